@@ -7,25 +7,105 @@
 #### Get report of current problems:
 ####  python3 apply-globally.py --input /tmp/jalphed-vocab-list.json  --template ./manual-glossary.template.html --output /tmp/glossary.html
 ####
+#### Both glossaries from one load of the data:
+####  python3 apply-globally.py --input /tmp/jalphed-vocab-list.json --template manual-glossary.template.html --output /tmp/glossary.html --template word-glossary.template.html --output /tmp/word-glossary.html
+####
+#### Stream the rendered glossary to its file a letter at a time (the
+#### input is still read whole):
+####  python3 apply-globally.py --stream --input /tmp/jalphed-vocab-list.json --template manual-glossary.template.html --output /tmp/glossary.html
+####
+#### One file per letter (/tmp/glossary-1.html, ...), indexed by /tmp/glossary.html:
+####  python3 apply-globally.py --shard --input /tmp/jalphed-vocab-list.json --template manual-glossary.template.html --output /tmp/glossary.html
+####
 
 import sys
 import argparse
 import logging
+import stagelog
 import csv
-import pystache
-import json
+import templates
+import intermediates
+import profiling
 import os
+import html
 
 ## Logger basic setup.
-logging.basicConfig(level=logging.INFO)
-LOGGER = logging.getLogger('apply-globally')
-LOGGER.setLevel(logging.WARNING)
+LOGGER = stagelog.get_logger('apply-globally')
 
 def die_screaming(string):
     """ Die and take our toys home. """
     LOGGER.error(string)
     sys.exit(1)
 
+def apply_template(data_list, template_filename, output_filename, template_cache=None):
+    """ Render a whole data list into a single output file. """
+
+    output_template = templates.load_template(template_filename, template_cache)
+
+    ## Dump out
+    LOGGER.info('%s', stagelog.lazy_json(data_list))
+    rendered = templates.render(output_template, {"all": data_list})
+    with open(output_filename, 'w') as output:
+        output.write(rendered)
+
+def split_template(template_filename, template_cache=None):
+    """ Return the (head, letter section, tail) parts of a glossary template. """
+    output_template = templates.load_template(template_filename, template_cache)
+    parts = templates.split_section(output_template, "all")
+    if parts is None:
+        die_screaming('need a template with a top-level "all" section to stream: ' + template_filename)
+    return parts
+
+def stream_template(data_list, template_filename, output_filename, template_cache=None):
+    """ Render a data list into a single output file, a letter at a time.
+
+    The same output as apply_template(), without ever holding all of
+    the rendered output in memory; the data list itself is still loaded
+    whole.
+    """
+    head, section, tail = split_template(template_filename, template_cache)
+    context = {"all": data_list}
+    with open(output_filename, 'w') as output:
+        output.write(templates.render(head, context))
+        for item in data_list:
+            LOGGER.info('Rendering letter: %s', item.get("letter"))
+            output.write(templates.render(section, context, item))
+        output.write(templates.render(tail, context))
+
+def shard_filename(output_filename, n):
+    """ The file the nth letter is written to when sharding (*-1.html, etc.). """
+    stem, extension = os.path.splitext(output_filename)
+    return stem + "-" + str(n) + extension
+
+def shard_template(data_list, template_filename, output_filename, template_cache=None):
+    """ Render each letter to its own file, with an index page at output_filename. """
+    head, section, tail = split_template(template_filename, template_cache)
+    index = ['<html lang="ja">', '  <head>', '    <meta charset="UTF-8">', '  </head>', '  <body>', '    <ul>']
+    for n, item in enumerate(data_list, 1):
+        filename = shard_filename(output_filename, n)
+        context = {"all": [item]}
+        LOGGER.info('Rendering letter %s to: %s', item.get("letter"), filename)
+        with open(filename, 'w') as output:
+            output.write(templates.render(head, context))
+            output.write(templates.render(section, context, item))
+            output.write(templates.render(tail, context))
+        index.append('      <li><a href="' + html.escape(os.path.basename(filename)) + '">' +
+                     html.escape(str(item.get("letter"))) + '</a> (' + str(len(item.get("data", []))) + ')</li>')
+    index.extend(['    </ul>', '  </body>', '</html>'])
+    with open(output_filename, 'w') as output:
+        output.write('\n'.join(index) + '\n')
+
+def apply_templates(data_list, pairs, template_cache=None, stream=False, shard=False):
+    """ Render one loaded data list with each (template, output file) pair. """
+    for template_filename, output_filename in pairs:
+        LOGGER.info('Rendering %s to: %s', template_filename, output_filename)
+        if shard:
+            shard_template(data_list, template_filename, output_filename, template_cache)
+        elif stream:
+            stream_template(data_list, template_filename, output_filename, template_cache)
+        else:
+            apply_template(data_list, template_filename, output_filename, template_cache)
+
 def main():
 
     ## Deal with incoming.
@@ -36,10 +116,17 @@ def main():
                         help='More verbose output')
     parser.add_argument('-i', '--input',
                         help='The file to use as input')
-    parser.add_argument('-t', '--template',
-                        help='The output template to use')
-    parser.add_argument('-o', '--output',
-                        help='The file to output to')
+    parser.add_argument('-t', '--template', action='append', default=[],
+                        help='The output template to use; may be repeated, pairing with each --output')
+    parser.add_argument('-c', '--template-cache',
+                        help='[optional] A directory to cache parsed templates in')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='[optional] Render and write a letter at a time, instead of all at once (the input is still read whole)')
+    parser.add_argument('-l', '--shard', action='store_true',
+                        help='[optional] Write each letter to its own file (*-1.html, etc.), with an index page as the output')
+    parser.add_argument('-o', '--output', action='append', default=[],
+                        help='The file to output to; may be repeated, pairing with each --template')
+    profiling.add_arguments(parser)
     args = parser.parse_args()
 
     ## Up the verbosity level if we want.
@@ -50,30 +137,28 @@ def main():
     ## Ensure arguments and read in what is necessary.
     if not args.input:
         die_screaming('need an input argument')
-    LOGGER.info('Will input from: ' + args.input)
+    LOGGER.info('Will input from: %s', args.input)
 
     if not args.template:
         die_screaming('need a template argument for the output')
-    output_template = None
-    with open(args.template) as fhandle:
-        output_template = fhandle.read()
-    LOGGER.info('Will use: ' + args.template + ' as the output formatter')
+    for template_filename in args.template:
+        LOGGER.info('Will use: %s as an output formatter', template_filename)
 
     if not args.output:
         die_screaming('need an output file argument')
-    LOGGER.info('Will output to file: ' + args.output)
+    if not len(args.output) == len(args.template):
+        die_screaming('need one output argument for each template argument')
+    for output_filename in args.output:
+        LOGGER.info('Will output to file: %s', output_filename)
 
     ## Bring data in.
-    data_list = []
-    with open(args.input, 'r') as json_in_f:
-        data_list = json.load(json_in_f)
+    data_list = intermediates.read(args.input)
+    profiling.checkpoint()
 
-    ## Dump out
-    LOGGER.info(json.dumps(data_list, indent = 4))
-    rendered = pystache.render(output_template, {"all": data_list})
-    with open(args.output, 'w') as output:
-        output.write(rendered)
+    ## Render every output from the one loaded data list.
+    apply_templates(data_list, list(zip(args.template, args.output)), args.template_cache,
+                    stream=args.stream, shard=args.shard)
 
 ## You saw it coming...
 if __name__ == '__main__':
-    main()
+    profiling.run(main)
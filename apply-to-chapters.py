@@ -7,25 +7,276 @@
 #### Get report of current problems:
 ####  python3 apply-to-chapters.py --input /tmp/chapters.json --template ./word-html-frame.template.html --output /tmp/chapter
 ####
+#### Render the chapters in parallel:
+####  python3 apply-to-chapters.py --jobs 8 --input /tmp/binned-kanji.json --template manual-html-kanji-details.template.html --output /tmp/kh-ch
+####
+#### Only rebuild changed chapters, removing those gone from the data (see
+#### what would be rebuilt or removed with --dry-run):
+####  python3 apply-to-chapters.py --incremental --input /tmp/chapters.json --template ./word-html-frame.template.html --output /tmp/chapter
+####
+#### Ship the chapters with just the stroke images they use (in /tmp/kh/strokes/):
+####  python3 apply-to-chapters.py --export --input /tmp/binned-kanji.json --template manual-html-kanji-details.template.html --output /tmp/kh/kh-ch
+####
+#### Several templates from one load of the data:
+####  python3 apply-to-chapters.py --input /tmp/chapters.json --template word-html-vocab-list.template.html --output /tmp/chapter --template ./word-html-frame.template.html --output /tmp/frame-chapter
+####
 
 import sys
 import argparse
 import logging
+import stagelog
 import csv
-import pystache
+import templates
+import chunked
 import json
+import intermediates
+import profiling
 import os
+import concurrent.futures
+import hashlib
+import shutil
 
 ## Logger basic setup.
-logging.basicConfig(level=logging.INFO)
-LOGGER = logging.getLogger('parse')
-LOGGER.setLevel(logging.WARNING)
+LOGGER = stagelog.get_logger('apply-to-chapters')
+
+## Where exported stroke images go, beside the chapter files.
+ASSETS_DIRECTORY = 'strokes'
 
 def die_screaming(string):
     """ Die and take our toys home. """
     LOGGER.error(string)
     sys.exit(1)
 
+def chapter_filename(output_pattern, chapter, output_extension):
+    """ The file a chapter is written to (*-1.html, etc.). """
+    return output_pattern + "-" + str(chapter) + output_extension
+
+def render_chapter(item, output_template, output_pattern, output_extension):
+    """ Render a single binned chapter and write it to its file. """
+    chapter = str(item["chapter"])
+    data = item["data"]
+
+    ## Write everything out in our given format.
+    LOGGER.info('%s', stagelog.lazy_json(data), chapter=chapter)
+    ## Anything an asset stage added to the chapter (say,
+    ## "stroke-symbols") is available to the template too.
+    context = {k: v for k, v in item.items() if k not in ["chapter", "data"]}
+    context["data"] = data
+    rendered = templates.render(output_template, context)
+    with open(chapter_filename(output_pattern, chapter, output_extension), 'w') as output:
+        output.write(rendered)
+
+## The parsed template for the pool workers, set once per worker.
+_WORKER_TEMPLATE = None
+
+def _init_worker(output_template):
+    """ Pool initializer; keep the parsed template around. """
+    global _WORKER_TEMPLATE
+    _WORKER_TEMPLATE = output_template
+
+def _render_chapter_job(item, output_pattern, output_extension):
+    """ Pool job; return a failure string for the chapter, or None. """
+    try:
+        render_chapter(item, _WORKER_TEMPLATE, output_pattern, output_extension)
+    except Exception as e:
+        return type(e).__name__ + ': ' + str(e)
+    return None
+
+def render_chapters(data_list, output_template, output_pattern, output_extension, jobs=1):
+    """ Render and write the given chapters, optionally in parallel. """
+
+    ## Dump out, one at a time.
+    if not jobs or jobs <= 1:
+        for item in data_list:
+            render_chapter(item, output_template, output_pattern, output_extension)
+        return
+
+    ## Dump out, with the chapters spread over a pool of workers
+    ## that each write their own files.
+    failures = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                mp_context=chunked.pool_context(),
+                                                initializer=_init_worker,
+                                                initargs=(output_template,)) as pool:
+        futures = {}
+        for item in data_list:
+            future = pool.submit(_render_chapter_job, item, output_pattern, output_extension)
+            futures[future] = str(item["chapter"])
+        for future in concurrent.futures.as_completed(futures):
+            chapter = futures[future]
+            try:
+                failure = future.result()
+            except Exception as e:
+                failure = type(e).__name__ + ': ' + str(e)
+            if failure:
+                LOGGER.error('failed to render chapter %s: %s', chapter, failure, chapter=chapter)
+                failures.append(chapter)
+            else:
+                LOGGER.info('Rendered chapter: %s', chapter, chapter=chapter)
+    if failures:
+        die_screaming('failed to render chapter(s): ' + ', '.join(sorted(failures, key=int)))
+
+def manifest_filename(output_pattern):
+    """ The file that the incremental chapter hashes are kept in. """
+    return output_pattern + "-manifest.json"
+
+def chapter_hash(item, template_text):
+    """ Hash a chapter's binned data together with its template. """
+    digest = hashlib.sha256()
+    digest.update(templates.content_hash(template_text).encode('utf-8'))
+    digest.update(json.dumps(item, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def read_manifest(filename):
+    """ Return the chapter hashes of the last run, if any. """
+    try:
+        with open(filename, 'r') as manifest_in:
+            return json.load(manifest_in).get("chapters", {})
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        LOGGER.warning('Ignoring unreadable manifest: %s', filename)
+        return {}
+
+def _asset_name(filename, digests):
+    """ The content-addressed name of a file (hashed once per run), or None if missing. """
+    if filename not in digests:
+        try:
+            with open(filename, 'rb') as asset:
+                digests[filename] = hashlib.sha256(asset.read()).hexdigest()[:32]
+        except OSError:
+            digests[filename] = None
+    if digests[filename] is None:
+        return None
+    return digests[filename] + os.path.splitext(filename)[1]
+
+def _place_asset(source, destination):
+    """ Hardlink (or else copy) source to destination; return how. """
+    if os.path.exists(destination):
+        return "skipped"
+    tmp_filename = destination + '.' + str(os.getpid()) + '.tmp'
+    try:
+        os.link(source, tmp_filename)
+        how = "linked"
+    except OSError:
+        shutil.copyfile(source, tmp_filename)
+        how = "copied"
+    os.replace(tmp_filename, destination)
+    return how
+
+def export_assets(data_list, output_pattern, dry_run=False):
+    """ Copy the stroke images the chapters link to next to them.
+
+    Images go in a "strokes" directory beside the chapter files, named
+    by content hash; existing ones are skipped, new ones hardlinked
+    where possible. Return a copy of the data list that links to them.
+    """
+    output_dir = os.path.dirname(output_pattern)
+    assets_dir = os.path.join(output_dir, ASSETS_DIRECTORY)
+    if not dry_run:
+        os.makedirs(assets_dir, exist_ok=True)
+    digests = {}
+    counts = {"linked": 0, "copied": 0, "skipped": 0}
+    exported_list = []
+    for item in data_list:
+        exported_sections = []
+        for section in item["data"]:
+            exported_records = []
+            for record in section["sections"]:
+                ## Sprited strokes are not linked to at all.
+                if "kanji-strokes-base" not in record or record.get("kanji-strokes-sprites"):
+                    exported_records.append(record)
+                    continue
+                base = str(record["kanji-strokes-base"])
+                exported = dict(record)
+                for list_key in ["kanji-strokes-list", "kanji-strokes-list-manual"]:
+                    names = [_asset_name(base + f, digests) for f in record.get(list_key, [])]
+                    if None in names:
+                        LOGGER.warning('Missing stroke images for kanji %s; keeping absolute links', record.get("kanji-raw"),
+                                       chapter=item["chapter"], row=record.get("row"))
+                        exported = record
+                        break
+                    if not dry_run:
+                        for f, name in zip(record.get(list_key, []), names):
+                            counts[_place_asset(base + f, os.path.join(assets_dir, name))] += 1
+                    exported[list_key] = names
+                if exported is not record:
+                    exported["kanji-strokes-href-base"] = ASSETS_DIRECTORY + '/'
+                exported_records.append(exported)
+            exported_sections.append(dict(section, sections=exported_records))
+        exported_list.append(dict(item, data=exported_sections))
+    LOGGER.info('Stroke images: %d linked, %d copied, %d already there', counts["linked"], counts["copied"], counts["skipped"])
+    return exported_list
+
+def apply_template(data_list, template_filename, output_pattern, template_cache=None, jobs=1, incremental=False, dry_run=False, export=False):
+    """ Render each chapter of a binned data list to its own file.
+
+    When incremental, only chapters whose data or template changed
+    since the last incremental run (or whose file is missing) are
+    rendered, and the files of chapters no longer in the data are
+    removed. When dry_run, report what would be rendered (and removed)
+    and stop. When export, the stroke images are exported with the
+    chapters.
+    """
+
+    template_text = None
+    with open(template_filename) as fhandle:
+        template_text = fhandle.read()
+    output_template = templates.parse_template(template_text, template_cache)
+
+    output_extension = os.path.splitext(template_filename)[1]
+    if not output_extension:
+        die_screaming('need a template with an output extension')
+    LOGGER.info('Will use: %s as the output extension', output_extension)
+
+    if export:
+        data_list = export_assets(data_list, output_pattern, dry_run)
+
+    ## Figure out which chapters need to be (re)built.
+    stale_list = data_list
+    hashes = {}
+    gone_list = []
+    if incremental:
+        old_hashes = read_manifest(manifest_filename(output_pattern))
+        stale_list = []
+        for item in data_list:
+            chapter = str(item["chapter"])
+            hashes[chapter] = chapter_hash(item, template_text)
+            if not hashes[chapter] == old_hashes.get(chapter) or \
+               not os.path.exists(chapter_filename(output_pattern, chapter, output_extension)):
+                stale_list.append(item)
+        LOGGER.info('Chapters to rebuild: %d of %d', len(stale_list), len(data_list))
+
+        ## Chapters that were rendered last time, but are gone now.
+        gone_list = [chapter_filename(output_pattern, chapter, output_extension)
+                     for chapter in old_hashes.keys() if chapter not in hashes]
+        gone_list = [filename for filename in gone_list if os.path.exists(filename)]
+
+    if dry_run:
+        for item in stale_list:
+            print(chapter_filename(output_pattern, item["chapter"], output_extension))
+        for filename in gone_list:
+            LOGGER.warning('Would remove chapter no longer in the data: %s', filename)
+        return
+
+    render_chapters(stale_list, output_template, output_pattern, output_extension, jobs)
+    for filename in gone_list:
+        LOGGER.warning('Removing chapter no longer in the data: %s', filename)
+        os.remove(filename)
+
+    ## Only record hashes once everything was written.
+    if incremental:
+        with open(manifest_filename(output_pattern), 'w') as output:
+            output.write(json.dumps({"template": template_filename,
+                                     "chapters": hashes}, indent = 4))
+
+def apply_templates(data_list, pairs, template_cache=None, jobs=1, incremental=False, dry_run=False, export=False):
+    """ Render one loaded data list with each (template, output pattern) pair. """
+    for template_filename, output_pattern in pairs:
+        LOGGER.info('Rendering %s to pattern: %s', template_filename, output_pattern)
+        apply_template(data_list, template_filename, output_pattern, template_cache, jobs,
+                       incremental=incremental, dry_run=dry_run, export=export)
+
 def main():
 
     ## Deal with incoming.
@@ -36,10 +287,21 @@ def main():
                         help='More verbose output')
     parser.add_argument('-i', '--input',
                         help='The file to use as input')
-    parser.add_argument('-t', '--template',
-                        help='The output template to use')
-    parser.add_argument('-o', '--output',
-                        help='The file pattern to output to (*-1.html, etc.)')
+    parser.add_argument('-t', '--template', action='append', default=[],
+                        help='The output template to use; may be repeated, pairing with each --output')
+    parser.add_argument('-c', '--template-cache',
+                        help='[optional] A directory to cache parsed templates in')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='[optional] The number of chapters to render in parallel')
+    parser.add_argument('-n', '--incremental', action='store_true',
+                        help='[optional] Only rebuild chapters whose data or template changed, and remove those gone from the data')
+    parser.add_argument('-d', '--dry-run', action='store_true',
+                        help='[optional] Only list the chapter files that would be (re)built')
+    parser.add_argument('-x', '--export', action='store_true',
+                        help='[optional] Copy the stroke images used into a "' + ASSETS_DIRECTORY + '" directory beside the chapters and link to those')
+    parser.add_argument('-o', '--output', action='append', default=[],
+                        help='The file pattern to output to (*-1.html, etc.); may be repeated, pairing with each --template')
+    profiling.add_arguments(parser)
     args = parser.parse_args()
 
     ## Up the verbosity level if we want.
@@ -50,40 +312,30 @@ def main():
     ## Ensure arguments and read in what is necessary.
     if not args.input:
         die_screaming('need an input argument')
-    LOGGER.info('Will input from: ' + args.input)
+    LOGGER.info('Will input from: %s', args.input)
 
     if not args.template:
         die_screaming('need a template argument for the output')
-    output_template = None
-    with open(args.template) as fhandle:
-        output_template = fhandle.read()
-    LOGGER.info('Will use: ' + args.template + ' as the output formatter')
-
-    output_extension = os.path.splitext(args.template)[1]
-    if not output_extension:
-        die_screaming('need a template with an output extension')
-    LOGGER.info('Will use: ' + output_extension + ' as the output extension')
+    for template_filename in args.template:
+        LOGGER.info('Will use: %s as an output formatter', template_filename)
+        if not os.path.splitext(template_filename)[1]:
+            die_screaming('need a template with an output extension')
 
     if not args.output:
         die_screaming('need an output pattern argument')
-    LOGGER.info('Will output with pattern to: ' + args.output)
+    if not len(args.output) == len(args.template):
+        die_screaming('need one output argument for each template argument')
+    for output_pattern in args.output:
+        LOGGER.info('Will output with pattern to: %s', output_pattern)
 
     ## Bring data in.
-    data_list = []
-    with open(args.input, 'r') as json_in_f:
-        data_list = json.load(json_in_f)
-
-    ## Dump out
-    for item in data_list:
-        chapter = str(item["chapter"])
-        data = item["data"]
+    data_list = intermediates.read(args.input)
+    profiling.checkpoint()
 
-        ## Write everything out in our given format.
-        LOGGER.info(json.dumps(data, indent = 4))
-        rendered = pystache.render(output_template, {"data": data})
-        with open(args.output + "-" + str(chapter) + output_extension, 'w') as output:
-            output.write(rendered)
+    ## Render every output from the one loaded data list.
+    apply_templates(data_list, list(zip(args.template, args.output)), args.template_cache, args.jobs,
+                    incremental=args.incremental, dry_run=args.dry_run, export=args.export)
 
 ## You saw it coming...
 if __name__ == '__main__':
-    main()
+    profiling.run(main)
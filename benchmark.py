@@ -0,0 +1,366 @@
+####
+#### Time every pipeline stage script over deterministic synthetic data.
+####
+#### Valid TSVs are generated in all three documented formats (vocab
+#### list, kanji list and kanji details), with ruby, sections and W/R
+#### runs, and each stage is run as its own process over the output of
+#### the one before. The wall time, rows/sec and peak memory of every
+#### run are appended to a results file, along with the commit, so
+#### that runs can be compared across commits.
+####
+#### Example usage to analyze the usual suspects:
+####  python3 benchmark.py --help
+####
+#### Benchmark everything at 1k rows:
+####  python3 benchmark.py --sizes 1k --results /tmp/benchmark-results.jsonl
+####
+#### The full 1k, 100k and 1M row run, keeping the generated files:
+####  python3 benchmark.py --workdir /tmp/bench --results /tmp/benchmark-results.jsonl
+####
+#### Compare the recorded runs, commit by commit:
+####  python3 benchmark.py --compare --results /tmp/benchmark-results.jsonl
+####
+#### Only generate the synthetic TSVs:
+####  python3 benchmark.py --sizes 100k --generate-only --workdir /tmp/bench
+####
+
+import sys
+import argparse
+import logging
+import stagelog
+import json
+import kaindex
+import os
+import random
+import subprocess
+import tempfile
+import time
+import platform
+import datetime
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('benchmark')
+
+## The directory that the stage scripts live in.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+## Named sizes, in rows.
+SIZES = {"1k": 1000, "100k": 100000, "1M": 1000000}
+
+## How many chapters the generated rows are spread over.
+CHAPTERS = 15
+
+## The header lines of the three TSV formats.
+VOCAB_HEADER = ["Level", "Chapter", "Japanese", "Ruby", "Reading", "Meaning", "Section", "Extra", "Grammar Point", "Notes"]
+KANJI_LIST_HEADER = ["Level", "Chapter", "W/R", "Kanji", "Hiragana", "Introduced", "New Kanji", "New Reading", "Meaning", "Section", "L. #W/R", "Notes"]
+KANJI_DETAILS_HEADER = ["Level", "Chapter", "W/R", "Kanji", "Reading", "Highlighted Reading", "Meaning", "Radical", "Radical  Meaning", "Radical Example", "Radical Example Notes", "Example Word", "Highlighted Example Word", "Stroke Order"]
+
+## Building blocks for the generated words, as (kanji, reading, meaning).
+WORDS = [("雑煮", "ぞうに", "mochi soup"),
+         ("正月", "しょうがつ", "new year"),
+         ("土井", "どい", "Doi"),
+         ("読", "よ", "read"),
+         ("書", "か", "write"),
+         ("酔", "よ", "get drunk"),
+         ("大阪", "おおさか", "Osaka"),
+         ("井戸", "いど", "well"),
+         ("天井", "てんじょう", "ceiling"),
+         ("一年", "いちねん", "one year"),
+         ("何", "なに", "what"),
+         ("会話", "かいわ", "conversation"),
+         ("漢字", "かんじ", "kanji"),
+         ("先生", "せんせい", "teacher"),
+         ("学生", "がくせい", "student")]
+KANA = ["あ", "い", "う", "え", "お", "か", "き", "く", "け", "こ",
+        "さ", "し", "す", "せ", "そ", "た", "ち", "つ", "て", "と",
+        "な", "に", "ぬ", "ね", "の", "は", "ひ", "ふ", "へ", "ほ",
+        "ま", "み", "む", "め", "も", "や", "ゆ", "よ", "ら", "り",
+        "る", "れ", "ろ", "わ", "ん", "が", "ぎ", "ぐ", "ざ", "だ",
+        "ば", "ぱ", "ア", "カ", "サ", "タ", "ナ", "ハ", "マ", "ラ"]
+
+## The vocab sections, in the order chapter-bin.py wants them.
+VOCAB_SECTIONS = ["", "読み物　一", "会話　一", "読み物　二", "会話　二", "読み物　三", "会話　三", "読み物　四", "会話　四"]
+
+def die_screaming(string):
+    """ Die and take our toys home. """
+    LOGGER.error(string)
+    sys.exit(1)
+
+def size_rows(size):
+    """ Turn a size like "100k" (or "2500") into a row count. """
+    if size in SIZES:
+        return SIZES[size]
+    try:
+        return int(size)
+    except ValueError:
+        die_screaming('unknown size: ' + size)
+
+def _layout(count):
+    """ Yield (chapter, position in chapter, rows in chapter) for count rows. """
+    per_chapter, extra = divmod(count, CHAPTERS)
+    for c in range(CHAPTERS):
+        chapter_rows = per_chapter + (1 if c < extra else 0)
+        for n in range(chapter_rows):
+            yield c + 1, n, chapter_rows
+
+def _kana(rng, length):
+    return ''.join(rng.choice(KANA) for n in range(length))
+
+def vocab_rows(count, seed=0):
+    """ Yield count valid vocab list rows, ten columns each. """
+    rng = random.Random(seed)
+    for chapter, n, chapter_rows in _layout(count):
+        section = VOCAB_SECTIONS[n * len(VOCAB_SECTIONS) // chapter_rows]
+        japanese = []
+        ruby = []
+        reading = []
+        meaning = []
+        for w in range(rng.randint(1, 3)):
+            if rng.random() < 0.2:
+                kana = _kana(rng, rng.randint(2, 4))
+                japanese.append(kana)
+                reading.append(kana)
+                continue
+            kanji, kanji_reading, kanji_meaning = rng.choice(WORDS)
+            okurigana = _kana(rng, rng.randint(0, 2))
+            japanese.append(kanji + okurigana)
+            ruby.append(kanji + '|' + kanji_reading)
+            reading.append(kanji_reading + okurigana)
+            meaning.append(kanji_meaning)
+        yield ["6", str(chapter), ''.join(japanese), ', '.join(ruby), ''.join(reading),
+               ' '.join(meaning) or 'kana word', section,
+               '*' if rng.random() < 0.1 else '',
+               'gp' if rng.random() < 0.05 else '',
+               'note' if rng.random() < 0.05 else '']
+
+def kanji_list_rows(count, seed=0):
+    """ Yield count valid kanji list rows, twelve columns each. """
+    rng = random.Random(seed)
+    for chapter, n, chapter_rows in _layout(count):
+        ## All the W rows of a chapter, then all the R rows.
+        read_write = "W" if n < chapter_rows // 2 else "R"
+        kanji, reading, meaning = rng.choice(WORDS)
+        introduced = kanji[:rng.randint(0, len(kanji))]
+        new_start = rng.randrange(len(kanji))
+        new_kanji = kanji[new_start]
+        new_reading = reading[:rng.randint(1, len(reading))]
+        okurigana = _kana(rng, rng.randint(0, 1))
+        yield ["6", str(chapter), read_write, kanji + okurigana, reading + okurigana,
+               introduced, new_kanji, new_reading, meaning,
+               '読' + str(chapter % 4 + 1) if rng.random() < 0.7 else '',
+               '', 'n' if rng.random() < 0.05 else '']
+
+def kanji_details_rows(count, kanji_pool, seed=0):
+    """ Yield count valid kanji details rows, fourteen columns each.
+
+    Kanji are drawn from kanji_pool, which should be kanji known to
+    the kanjialive data.
+    """
+    rng = random.Random(seed)
+    for chapter, n, chapter_rows in _layout(count):
+        read_write = "W" if n < chapter_rows // 2 else "R"
+        kanji = rng.choice(kanji_pool)
+        readings = [_kana(rng, rng.randint(1, 3)) for r in range(rng.randint(1, 3))]
+        examples = []
+        for e in range(rng.randint(1, 3)):
+            word, word_reading, word_meaning = rng.choice(WORDS)
+            examples.append(kanji + word + '+' + word_reading + '+' + word_meaning)
+        yield ["6", str(chapter), read_write, kanji,
+               ', '.join(readings), rng.choice(readings) if rng.random() < 0.7 else '',
+               '+'.join(rng.choice(WORDS)[2] for m in range(rng.randint(1, 2))),
+               rng.choice(kanji_pool), 'meaning' if rng.random() < 0.7 else '',
+               ', '.join(rng.choice(kanji_pool) for r in range(rng.randint(1, 3))),
+               'note' if rng.random() < 0.1 else '',
+               '|'.join(examples), rng.choice(examples), '']
+
+def write_tsv(tsv_filename, header, rows):
+    """ Write a header and rows out as a TSV; return the row count. """
+    count = 0
+    with open(tsv_filename, 'w') as output:
+        output.write('\t'.join(header) + '\n')
+        for row in rows:
+            output.write('\t'.join(row) + '\n')
+            count = count + 1
+    return count
+
+def tsv_filenames(workdir):
+    """ Where the three synthetic TSVs go in a directory. """
+    return {"vocab": os.path.join(workdir, 'vocab-list.tsv'),
+            "kanji-list": os.path.join(workdir, 'kanji-list.tsv'),
+            "kanji-details": os.path.join(workdir, 'kanji-details.tsv')}
+
+def generate(workdir, count, repo, seed=0):
+    """ Write the three synthetic TSVs for count rows; return their names. """
+    kanji_pool = sorted(kaindex.load_index(repo + '/kanjialive/ka_data.csv'))
+    tsvs = tsv_filenames(workdir)
+    write_tsv(tsvs["vocab"], VOCAB_HEADER, vocab_rows(count, seed))
+    write_tsv(tsvs["kanji-list"], KANJI_LIST_HEADER, kanji_list_rows(count, seed))
+    write_tsv(tsvs["kanji-details"], KANJI_DETAILS_HEADER, kanji_details_rows(count, kanji_pool, seed))
+    return tsvs
+
+def stage_runs(workdir, tsvs, repo):
+    """ The stage runs to time, in order, as (label, script, arguments). """
+    def w(name):
+        return os.path.join(workdir, name)
+    return [
+        ("parse-vocab-list", "parse-vocab-list.py", ["--tsv", tsvs["vocab"], "--output", w('parsed-vocab-list.json')]),
+        ("chapter-bin vocab-list", "chapter-bin.py", ["--pattern", "vocab-list", "--input", w('parsed-vocab-list.json'), "--output", w('chapters-vocab-list.json')]),
+        ("apply-to-chapters vocab-list", "apply-to-chapters.py", ["--input", w('chapters-vocab-list.json'), "--template", "word-html-vocab-list.template.html", "--output", w('ch-vocab-list')]),
+        ("jalphabetical-bin vocab-list", "jalphabetical-bin.py", ["--pattern", "vocab-list", "--input", w('parsed-vocab-list.json'), "--output", w('jalphed-vocab-list.json')]),
+        ("apply-globally glossary", "apply-globally.py", ["--input", w('jalphed-vocab-list.json'), "--template", "manual-glossary.template.html", "--output", w('glossary.html')]),
+        ("parse-kanji-list", "parse-kanji-list.py", ["--tsv", tsvs["kanji-list"], "--output", w('parsed-kanji-list.json')]),
+        ("chapter-bin kanji-list", "chapter-bin.py", ["--pattern", "kanji-list", "--input", w('parsed-kanji-list.json'), "--output", w('chapters-kanji-list.json')]),
+        ("apply-to-chapters kanji-list", "apply-to-chapters.py", ["--input", w('chapters-kanji-list.json'), "--template", "manual-html-kanji-list.template.html", "--output", w('ch-kanji-list')]),
+        ("parse-kanji-details", "parse-kanji-details.py", ["--tsv", tsvs["kanji-details"], "--repo", repo, "--output", w('parsed-kanji-details.json')]),
+        ("chapter-bin kanji-details", "chapter-bin.py", ["--pattern", "kanji-details", "--input", w('parsed-kanji-details.json'), "--output", w('chapters-kanji-details.json')]),
+        ("apply-to-chapters kanji-details", "apply-to-chapters.py", ["--input", w('chapters-kanji-details.json'), "--template", "manual-html-kanji-details.template.html", "--output", w('ch-kanji-details')]),
+    ]
+
+def time_stage(script, arguments, log_filename):
+    """ Run a stage script to completion; return (seconds, peak KiB). """
+    command = [sys.executable, os.path.join(SCRIPT_DIR, script)] + arguments
+    with open(log_filename, 'ab') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, stderr=log)
+        ## wait4() gives the resource usage of this child alone.
+        pid, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    ## Keep subprocess from trying to reap it again.
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        die_screaming('stage failed (' + str(process.returncode) + '), see ' + log_filename + ': ' + ' '.join(command))
+    return seconds, usage.ru_maxrss
+
+def current_commit():
+    """ The commit being benchmarked, if we can tell. """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(sizes, workdir, repo, results_filename, seed=0):
+    """ Generate, run and record every stage at every size. """
+    commit = current_commit()
+    started = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+    for size in sizes:
+        count = size_rows(size)
+        size_dir = os.path.join(workdir, size)
+        os.makedirs(size_dir, exist_ok=True)
+        LOGGER.info('Generating %d rows in: %s', count, size_dir)
+        ## Generated in a child, so that our own peak memory does
+        ## not leak into the stages' (forked children start with it).
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--generate-only', '--sizes', size,
+                        '--workdir', workdir, '--repo', repo, '--seed', str(seed)],
+                       stdout=subprocess.DEVNULL, check=True)
+        tsvs = tsv_filenames(size_dir)
+        log_filename = os.path.join(size_dir, 'stages.log')
+        for label, script, arguments in stage_runs(size_dir, tsvs, repo):
+            seconds, peak_kib = time_stage(script, arguments, log_filename)
+            result = {"commit": commit, "started": started, "python": platform.python_version(),
+                      "size": size, "rows": count, "stage": label,
+                      "seconds": round(seconds, 4), "rows-per-second": round(count / seconds, 1),
+                      "peak-kib": peak_kib}
+            with open(results_filename, 'a') as results:
+                results.write(json.dumps(result) + '\n')
+            print(size.rjust(6) + '  ' + label.ljust(34) + ('%10.3fs' % seconds) +
+                  ('%14.1f rows/s' % (count / seconds)) + ('%10d KiB' % peak_kib))
+
+def compare(results_filename):
+    """ Print rows/sec per stage and size for each recorded commit. """
+    runs = {}
+    commits = []
+    with open(results_filename) as results:
+        for line in results:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            commit = str(result["commit"])
+            if commit not in commits:
+                commits.append(commit)
+            ## Later runs of the same commit win.
+            runs[(result["size"], result["stage"], commit)] = result
+    keys = []
+    for size, stage, commit in runs.keys():
+        if (size, stage) not in keys:
+            keys.append((size, stage))
+    print('size'.rjust(6) + '  ' + 'stage'.ljust(34) + ''.join(c.rjust(14) for c in commits))
+    for size, stage in keys:
+        cells = []
+        for commit in commits:
+            result = runs.get((size, stage, commit))
+            cells.append(('%.1f' % result["rows-per-second"]) if result else '-')
+        print(size.rjust(6) + '  ' + stage.ljust(34) + ''.join(c.rjust(14) for c in cells))
+
+def main():
+
+    ## Deal with incoming.
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='More verbose output')
+    parser.add_argument('-s', '--sizes', default='1k,100k,1M',
+                        help='[optional] Comma-separated sizes to run: 1k, 100k, 1M or a row count (default all three)')
+    parser.add_argument('-r', '--repo',
+                        help='[optional] The path to this repo')
+    parser.add_argument('-w', '--workdir',
+                        help='[optional] A directory to generate and keep files in (default a temporary one, removed afterwards; needed with --generate-only)')
+    parser.add_argument('-e', '--seed', type=int, default=0,
+                        help='[optional] The seed for the synthetic data')
+    parser.add_argument('-g', '--generate-only', action='store_true',
+                        help='[optional] Only generate the synthetic TSVs')
+    parser.add_argument('-c', '--compare', action='store_true',
+                        help='[optional] Compare the runs already in the results file')
+    parser.add_argument('-o', '--results',
+                        help='The JSON lines file to append results to (not needed with --generate-only)')
+    args = parser.parse_args()
+
+    ## Up the verbosity level if we want.
+    if args.verbose:
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.info('Verbose: on')
+
+    if not args.results and not args.generate_only:
+        die_screaming('need a results file argument')
+
+    if args.compare:
+        if not os.path.exists(args.results):
+            die_screaming('no results file at: ' + args.results)
+        compare(args.results)
+        return
+
+    if not args.repo:
+        args.repo = os.getcwd()
+    args.repo = os.path.abspath(args.repo)
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    for size in sizes:
+        size_rows(size)
+
+    if args.generate_only:
+        if not args.workdir:
+            die_screaming('need a workdir argument to keep the generated files in')
+        workdir = os.path.abspath(args.workdir)
+        LOGGER.info('Will work in: %s', workdir)
+        for size in sizes:
+            size_dir = os.path.join(workdir, size)
+            os.makedirs(size_dir, exist_ok=True)
+            for name, tsv_filename in generate(size_dir, size_rows(size), args.repo, args.seed).items():
+                print(tsv_filename)
+        return
+
+    LOGGER.info('Will append results to: %s', args.results)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        workdir = os.path.abspath(args.workdir)
+        LOGGER.info('Will work in: %s', workdir)
+        benchmark(sizes, workdir, args.repo, os.path.abspath(args.results), args.seed)
+    else:
+        ## Nothing to keep; clean up after ourselves.
+        with tempfile.TemporaryDirectory(prefix='kanji-benchmark-') as workdir:
+            LOGGER.info('Will work in: %s', workdir)
+            benchmark(sizes, workdir, args.repo, os.path.abspath(args.results), args.seed)
+
+## You saw it coming...
+if __name__ == '__main__':
+    main()
@@ -8,22 +8,115 @@
 #### Get report of current problems and/or bin:
 ####  python3 chapter-bin.py --pattern vocab-list --input /tmp/input.json --output /tmp/output.json
 ####
+#### Bin from a corpus (see corpus.py):
+####  python3 chapter-bin.py --pattern vocab-list --corpus /tmp/corpus.sqlite --output /tmp/output.json
+####
 
 import sys
 import argparse
 import logging
-import json
+import stagelog
+import intermediates
+import profiling
+import corpus
 
 ## Logger basic setup.
-logging.basicConfig(level=logging.INFO)
-LOGGER = logging.getLogger('chapter-bin')
-LOGGER.setLevel(logging.WARNING)
+LOGGER = stagelog.get_logger('chapter-bin')
+
+## The W/R that each kanji read/write header is for.
+READ_WRITE_HEADERS = {"書けなければいけない漢字": "W", "読めなければいけない漢字": "R"}
 
 def die_screaming(string):
     """ Die and take our toys home. """
     LOGGER.error(string)
     sys.exit(1)
 
+def ordering(pattern):
+    """ Return the chapter field, section field and section order of a pattern. """
+
+    ## Define the upper and lower sorting criteria.
+    if pattern == "vocab-list":
+        upper_set_field = "chapter"
+        section_field = "section"
+        section_field_order = [None, "読み物　一", "会話　一", "読み物　二", "会話　二", "読み物　三", "会話　三", "読み物　四", "会話　四"]
+    elif pattern == "kanji-list":
+        upper_set_field = "chapter"
+        section_field = "read-write-header"
+        section_field_order = ["書けなければいけない漢字", "読めなければいけない漢字"]
+    elif pattern == "kanji-details":
+        upper_set_field = "chapter"
+        section_field = "read-write-header"
+        section_field_order = ["書けなければいけない漢字", "読めなければいけない漢字"]
+    else:
+        die_screaming('unknown ordering pattern')
+    return upper_set_field, section_field, section_field_order
+
+def bin_data(data_list, pattern):
+    """ Bin a parsed data list into chapters and ordered sections. """
+
+    upper_set_field, section_field, section_field_order = ordering(pattern)
+
+    ## Sort the data into chapter and section sets in a single
+    ## pass.
+    upper_sets = {}
+    for item in data_list:
+        sections = upper_sets.setdefault(str(item[upper_set_field]), {})
+        sections.setdefault(item[section_field], []).append(item)
+
+    ## Manually add the sections in the order we want them to
+    ## appear in each chapter, cross-checking against what we have.
+    sectioned_upper_sets = []
+    for chi in sorted(upper_sets.keys(), key=int):
+        sections = upper_sets[chi]
+        unorderable = [str(x) for x in sections.keys() if x not in section_field_order]
+        if unorderable:
+            die_screaming('unorderable section header in chapter ' + chi + ': ' + ', '.join(unorderable))
+        LOGGER.info('Chapter %s sections: %s', chi,
+                    stagelog.lazy(lambda: ', '.join([str(x) for x in section_field_order if x in sections])),
+                    chapter=chi)
+
+        ## Prepare sections with(out) headers for final rendering as
+        ## separate tables in the chapter docs.
+        sectioned_data_list = []
+        for s in section_field_order:
+            if s in sections:
+                sectioned_data_list.append({"header": s, "sections": sections[s]})
+
+        sectioned_upper_sets.append({upper_set_field: str(chi), "data": sectioned_data_list})
+
+    return sectioned_upper_sets
+
+def bin_corpus(connection, pattern):
+    """ Bin the records of a pattern's kind in a corpus, a section at a time.
+
+    Each chapter section is one indexed query; the read/write headers
+    are found by their W/R.
+    """
+
+    upper_set_field, section_field, section_field_order = ordering(pattern)
+    if section_field == "section":
+        section_where = {s: {"section": s} for s in section_field_order}
+    else:
+        section_where = {s: {"read_write": READ_WRITE_HEADERS[s]} for s in section_field_order}
+
+    sectioned_upper_sets = []
+    for chi in sorted(corpus.distinct(connection, pattern, upper_set_field), key=int):
+        if section_field == "section":
+            unorderable = [str(x) for x in corpus.distinct(connection, pattern, section_field, chapter=chi)
+                           if x not in section_field_order]
+            if unorderable:
+                die_screaming('unorderable section header in chapter ' + chi + ': ' + ', '.join(unorderable))
+        sectioned_data_list = []
+        for s in section_field_order:
+            items = corpus.records(connection, pattern, chapter=chi, **section_where[s])
+            if items:
+                sectioned_data_list.append({"header": s, "sections": items})
+        LOGGER.info('Chapter %s sections: %s', chi,
+                    stagelog.lazy(lambda: ', '.join([str(x["header"]) for x in sectioned_data_list])), chapter=chi)
+        sectioned_upper_sets.append({upper_set_field: str(chi), "data": sectioned_data_list})
+
+    return sectioned_upper_sets
+
 def main():
 
     ## Deal with incoming.
@@ -34,10 +127,15 @@ def main():
                         help='More verbose output')
     parser.add_argument('-i', '--input',
                         help='The file to use as input')
+    parser.add_argument('-d', '--corpus',
+                        help='[optional] A corpus (see corpus.py) to bin the pattern\'s records from, instead of an input file')
     parser.add_argument('-p', '--pattern',
                         help='The input-specific pattern that we need to use to bin the output')
+    parser.add_argument('-f', '--format', choices=intermediates.FORMATS, default=intermediates.FORMATS[0],
+                        help='[optional] The output format: json (default), compact (unindented JSON) or binary')
     parser.add_argument('-o', '--output',
                         help='The file to output')
+    profiling.add_arguments(parser)
     args = parser.parse_args()
 
     ## Up the verbosity level if we want.
@@ -46,84 +144,33 @@ def main():
         LOGGER.info('Verbose: on')
 
     ## Ensure arguments and read in what is necessary.
-    if not args.input:
+    if not args.input and not args.corpus:
         die_screaming('need an input argument')
-    LOGGER.info('Will input from: ' + args.input)
+    LOGGER.info('Will input from: %s', args.input or args.corpus)
     if not args.pattern:
         die_screaming('need a pattern argument')
     if args.pattern not in ["kanji-list", "kanji-details", "vocab-list"]:
         die_screaming('pattern argument unknown')
-    LOGGER.info('Will input from: ' + args.input)
+    LOGGER.info('Will input from: %s', args.input or args.corpus)
     if not args.output:
         die_screaming('need an output argument')
-    LOGGER.info('Will output to: ' + args.output)
+    LOGGER.info('Will output to: %s', args.output)
 
-    ## Define the upper and lower sorting criteria.
-    if args.pattern == "vocab-list":
-        upper_set_field = "chapter"
-        section_field = "section"
-        section_field_order = [None, "読み物　一", "会話　一", "読み物　二", "会話　二", "読み物　三", "会話　三", "読み物　四", "会話　四"]
-    elif args.pattern == "kanji-list":
-        upper_set_field = "chapter"
-        section_field = "read-write-header"
-        section_field_order = ["書けなければいけない漢字", "読めなければいけない漢字"]
-    elif args.pattern == "kanji-details":
-        upper_set_field = "chapter"
-        section_field = "read-write-header"
-        section_field_order = ["書けなければいけない漢字", "読めなければいけない漢字"]
+    ## Bring data in and bin, or bin straight from the corpus.
+    if args.corpus:
+        connection = corpus.open_corpus(args.corpus)
+        total = corpus.count(connection, args.pattern)
+        sectioned_upper_sets = bin_corpus(connection, args.pattern)
     else:
-        die_screaming('unknown ordering pattern')
-
-    ## Bring data in.
-    data_list = []
-    with open(args.input, 'r') as json_in_f:
-        data_list = json.load(json_in_f)
-
-    ## Sort the data into the different chapter sets.
-    upper_sets = {}
-    for item in data_list:
-        chapter = str(item[upper_set_field])
-        #print(chapter)
-        if not chapter in upper_sets:
-            upper_sets[chapter] = []
-        upper_sets[chapter].append(item)
-    #print(", ".join(sorted(upper_sets.keys(), key=int)))
-
-    ## Loop over the different chapters to create the output.
-    sectioned_upper_sets = []
-    for chi in sorted(upper_sets.keys(), key=int):
-        data_list = upper_sets[chi]
-
-        ## Sort the upper/chapter sets into sections sets.
-        sections = {}
-        for item in data_list:
-            section = item[section_field]
-            if not section in sections:
-                sections[section] = []
-            sections[section].append(item)
-
-        ## Manually add the sections in the order we want them to
-        ## appear in the chapter.
-        ## Cross-check against what we have.
-        print(", ".join(sorted([str(x) for x in section_field_order])))
-        print(", ".join(sorted([str(x) for x in sections.keys()])))
-        if not set(sections.keys()).issubset(set(section_field_order)):
-            die_screaming('unorderable section header')
-
-        ## Prepare sections with(out) headers for final rendering as
-        ## separate tables in the chapter docs.
-        sectioned_data_list = []
-        for s in section_field_order:
-            if s in sections:
-                sectioned_data_list.append({"header": s, "sections": sections[s]})
-
-        sectioned_upper_sets.append({upper_set_field: str(chi), "data": sectioned_data_list})
+        data_list = intermediates.read(args.input)
+        total = len(data_list)
+        sectioned_upper_sets = bin_data(data_list, args.pattern)
+    profiling.checkpoint()
 
-        ## Write everything out.
-        print(json.dumps(sectioned_data_list, indent = 4))
-        with open(args.output, 'w') as output:
-            output.write(json.dumps(sectioned_upper_sets, indent = 4))
+    ## Write everything out, once.
+    intermediates.write(args.output, sectioned_upper_sets, args.format)
+    print('Binned ' + str(total) + ' items into ' + str(len(sectioned_upper_sets)) + ' chapters')
 
 ## You saw it coming...
 if __name__ == '__main__':
-    main()
+    profiling.run(main)
@@ -0,0 +1,73 @@
+####
+#### Shared pieces for the parse-* scripts' --check mode: validate a
+#### whole TSV without enriching it, and report every problem at once
+#### as JSON.
+####
+#### A report looks like:
+####  {"tsv": "/tmp/vocab-list.tsv", "format": "vocab-list", "rows": 1832,
+####   "problem-count": 1,
+####   "problems": [{"row": 12, "column": "meaning", "problem": "required",
+####                 "message": "missing required \"meaning\""}]}
+#### with "column" null for problems with the line as a whole. The
+#### kinds of problem are: columns, required, chapter, read-write,
+#### section, ruby, unknown-kanji and example-word.
+####
+#### Example usage:
+####  import checks
+####  def check_row(i, line, problems):
+####      checks.check_required(i, {"meaning": line[5]}, problems)
+####  checks.write_report(None, checks.check_tsv('/tmp/list.tsv', 'vocab-list', 10, check_row))
+####
+
+import sys
+import json
+import tsvrows
+
+def problem(row, column, kind, message):
+    """ One problem, as it appears in a report. """
+    return {"row": row, "column": column, "problem": kind, "message": message}
+
+def check_required(i, values, problems):
+    """ Add a problem for each required column (name -> value) that is empty. """
+    for column, value in values.items():
+        if not value:
+            problems.append(problem(i, column, "required", 'missing required "' + column + '"'))
+
+def check_chapter(i, value, problems):
+    """ Add a problem if a (present) chapter cannot be ordered as a number. """
+    if value and not value.strip().isdigit():
+        problems.append(problem(i, "chapter", "chapter", 'chapter "' + value + '" is not a number'))
+
+def check_read_write(i, value, problems):
+    """ Add a problem if a (present) read-write value is not "W" or "R". """
+    if value and value not in ["W", "R"]:
+        problems.append(problem(i, "read-write", "read-write", 'read-write "' + value + '" is not W or R'))
+
+def check_tsv(tsv_filename, format_name, required_total_columns, check_row):
+    """ Run check_row(i, line, problems) over a whole TSV; return the report. """
+    problems = []
+    malformed = []
+    total_rows = 0
+    for i, line in tsvrows.read_rows(tsv_filename, required_total_columns, malformed=malformed):
+        total_rows = total_rows + 1
+        check_row(i, line, problems)
+    for e in malformed:
+        problems.append(problem(e.row, None, "columns", 'expected ' + str(required_total_columns) +
+                                ' columns, found ' + str(len(e.line))))
+    return report(tsv_filename, format_name, total_rows + len(malformed), problems)
+
+def report(tsv_filename, format_name, total_rows, problems):
+    """ Gather the problems with a TSV into a report, in row order. """
+    problems = sorted(problems, key=lambda p: p["row"])
+    return {"tsv": tsv_filename, "format": format_name, "rows": total_rows,
+            "problem-count": len(problems), "problems": problems}
+
+def write_report(filename, report):
+    """ Write a report to the file, or to stdout if none. """
+    if filename:
+        with open(filename, 'w') as output:
+            json.dump(report, output, indent = 4, ensure_ascii=False)
+            output.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent = 4, ensure_ascii=False)
+        sys.stdout.write('\n')
@@ -0,0 +1,130 @@
+####
+#### Map a per-row parse function over numbered TSV rows, either in
+#### this process or in chunks spread over a pool of worker processes.
+####
+#### Results come back in the original row order either way, so that
+#### whatever depends on the order (like the read/write changeover
+#### counts) can be filled in by a cheap sequential pass afterwards.
+#### Expected, per-row errors are handed back in place of the result;
+#### a worker that dies (die_screaming()) takes us down with it, after
+#### the rows before it. The same goes for the rows' reader.
+####
+#### Example usage:
+####  import chunked
+####  for result in chunked.map_rows(parse_row, tsvrows.read_rows('/tmp/list.tsv', 10), jobs=4):
+####      ...
+####
+
+import sys
+import stagelog
+import collections
+import itertools
+import concurrent.futures
+import multiprocessing
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('chunked')
+
+## Rows per job sent to a worker.
+CHUNK_SIZE = 2000
+
+## The row function for the pool workers, set once per worker.
+_WORKER_FUNCTION = None
+_WORKER_ERRORS = ()
+
+def _init_worker(function, errors, initializer, initargs):
+    """ Pool initializer; keep the row function around. """
+    global _WORKER_FUNCTION, _WORKER_ERRORS
+    _WORKER_FUNCTION = function
+    _WORKER_ERRORS = errors
+    if initializer:
+        initializer(*initargs)
+
+def _apply(function, errors, i, line):
+    try:
+        return function(i, line)
+    except errors as e:
+        e.row = i
+        return e
+
+def _map_chunk_job(chunk):
+    """ Pool job; return the results for a chunk, and whether it died. """
+    results = []
+    for i, line in chunk:
+        try:
+            results.append(_apply(_WORKER_FUNCTION, _WORKER_ERRORS, i, line))
+        except SystemExit:
+            ## The row function has already logged why.
+            return results, True
+    return results, False
+
+def chunks(rows, chunk_size=CHUNK_SIZE):
+    """ Yield lists of up to chunk_size rows.
+
+    If reading the rows fails, the rows read so far are still yielded
+    before the error is raised.
+    """
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    except (Exception, SystemExit):
+        if chunk:
+            yield chunk
+        raise
+    if chunk:
+        yield chunk
+
+def pool_context():
+    """ The multiprocessing context for pools running stage functions. """
+    ## Forked workers inherit the loaded stage modules; spawned ones
+    ## could not import hyphenated scripts by name.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+def map_rows(function, rows, jobs=1, errors=(), initializer=None, initargs=(), chunk_size=CHUNK_SIZE):
+    """ Yield function(i, line) for each numbered row, in order.
+
+    Exceptions of the given errors types are yielded instead of
+    results, with their row number as .row. With jobs > 1, rows are sent to a pool of workers in
+    chunks; the function and initializer must be module-level.
+    """
+
+    if not jobs or jobs <= 1:
+        if initializer:
+            initializer(*initargs)
+        for i, line in rows:
+            yield _apply(function, errors, i, line)
+        return
+
+    ## Keep a few chunks in flight per worker, collecting in order.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                mp_context=pool_context(),
+                                                initializer=_init_worker,
+                                                initargs=(function, errors, initializer, initargs)) as pool:
+        chunk_iterator = chunks(rows, chunk_size)
+        pending = collections.deque()
+        reader_error = None
+        while True:
+            ## If reading the rows fails (say, a malformed row), the
+            ## chunks before it still come first, as in a serial run.
+            if reader_error is None:
+                try:
+                    for chunk in itertools.islice(chunk_iterator, 2 * jobs - len(pending)):
+                        pending.append(pool.submit(_map_chunk_job, chunk))
+                except (Exception, SystemExit) as e:
+                    reader_error = e
+            if not pending:
+                if reader_error is not None:
+                    raise reader_error
+                break
+            results, died = pending.popleft().result()
+            yield from results
+            if died:
+                pool.shutdown(cancel_futures=True)
+                sys.exit(1)
+        LOGGER.info('Parsed rows with %d workers', jobs)
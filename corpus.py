@@ -0,0 +1,285 @@
+####
+#### A local SQLite store for the parsed records of all three TSV
+#### formats (the outputs of the parse-* scripts), with indexed columns
+#### for quick queries and binning.
+####
+#### Each record is kept whole, as JSON, by kind ("vocab-list",
+#### "kanji-list" or "kanji-details") and row, alongside indexed
+#### copies of its level, chapter, section, read-write, reading and
+#### kanji. Loads are upserts keyed on a hash of each record's content
+#### (everything but its row), so that re-loading an export only
+#### writes the rows that changed and just renumbers the rows that
+#### moved (say, after a line was added to the sheet above them). Rows
+#### of the kind that the load does not cover are kept, unless the load
+#### is a --replace, which drops every row of the kind not in it.
+####
+#### Example usage to analyze the usual suspects:
+####  python3 corpus.py --help
+####
+#### Load (or re-load) parsed outputs:
+####  python3 corpus.py --database /tmp/corpus.sqlite --load vocab-list=/tmp/parsed-vocab-list.json --load kanji-list=/tmp/parsed-kanji-list.json --load kanji-details=/tmp/parsed-kanji-details.json
+####
+#### Re-load a whole export, dropping the rows that are gone from it:
+####  python3 corpus.py --database /tmp/corpus.sqlite --replace --load vocab-list=/tmp/parsed-vocab-list.json
+####
+#### All words in level 6 chapter 3 with a reading starting with か:
+####  python3 corpus.py --database /tmp/corpus.sqlite --kind vocab-list --level 6 --chapter 3 --reading-prefix か
+####
+#### Bin straight from it:
+####  python3 chapter-bin.py --corpus /tmp/corpus.sqlite --pattern vocab-list --output /tmp/chapters.json
+####
+#### From other code:
+####  import corpus
+####  connection = corpus.open_corpus('/tmp/corpus.sqlite')
+####  corpus.records(connection, 'vocab-list', level='6', chapter='3', reading_prefix='か')
+####
+
+import sys
+import argparse
+import logging
+import stagelog
+import json
+import intermediates
+import profiling
+import hashlib
+import sqlite3
+import time
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('corpus')
+
+## The kinds of record there are, and the record fields that their
+## reading and kanji columns come from.
+KINDS = {
+    "vocab-list": {"reading": "reading", "kanji": "raw-japanese"},
+    "kanji-list": {"reading": "hiragana-raw", "kanji": "kanji-raw"},
+    "kanji-details": {"reading": "reading-raw", "kanji": "kanji-raw"},
+}
+
+## The indexed columns that records can be queried by.
+COLUMNS = ["level", "chapter", "section", "read_write", "reading", "kanji"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    kind TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    level TEXT,
+    chapter TEXT,
+    section TEXT,
+    read_write TEXT,
+    reading TEXT,
+    kanji TEXT,
+    hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, row)
+);
+CREATE INDEX IF NOT EXISTS records_level ON records (kind, level, chapter, section, row);
+CREATE INDEX IF NOT EXISTS records_chapter ON records (kind, chapter, section, row);
+CREATE INDEX IF NOT EXISTS records_read_write ON records (kind, read_write, row);
+CREATE INDEX IF NOT EXISTS records_reading ON records (kind, reading);
+CREATE INDEX IF NOT EXISTS records_kanji ON records (kind, kanji);
+"""
+
+def die_screaming(string):
+    """ Die and take our toys home. """
+    LOGGER.error(string)
+    sys.exit(1)
+
+def open_corpus(filename):
+    """ Open (or create) a corpus database. """
+    connection = sqlite3.connect(filename)
+    connection.executescript(SCHEMA)
+    return connection
+
+def _columns(kind, record):
+    """ The indexed column values of a record. """
+    return (record.get("level"), record.get("chapter"), record.get("section"), record.get("read-write"),
+            record.get(KINDS[kind]["reading"]), record.get(KINDS[kind]["kanji"]))
+
+def _content(record):
+    """ The stored JSON of a record: all of it but its row. """
+    return json.dumps({k: v for k, v in record.items() if not k == "row"}, separators=(',', ':'), ensure_ascii=False)
+
+def _record_json(row, data):
+    """ The JSON of a stored record, with its row put back first, as parsed. """
+    return '{"row":' + json.dumps(str(row)) + ('}' if data == '{}' else ',' + data[1:])
+
+def load(connection, kind, data_list, replace=False):
+    """ Upsert the parsed records of a kind.
+
+    Records are matched by content, not row: a stored record whose
+    content reappears at another row only has its row changed, and new
+    content is written. Stored records at rows the load does not cover
+    are kept, unless replace is true, when every stored record of the
+    kind whose content is gone is deleted. Return the counts of
+    inserted, updated (new content at a row whose old content is gone),
+    moved, unchanged and deleted rows.
+    """
+    if kind not in KINDS:
+        die_screaming('unknown kind: ' + str(kind))
+    existing = dict(connection.execute('SELECT row, hash FROM records WHERE kind = ?', (kind,)))
+    stored_total = len(existing)
+
+    incoming = []
+    for record in data_list:
+        data = _content(record)
+        incoming.append((int(record["row"]), hashlib.sha256(data.encode('utf-8')).hexdigest(), record, data))
+
+    ## Without replace, only the stored rows that the load covers are
+    ## up for moving or overwriting; the rest are left alone.
+    if not replace:
+        rows = set(row for row, digest, record, data in incoming)
+        existing = {row: digest for row, digest in existing.items() if row in rows}
+
+    ## Content that stayed put, then content that moved, taking the
+    ## stored rows with the same content in order.
+    claimed = set()
+    for row, digest, record, data in incoming:
+        if existing.get(row) == digest:
+            claimed.add(row)
+    unclaimed = {}
+    for old_row in sorted(existing.keys()):
+        if old_row not in claimed:
+            unclaimed.setdefault(existing[old_row], []).append(old_row)
+    moves = []
+    writes = []
+    for row, digest, record, data in incoming:
+        if existing.get(row) == digest:
+            continue
+        if unclaimed.get(digest):
+            old_row = unclaimed[digest].pop(0)
+            claimed.add(old_row)
+            moves.append((old_row, row))
+        else:
+            writes.append((kind, row) + _columns(kind, record) + (digest, data))
+    gone = [row for row in existing.keys() if row not in claimed]
+
+    counts = {"inserted": 0, "updated": 0, "moved": len(moves),
+              "unchanged": len(incoming) - len(moves) - len(writes), "deleted": len(gone)}
+    gone_rows = set(gone)
+    for write in writes:
+        if write[1] in gone_rows:
+            counts["updated"] += 1
+            counts["deleted"] -= 1
+        else:
+            counts["inserted"] += 1
+    if replace and counts["deleted"] * 2 > stored_total:
+        LOGGER.warning('Replacing %s deletes %d of its %d stored rows', kind, counts["deleted"], stored_total)
+
+    ## Moved rows go through negative rows, so that no two rows
+    ## collide on the way.
+    with connection:
+        connection.executemany('UPDATE records SET row = ? WHERE kind = ? AND row = ?',
+                               [(-1 - row, kind, old_row) for old_row, row in moves])
+        connection.executemany('DELETE FROM records WHERE kind = ? AND row = ?', [(kind, row) for row in gone])
+        connection.execute('UPDATE records SET row = -1 - row WHERE kind = ? AND row < 0', (kind,))
+        connection.executemany('INSERT INTO records (kind, row, ' + ', '.join(COLUMNS) + ', hash, data) '
+                               'VALUES (' + ', '.join(['?'] * (len(COLUMNS) + 4)) + ')', writes)
+    return counts
+
+def _where(kind, reading_prefix=None, **where):
+    """ The WHERE clause and parameters for a query; None matches NULL. """
+    clauses = ['kind = ?']
+    parameters = [kind]
+    for column, value in where.items():
+        if column not in COLUMNS:
+            die_screaming('unknown column: ' + column)
+        clauses.append(column + ' IS ?')
+        parameters.append(value)
+    ## A range, so that the reading index is used.
+    if reading_prefix:
+        clauses.append('reading >= ? AND reading < ?')
+        parameters.extend([reading_prefix, reading_prefix[:-1] + chr(ord(reading_prefix[-1]) + 1)])
+    return ' WHERE ' + ' AND '.join(clauses), parameters
+
+def records(connection, kind, reading_prefix=None, **where):
+    """ Return the records of a kind with the given column values, in row order. """
+    clause, parameters = _where(kind, reading_prefix, **where)
+    ## Decoded as one JSON list; much quicker than record by record.
+    return json.loads('[' + ','.join(_record_json(row, data) for (row, data) in
+                                     connection.execute('SELECT row, data FROM records' + clause + ' ORDER BY row', parameters)) + ']')
+
+def distinct(connection, kind, column, **where):
+    """ Return the distinct values of a column for a kind's matching records. """
+    clause, parameters = _where(kind, **where)
+    if column not in COLUMNS:
+        die_screaming('unknown column: ' + column)
+    return [value for (value,) in connection.execute('SELECT DISTINCT ' + column + ' FROM records' + clause, parameters)]
+
+def count(connection, kind):
+    """ The number of records of a kind. """
+    return connection.execute('SELECT COUNT(*) FROM records WHERE kind = ?', (kind,)).fetchone()[0]
+
+def main():
+
+    ## Deal with incoming.
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='More verbose output')
+    parser.add_argument('-d', '--database',
+                        help='The SQLite corpus file to use (created if missing)')
+    parser.add_argument('-l', '--load', action='append', default=[],
+                        help='[optional] Load a parse-* output, as KIND=FILE (' + ', '.join(KINDS.keys()) + '); may be repeated')
+    parser.add_argument('-r', '--replace', action='store_true',
+                        help='[optional] Make each load replace all the records of its kind, deleting those not in it (default only upsert the loaded rows)')
+    parser.add_argument('-k', '--kind',
+                        help='[optional] The kind of record to query')
+    parser.add_argument('--level',
+                        help='[optional] Query for a level')
+    parser.add_argument('--chapter',
+                        help='[optional] Query for a chapter')
+    parser.add_argument('--section',
+                        help='[optional] Query for a section')
+    parser.add_argument('--read-write',
+                        help='[optional] Query for W or R')
+    parser.add_argument('--reading-prefix',
+                        help='[optional] Query for readings starting with this')
+    parser.add_argument('--kanji',
+                        help='[optional] Query for a kanji (or vocab word)')
+    parser.add_argument('-o', '--output',
+                        help='[optional] The file to write query results to (default stdout)')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    ## Up the verbosity level if we want.
+    if args.verbose:
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.info('Verbose: on')
+
+    ## Ensure arguments and read in what is necessary.
+    if not args.database:
+        die_screaming('need a database argument')
+    LOGGER.info('Will use corpus: %s', args.database)
+    if not args.load and not args.kind:
+        die_screaming('need something to load or a kind to query')
+    connection = open_corpus(args.database)
+
+    for load_argument in args.load:
+        kind, sep, filename = load_argument.partition('=')
+        if not sep or kind not in KINDS:
+            die_screaming('load argument should be KIND=FILE, with KIND one of: ' + ', '.join(KINDS.keys()))
+        counts = load(connection, kind, intermediates.read(filename), args.replace)
+        profiling.checkpoint()
+        print('Loaded ' + filename + ' as ' + kind + ': ' + ', '.join(str(v) + ' ' + k for k, v in counts.items()))
+
+    if args.kind:
+        if args.kind not in KINDS:
+            die_screaming('kind argument unknown')
+        where = {}
+        for column in COLUMNS:
+            value = getattr(args, column, None)
+            if value is not None:
+                where[column] = value
+        start = time.perf_counter()
+        found = records(connection, args.kind, args.reading_prefix, **where)
+        LOGGER.info('Found %d records in %.1fms', len(found), (time.perf_counter() - start) * 1000)
+        if args.output:
+            intermediates.write(args.output, found)
+        else:
+            print(json.dumps(found, indent = 4, ensure_ascii=False))
+
+## You saw it coming...
+if __name__ == '__main__':
+    profiling.run(main)
@@ -0,0 +1,56 @@
+####
+#### Span-based highlighting: atomize a string into per-character
+#### dicts for the templates, with marker dicts at the boundaries of
+#### highlighted spans (bold, dotted, underline, ...).
+####
+#### Spans are offset ranges, given outermost first. Where boundaries
+#### fall on the same offset, inner spans are closed before outer ones
+#### and outer spans are opened before inner ones. Any number of
+#### (overlapping) spans is fine; the output is built in one pass.
+####
+#### Example usage:
+####  import highlight
+####  spans = [highlight.find_span('正月', '正月', 'token-dot-start-p', 'token-dot-end-p'),
+####           highlight.find_span('正月', '正', 'token-bold-start-p', 'token-bold-end-p')]
+####  highlight.segment('正月', spans)
+####  # => [{"token-dot-start-p": True}, {"token-bold-start-p": True}, {"chr": "正"},
+####  #     {"token-bold-end-p": True}, {"chr": "月"}, {"token-dot-end-p": True}]
+####
+
+def find_span(text, sub, start_token, end_token):
+    """ Return the span of the first sub in text, or None if absent. """
+    if not text or not sub:
+        return None
+    start = text.find(sub)
+    if start == -1:
+        return None
+    return (start, start + len(sub), start_token, end_token)
+
+def segment(text, spans=()):
+    """ Atomize text, with the markers of spans (outermost first) inserted.
+
+    Each span is a (start, end, start token, end token) tuple; None
+    spans are skipped.
+    """
+    spans = [s for s in spans if s is not None]
+    if not spans:
+        return [{"chr": x} for x in text]
+
+    ## Markers at each offset: closes (inner first), then opens
+    ## (outer first).
+    closes = {}
+    opens = {}
+    for start, end, start_token, end_token in reversed(spans):
+        closes.setdefault(end, []).append({end_token: True})
+    for start, end, start_token, end_token in spans:
+        opens.setdefault(start, []).append({start_token: True})
+
+    atomized = []
+    for offset in range(len(text) + 1):
+        if offset in closes:
+            atomized.extend(closes[offset])
+        if offset in opens:
+            atomized.extend(opens[offset])
+        if offset < len(text):
+            atomized.append({"chr": text[offset]})
+    return atomized
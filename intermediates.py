@@ -0,0 +1,93 @@
+####
+#### Reading and writing the intermediates that are passed between
+#### the pipeline stages.
+####
+#### There are three formats:
+####  json: indented JSON, as the scripts have always written
+####  compact: unindented JSON, with unescaped Japanese
+####  binary: zlib-compressed compact JSON, behind a magic header
+#### Readers detect the format automatically.
+####
+#### Example usage:
+####  import intermediates
+####  intermediates.write_list('/tmp/parsed-vocab-list.json', parse_rows(rows), 'binary')
+####  data_list = intermediates.read('/tmp/parsed-vocab-list.json')
+####
+
+import json
+import zlib
+import os
+
+## Known formats; the first is the default.
+FORMATS = ["json", "compact", "binary"]
+
+## The file suffix that goes with each format.
+SUFFIXES = {"json": ".json", "compact": ".json", "binary": ".bin"}
+
+## Marks the binary format; cannot be the start of a JSON document.
+MAGIC = b'\x00KTTB01\n'
+
+def _json_pieces(items, format):
+    """ Yield the text of a JSON list of the items, piece by piece. """
+    first_p = True
+    if format == "json":
+        ## Identical to json.dumps(list(items), indent = 4).
+        for item in items:
+            yield '[\n    ' if first_p else ',\n    '
+            yield json.dumps(item, indent = 4).replace('\n', '\n    ')
+            first_p = False
+        yield '[]' if first_p else '\n]'
+    else:
+        for item in items:
+            yield '[' if first_p else ','
+            yield json.dumps(item, separators=(',', ':'), ensure_ascii=False)
+            first_p = False
+        yield '[]' if first_p else ']'
+
+def _write_pieces(output, items, format):
+    if format == "binary":
+        output.write(MAGIC)
+        compressor = zlib.compressobj()
+        for piece in _json_pieces(items, format):
+            output.write(compressor.compress(piece.encode('utf-8')))
+        output.write(compressor.flush())
+    else:
+        for piece in _json_pieces(items, format):
+            output.write(piece.encode('utf-8'))
+
+def write_list(output_filename, items, format="json"):
+    """ Write items as a list in the given format, one item at a time.
+
+    In every format, the list goes to a temporary file beside the
+    output, which is only moved into place once the items are
+    exhausted; if anything fails partway through (say, the parser
+    feeding it dies), the previous output is left as it was. Outputs
+    that are not plain files (/dev/stdout, a pipe) are written to
+    directly.
+    """
+    if format not in FORMATS:
+        raise ValueError('unknown intermediate format: ' + str(format))
+    if os.path.exists(output_filename) and not os.path.isfile(output_filename):
+        with open(output_filename, 'wb') as output:
+            _write_pieces(output, items, format)
+        return
+    tmp_filename = output_filename + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmp_filename, 'wb') as output:
+            _write_pieces(output, items, format)
+        os.replace(tmp_filename, output_filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+def write(output_filename, data_list, format="json"):
+    """ Write a whole data list in the given format, as write_list() does. """
+    write_list(output_filename, iter(data_list), format)
+
+def read(input_filename):
+    """ Read an intermediate written in any of the formats. """
+    with open(input_filename, 'rb') as json_in_f:
+        raw = json_in_f.read()
+    if raw.startswith(MAGIC):
+        raw = zlib.decompress(raw[len(MAGIC):])
+    return json.loads(raw)
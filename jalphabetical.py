@@ -0,0 +1,425 @@
+####
+#### Japanese alphabetical ("jalphabetical") ordering tables and a
+#### collation-key engine for sorting readings.
+####
+#### Readings are normalized once and mapped to a tuple of integer
+#### ranks, so that lists can be sorted with `key=` instead of
+#### comparing (and re-normalizing) strings pairwise.
+####
+#### Example usage:
+####  import jalphabetical
+####  sorted(data_list, key=jalphabetical.item_key("reading"))
+####
+
+import re
+
+## Characters that are ignored entirely when ordering.
+IGNORED_CHARACTERS = ["（", "）", "(", ")", "～", "~", " ", "・", "…", "."]
+
+JALPHABETICAL_ORDER = [
+    ## NOTE: useful:
+    ##  for i in range(0, len(k)): print('"' + str(k[i]) + 'ー": "' + str(h[i]) + '",')
+    # "ア", "ァ", "イ", "ィ", "ウ", "ゥ", "エ", "ェ", "オ", "ォ",
+    # "カ", "ガ", "キ", "ギ", "ク", "グ", "ケ", "ゲ", "コ", "ゴ",
+    # "サ", "ザ", "シ", "ジ", "ス", "ズ", "セ", "ゼ", "ソ", "ゾ",
+    # "タ", "ダ", "チ", "ヂ", "ツ", "ッ", "ヅ", "テ", "デ", "ト", "ド",
+    # "ナ", "ニ", "ヌ", "ネ", "ノ",
+    # "ハ", "バ", "パ", "ヒ", "ビ", "ピ", "フ", "ブ", "プ", "ヘ", "ベ", "ペ", "ホ", "ボ", "ポ",
+    # "マ", "ミ", "ム", "メ", "モ",
+    # "ヤ", "ャ", "ユ", "ュ", "ヨ", "ョ",
+    # "ラ", "リ", "ル", "レ", "ロ",
+    # "ワ", "ヲ",
+    # "ン",
+    # "あ", "ぁ", "い", "ぃ", "う", "ぅ", "え", "ぇ", "お", "ぉ",
+    # "か", "が", "き", "ぎ", "く", "ぐ", "け", "げ", "こ", "ご",
+    # "さ", "ざ", "し", "じ", "す", "ず", "せ", "ぜ", "そ", "ぞ",
+    # "た", "だ", "ち", "ぢ", "つ", "っ", "づ", "て", "で", "と", "ど",
+    # "な", "に", "ぬ", "ね", "の",
+    # "は", "ば", "ぱ", "ひ", "び", "ぴ", "ふ", "ぶ", "ぷ", "へ", "べ", "ぺ", "ほ", "ぼ", "ぽ",
+    # "ま", "み", "む", "め", "も",
+    # "や", "ゃ", "ゆ", "ゅ", "よ", "ょ",
+    # "ら", "り", "る", "れ", "ろ",
+    # "わ", "を",
+    # "ん"]
+    "あ", "ア", "ぁ", "ァ",
+    "い", "イ", "ぃ", "ィ",
+    "う", "ウ", "ぅ", "ゥ",
+    "え", "エ", "ぇ", "ェ",
+    "お", "オ", "ぉ", "ォ",
+    "か", "カ", "が", "ガ",
+    "き", "キ", "ぎ", "ギ",
+    "く", "ク", "ぐ", "グ",
+    "け", "ケ", "げ", "ゲ",
+    "こ", "コ", "ご", "ゴ",
+    "さ", "サ", "ざ", "ザ",
+    "し", "シ", "じ", "ジ",
+    "す", "ス", "ず", "ズ",
+    "せ", "セ", "ぜ", "ゼ",
+    "そ", "ソ", "ぞ", "ゾ",
+    "た", "タ", "だ", "ダ",
+    "ち", "チ", "ぢ", "ヂ",
+    "つ", "ツ", "っ", "ッ", "づ", "ヅ",
+    "て", "テ", "で", "デ",
+    "と", "ト", "ど", "ド",
+    "な", "ナ",
+    "に", "ニ",
+    "ぬ", "ヌ",
+    "ね", "ネ",
+    "の", "ノ",
+    "は", "ハ", "ば", "バ", "ぱ", "パ",
+    "ひ", "ヒ", "び", "ビ", "ぴ", "ピ",
+    "ふ", "フ", "ぶ", "ブ", "ぷ", "プ",
+    "へ", "ヘ", "べ", "ベ", "ぺ", "ペ",
+    "ほ", "ホ", "ぼ", "ボ", "ぽ", "ポ",
+    "ま", "マ",
+    "み", "ミ",
+    "む", "ム",
+    "め", "メ",
+    "も", "モ",
+    "や", "ヤ", "ゃ", "ャ",
+    "ゆ", "ユ", "ゅ", "ュ",
+    "よ", "ヨ", "ょ", "ョ",
+    "ら", "ラ",
+    "り", "リ",
+    "る", "ル",
+    "れ", "レ",
+    "ろ", "ロ",
+    "わ", "ワ",
+    "を", "ヲ",
+    "ん", "ン"]
+JALPHABETICAL_XFORM = {
+    "アー": "アア",
+    "ァー": "ァァ",
+    "イー": "イイ",
+    "ィー": "ィィ",
+    "ウー": "ウウ",
+    "ゥー": "ゥゥ",
+    "エー": "エエ",
+    "ェー": "ェェ",
+    "オー": "オオ",
+    "ォー": "ォォ",
+    "カー": "カア",
+    "ガー": "ガア",
+    "キー": "キイ",
+    "ギー": "ギイ",
+    "クー": "クウ",
+    "グー": "グウ",
+    "ケー": "ケエ",
+    "ゲー": "ゲエ",
+    "コー": "コオ",
+    "ゴー": "ゴオ",
+    "サー": "サア",
+    "ザー": "ザア",
+    "シー": "シイ",
+    "ジー": "ジイ",
+    "スー": "スウ",
+    "ズー": "ズウ",
+    "セー": "セエ",
+    "ゼー": "ゼエ",
+    "ソー": "ソオ",
+    "ゾー": "ゾオ",
+    "ター": "タア",
+    "ダー": "ダア",
+    "チー": "チイ",
+    "ヂー": "ヂイ",
+    "ツー": "ツウ",
+    "ッー": "ッウ",
+    "ヅー": "ヅウ",
+    "テー": "テエ",
+    "デー": "デエ",
+    "トー": "トオ",
+    "ドー": "ドオ",
+    "ナー": "ナア",
+    "ニー": "ニイ",
+    "ヌー": "ヌウ",
+    "ネー": "ネエ",
+    "ノー": "ノオ",
+    "ハー": "ハア",
+    "バー": "バア",
+    "パー": "パア",
+    "ヒー": "ヒイ",
+    "ビー": "ビイ",
+    "ピー": "ピイ",
+    "フー": "フウ",
+    "ブー": "ブウ",
+    "プー": "プウ",
+    "ヘー": "ヘエ",
+    "ベー": "ベエ",
+    "ペー": "ペエ",
+    "ホー": "ホオ",
+    "ボー": "ボオ",
+    "ポー": "ポオ",
+    "マー": "マア",
+    "ミー": "ミイ",
+    "ムー": "ムウ",
+    "メー": "メエ",
+    "モー": "モオ",
+    "ヤー": "ヤア",
+    "ャー": "ャァ",
+    "ユー": "ユウ",
+    "ュー": "ュィ",
+    "ヨー": "ヨオ",
+    "ョー": "ョォ",
+    "ラー": "ラア",
+    "リー": "リイ",
+    "ルー": "ルウ",
+    "レー": "レエ",
+    "ロー": "ロオ",
+    "ワー": "ワア",
+    "ヲー": "ヲオ",
+    ## Remove voicing for sorting.
+    "ガ": "カ",
+    "ギ": "キ",
+    "グ": "ク",
+    "ゲ": "ケ",
+    "ゴ": "コ",
+    "ザ": "サ",
+    "ジ": "シ",
+    "ズ": "ス",
+    "ゼ": "セ",
+    "ゾ": "ソ",
+    "ダ": "タ",
+    "ヂ": "チ",
+    "ヅ": "ツ",
+    "デ": "テ",
+    "ド": "ト",
+    "バ": "ハ",
+    "パ": "ハ",
+    "ビ": "ヒ",
+    "ピ": "ヒ",
+    "ブ": "フ",
+    "プ": "フ",
+    "ベ": "ヘ",
+    "ペ": "ヘ",
+    "ボ": "ホ",
+    "ポ": "ホ",
+    "が": "か",
+    "ぎ": "き",
+    "ぐ": "く",
+    "げ": "け",
+    "ご": "こ",
+    "ざ": "さ",
+    "じ": "し",
+    "ず": "す",
+    "ぜ": "せ",
+    "ぞ": "そ",
+    "だ": "た",
+    "ぢ": "ち",
+    "づ": "つ",
+    "で": "て",
+    "ど": "と",
+    "ば": "は",
+    "ぱ": "は",
+    "び": "ひ",
+    "ぴ": "ひ",
+    "ぶ": "ふ",
+    "ぷ": "ふ",
+    "べ": "へ",
+    "ぺ": "へ",
+    "ぼ": "ほ",
+    "ぽ": "ほ"
+}
+SECTION_FIELD_ORDER = [
+    "あ", "い", "う", "え", "お",
+    "か", "き", "く", "け", "こ",
+    "さ", "し", "す", "せ", "そ",
+    "た", "ち", "つ", "て", "と",
+    "な", "に", "ぬ", "ね", "の",
+    "は", "ひ", "ふ", "へ", "ほ",
+    "ま", "み", "む", "め", "も",
+    "や", "ゆ", "よ",
+    "ら", "り", "る", "れ", "ろ",
+    "わ", "を",
+    "ん"]
+SECTION_FIELD_MEMBERSHIP = {
+    "あ": "あ",
+    "ぁ": "あ",
+    "い": "い",
+    "ぃ": "い",
+    "う": "う",
+    "ぅ": "う",
+    "え": "え",
+    "ぇ": "え",
+    "お": "お",
+    "ぉ": "お",
+    "か": "か",
+    "が": "か",
+    "き": "き",
+    "ぎ": "き",
+    "く": "く",
+    "ぐ": "く",
+    "け": "け",
+    "げ": "け",
+    "こ": "こ",
+    "ご": "こ",
+    "さ": "さ",
+    "ざ": "さ",
+    "し": "し",
+    "じ": "し",
+    "す": "す",
+    "ず": "す",
+    "せ": "せ",
+    "ぜ": "せ",
+    "そ": "そ",
+    "ぞ": "そ",
+    "た": "た",
+    "だ": "た",
+    "ち": "ち",
+    "ぢ": "ち",
+    "つ": "つ",
+    "っ": "つ",
+    "づ": "つ",
+    "て": "て",
+    "で": "て",
+    "と": "と",
+    "ど": "と",
+    "な": "な",
+    "に": "に",
+    "ぬ": "ぬ",
+    "ね": "ね",
+    "の": "の",
+    "は": "は",
+    "ば": "は",
+    "ぱ": "は",
+    "ひ": "ひ",
+    "び": "ひ",
+    "ぴ": "ひ",
+    "ふ": "ふ",
+    "ぶ": "ふ",
+    "ぷ": "ふ",
+    "へ": "へ",
+    "べ": "へ",
+    "ぺ": "へ",
+    "ほ": "ほ",
+    "ぼ": "ほ",
+    "ぽ": "ほ",
+    "ま": "ま",
+    "み": "み",
+    "む": "む",
+    "め": "め",
+    "も": "も",
+    "や": "や",
+    "ゃ": "や",
+    "ゆ": "ゆ",
+    "ゅ": "ゆ",
+    "よ": "よ",
+    "ょ": "よ",
+    "ら": "ら",
+    "り": "り",
+    "る": "る",
+    "れ": "れ",
+    "ろ": "ろ",
+    "わ": "わ",
+    "を": "を",
+    "ん": "ん",
+    "ア": "あ",
+    "ァ": "あ",
+    "イ": "い",
+    "ィ": "い",
+    "ウ": "う",
+    "ゥ": "う",
+    "エ": "え",
+    "ェ": "え",
+    "オ": "お",
+    "ォ": "お",
+    "カ": "か",
+    "ガ": "か",
+    "キ": "き",
+    "ギ": "き",
+    "ク": "く",
+    "グ": "く",
+    "ケ": "け",
+    "ゲ": "け",
+    "コ": "こ",
+    "ゴ": "こ",
+    "サ": "さ",
+    "ザ": "さ",
+    "シ": "し",
+    "ジ": "し",
+    "ス": "す",
+    "ズ": "す",
+    "セ": "せ",
+    "ゼ": "せ",
+    "ソ": "そ",
+    "ゾ": "そ",
+    "タ": "た",
+    "ダ": "た",
+    "チ": "ち",
+    "ヂ": "ち",
+    "ツ": "つ",
+    "ッ": "つ",
+    "ヅ": "つ",
+    "テ": "て",
+    "デ": "て",
+    "ト": "と",
+    "ド": "と",
+    "ナ": "な",
+    "ニ": "に",
+    "ヌ": "ぬ",
+    "ネ": "ね",
+    "ノ": "の",
+    "ハ": "は",
+    "バ": "は",
+    "パ": "は",
+    "ヒ": "ひ",
+    "ビ": "ひ",
+    "ピ": "ひ",
+    "フ": "ふ",
+    "ブ": "ふ",
+    "プ": "ふ",
+    "ヘ": "へ",
+    "ベ": "へ",
+    "ペ": "へ",
+    "ホ": "ほ",
+    "ボ": "ほ",
+    "ポ": "ほ",
+    "マ": "ま",
+    "ミ": "み",
+    "ム": "む",
+    "メ": "め",
+    "モ": "も",
+    "ヤ": "や",
+    "ャ": "や",
+    "ユ": "ゆ",
+    "ュ": "ゆ",
+    "ヨ": "よ",
+    "ョ": "よ",
+    "ラ": "ら",
+    "リ": "り",
+    "ル": "る",
+    "レ": "れ",
+    "ロ": "ろ",
+    "ワ": "わ",
+    "ヲ": "を",
+    "ン": "ん"}
+
+## Precomputed lookup tables for the collation keys.
+_IGNORED_TABLE = str.maketrans("", "", "".join(IGNORED_CHARACTERS))
+_RANKS = {}
+for rank, character in enumerate(JALPHABETICAL_ORDER):
+    _RANKS.setdefault(character, rank)
+## NOTE: The transform table is applied in two steps: first all of
+## the long vowel ("Xー") rules, then all of the single character
+## (voicing) rules. This is equivalent to applying each rule in
+## order with str.replace, as all of the long vowel rules come first
+## in the table and none of them can overlap.
+_XFORM_LONG = {k: v for k, v in JALPHABETICAL_XFORM.items() if len(k) > 1}
+_XFORM_LONG_RE = re.compile("|".join(re.escape(k) for k in _XFORM_LONG))
+_XFORM_TABLE = str.maketrans({k: v for k, v in JALPHABETICAL_XFORM.items() if len(k) == 1})
+
+def normalize_reading(reading):
+    """ Strip ignored characters and apply the transform table. """
+    reading = str(reading).translate(_IGNORED_TABLE)
+    reading = _XFORM_LONG_RE.sub(lambda m: _XFORM_LONG[m.group(0)], reading)
+    return reading.translate(_XFORM_TABLE)
+
+def collation_key(reading):
+    """ Return a tuple of integer ranks for sorting the reading. """
+    ## Characters not in our ordering sort after all known ones, by
+    ## code point.
+    unknown_base = len(JALPHABETICAL_ORDER)
+    return tuple(_RANKS.get(c, unknown_base + ord(c)) for c in normalize_reading(reading))
+
+def item_key(field):
+    """ Return a sort key function for dicts with a reading in field. """
+    return lambda item: collation_key(item[field])
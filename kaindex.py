@@ -0,0 +1,254 @@
+####
+#### Compile kanjialive/ka_data.csv into a compact binary index, keyed
+#### by kanji, that can be memory-mapped instead of re-reading the CSV
+#### on every run.
+####
+#### Every column is kept; the (large, embedded JSON) "examples"
+#### column is only parsed when it is accessed. The index is rebuilt
+#### automatically whenever the CSV changes.
+####
+#### Example usage to analyze the usual suspects:
+####  python3 kaindex.py --help
+####
+#### (Re)build the index for this repo:
+####  python3 kaindex.py --repo /home/sjcarbon/local/src/git/textbook-project-data
+####
+#### From other code:
+####  import kaindex
+####  lookup = kaindex.load_index(repo + '/kanjialive/ka_data.csv')
+####  lookup['何']['kname'] # => 'nani'
+####
+
+import sys
+import argparse
+import logging
+import stagelog
+import csv
+import json
+import os
+import mmap
+import struct
+import collections.abc
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('kaindex')
+
+## File layout:
+##  header: magic, source size, source mtime (ns), column count, record count
+##  columns: (length, utf-8 name) for each column
+##  table: (key offset, key length, record offset) for each record, sorted by key
+##  data: keys and records; a record is (length, utf-8 value) for each column
+MAGIC = b'KAIDX001'
+HEADER = struct.Struct('<8sQQII')
+COLUMN = struct.Struct('<H')
+ENTRY = struct.Struct('<III')
+FIELD = struct.Struct('<I')
+
+## Columns that are stored as JSON and parsed on access.
+JSON_COLUMNS = ["examples"]
+
+def die_screaming(string):
+    """ Die and take our toys home. """
+    LOGGER.error(string)
+    sys.exit(1)
+
+def default_index_filename(csv_filename):
+    """ The index lives next to the CSV it was built from. """
+    return os.path.splitext(csv_filename)[0] + '.idx'
+
+class KanjiRecord(collections.abc.Mapping):
+    """ A read-only view of one kanji's row in the index. """
+
+    def __init__(self, buf, offset, columns):
+        self._buf = buf
+        self._offset = offset
+        self._columns = columns
+        self._values = None
+        self._parsed = {}
+
+    def _decode(self):
+        """ Decode all the raw column strings of the record, once. """
+        values = {}
+        offset = self._offset
+        for column in self._columns:
+            (length,) = FIELD.unpack_from(self._buf, offset)
+            offset = offset + FIELD.size
+            values[column] = bytes(self._buf[offset:offset+length]).decode('utf-8')
+            offset = offset + length
+        self._values = values
+
+    def __getitem__(self, column):
+        if self._values is None:
+            self._decode()
+        if column in JSON_COLUMNS and column in self._values:
+            if column not in self._parsed:
+                self._parsed[column] = json.loads(self._values[column])
+            return self._parsed[column]
+        return self._values[column]
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+class KanjiIndex(collections.abc.Mapping):
+    """ A read-only mapping of kanji to KanjiRecord over an index buffer. """
+
+    def __init__(self, buf):
+        magic, size, mtime_ns, column_count, record_count = HEADER.unpack_from(buf, 0)
+        if not magic == MAGIC:
+            raise ValueError('not a kanjialive index')
+        self._buf = buf
+        self.source_size = size
+        self.source_mtime_ns = mtime_ns
+        self._record_count = record_count
+        columns = []
+        offset = HEADER.size
+        for c in range(column_count):
+            (length,) = COLUMN.unpack_from(buf, offset)
+            offset = offset + COLUMN.size
+            columns.append(bytes(buf[offset:offset+length]).decode('utf-8'))
+            offset = offset + length
+        self.columns = columns
+        self._table_offset = offset
+
+    def _entry(self, n):
+        return ENTRY.unpack_from(self._buf, self._table_offset + n * ENTRY.size)
+
+    def _key(self, n):
+        key_offset, key_length, record_offset = self._entry(n)
+        return bytes(self._buf[key_offset:key_offset+key_length])
+
+    def _find(self, kanji):
+        """ Binary search the sorted table; return the entry number. """
+        key = kanji.encode('utf-8')
+        lo = 0
+        hi = self._record_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._record_count and self._key(lo) == key:
+            return lo
+        return None
+
+    def __getitem__(self, kanji):
+        n = self._find(kanji) if isinstance(kanji, str) else None
+        if n is None:
+            raise KeyError(kanji)
+        return KanjiRecord(self._buf, self._entry(n)[2], self.columns)
+
+    def __contains__(self, kanji):
+        return isinstance(kanji, str) and self._find(kanji) is not None
+
+    def __iter__(self):
+        for n in range(self._record_count):
+            yield self._key(n).decode('utf-8')
+
+    def __len__(self):
+        return self._record_count
+
+def compile_index(csv_filename):
+    """ Read the CSV and return the bytes of its index. """
+
+    stat = os.stat(csv_filename)
+    records = {}
+    with open(csv_filename, 'r') as ka_in:
+        ka_in = csv.reader(ka_in, delimiter=',')
+        columns = next(ka_in)
+        for line in ka_in:
+            ## Later rows win, as with a plain dict.
+            records[line[0]] = line
+
+    ## Lay out the header, columns and table, then the data.
+    head = bytearray(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, len(columns), len(records)))
+    for column in columns:
+        name = column.encode('utf-8')
+        head += COLUMN.pack(len(name)) + name
+    keys = sorted(k.encode('utf-8') for k in records.keys())
+    data_offset = len(head) + len(keys) * ENTRY.size
+    table = bytearray()
+    data = bytearray()
+    for key in keys:
+        key_offset = data_offset + len(data)
+        data += key
+        record_offset = data_offset + len(data)
+        line = records[key.decode('utf-8')]
+        for c in range(len(columns)):
+            value = (line[c] if c < len(line) else '').encode('utf-8')
+            data += FIELD.pack(len(value)) + value
+        table += ENTRY.pack(key_offset, len(key), record_offset)
+    return bytes(head + table + data)
+
+def index_fresh_p(csv_filename, index_filename):
+    """ Whether the index exists and was built from the CSV as it is now. """
+    try:
+        stat = os.stat(csv_filename)
+        with open(index_filename, 'rb') as idx_in:
+            magic, size, mtime_ns, column_count, record_count = HEADER.unpack(idx_in.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    return magic == MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+
+def build_index(csv_filename, index_filename=None):
+    """ (Re)build the index file; return its bytes. """
+    index_filename = index_filename or default_index_filename(csv_filename)
+    LOGGER.info('Building kanjialive index: %s', index_filename)
+    compiled = compile_index(csv_filename)
+    tmp_filename = index_filename + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_filename, 'wb') as output:
+        output.write(compiled)
+    os.replace(tmp_filename, index_filename)
+    return compiled
+
+def load_index(csv_filename, index_filename=None):
+    """ Return a KanjiIndex for the CSV, (re)building it if stale. """
+
+    index_filename = index_filename or default_index_filename(csv_filename)
+    if not index_fresh_p(csv_filename, index_filename):
+        try:
+            build_index(csv_filename, index_filename)
+        except OSError as e:
+            ## Say, a read-only checkout; just use it from memory.
+            LOGGER.warning('Could not write kanjialive index (%s); using it from memory', e)
+            return KanjiIndex(compile_index(csv_filename))
+
+    with open(index_filename, 'rb') as idx_in:
+        buf = mmap.mmap(idx_in.fileno(), 0, access=mmap.ACCESS_READ)
+    return KanjiIndex(buf)
+
+def main():
+
+    ## Deal with incoming.
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='More verbose output')
+    parser.add_argument('-r', '--repo',
+                        help='[optional] The path to this repo')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='[optional] Rebuild even if the index looks fresh')
+    args = parser.parse_args()
+
+    ## Up the verbosity level if we want.
+    if args.verbose:
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.info('Verbose: on')
+
+    if not args.repo:
+        args.repo = os.getcwd()
+    csv_filename = args.repo + '/kanjialive/ka_data.csv'
+    if not os.path.exists(csv_filename):
+        die_screaming('no kanjialive data at: ' + csv_filename)
+
+    if args.force or not index_fresh_p(csv_filename, default_index_filename(csv_filename)):
+        build_index(csv_filename)
+    print(str(len(load_index(csv_filename))) + ' kanji in ' + default_index_filename(csv_filename))
+
+## You saw it coming...
+if __name__ == '__main__':
+    main()
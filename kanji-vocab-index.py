@@ -0,0 +1,133 @@
+####
+#### Build an inverted index from each kanji to the vocab words that
+#### use it, and attach it to parsed kanji details records.
+####
+#### The parsed vocab list is scanned once; each kanji details record
+#### then gets its occurrences (chapter, section, row, ...) by lookup:
+####  "vocab-occurrences": every vocab word using the kanji, in order
+####  "vocab-chapters": the same, grouped as [{"chapter": ..., "vocab": [...]}]
+####  "vocab-occurrences-p": whether there are any
+####
+#### Example usage to analyze the usual suspects:
+####  python3 kanji-vocab-index.py --help
+####
+#### As part of a pipeline, between parsing and binning the kanji details:
+####  python3 parse-vocab-list.py --tsv /tmp/vocab-list.tsv --output /tmp/parsed-vocab-list.json && python3 parse-kanji-details.py --tsv /tmp/kanji-details.tsv --output /tmp/parsed-kanji-details.json && python3 kanji-vocab-index.py --vocab /tmp/parsed-vocab-list.json --input /tmp/parsed-kanji-details.json --output /tmp/indexed-kanji-details.json && python3 chapter-bin.py --input /tmp/indexed-kanji-details.json --pattern kanji-details --output /tmp/binned-kanji.json && python3 apply-to-chapters.py --input /tmp/binned-kanji.json --template manual-html-kanji-details.template.html --output /tmp/kh-ch
+####
+#### Also keep the whole index around:
+####  python3 kanji-vocab-index.py --vocab /tmp/parsed-vocab-list.json --input /tmp/parsed-kanji-details.json --output /tmp/indexed-kanji-details.json --index /tmp/kanji-vocab-index.json
+####
+
+import sys
+import argparse
+import logging
+import stagelog
+import intermediates
+import profiling
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('kanji-vocab-index')
+
+## Unicode blocks that hold kanji, as (first, last) code points.
+KANJI_RANGES = [(0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF), (0x20000, 0x3134F)]
+
+def die_screaming(string):
+    """ Die and take our toys home. """
+    LOGGER.error(string)
+    sys.exit(1)
+
+def kanji_p(character):
+    """ Whether a character is a kanji. """
+    code = ord(character)
+    for first, last in KANJI_RANGES:
+        if first <= code <= last:
+            return True
+    return False
+
+def build_index(vocab_list):
+    """ Return a dict of kanji to the vocab occurrences that use it. """
+    index = {}
+    for item in vocab_list:
+        japanese = str(item["raw-japanese"])
+        occurrence = {"chapter": str(item["chapter"]),
+                      "section": item.get("section"),
+                      "row": str(item["row"]),
+                      "japanese": japanese,
+                      "reading": item.get("reading"),
+                      "meaning": item.get("meaning")}
+        ## Once per word, however often the kanji appears in it.
+        seen = set()
+        for character in japanese:
+            if character not in seen and kanji_p(character):
+                seen.add(character)
+                index.setdefault(character, []).append(occurrence)
+    for occurrences in index.values():
+        occurrences.sort(key=lambda o: (int(o["chapter"]), int(o["row"])))
+    return index
+
+def attach_index(kanji_list, index):
+    """ Attach the vocab occurrences of each record's kanji to it. """
+    for item in kanji_list:
+        occurrences = index.get(str(item["kanji-raw"]), [])
+        chapters = []
+        for occurrence in occurrences:
+            if not chapters or not chapters[-1]["chapter"] == occurrence["chapter"]:
+                chapters.append({"chapter": occurrence["chapter"], "vocab": []})
+            chapters[-1]["vocab"].append(occurrence)
+        item["vocab-occurrences"] = occurrences
+        item["vocab-chapters"] = chapters
+        item["vocab-occurrences-p"] = len(occurrences) > 0
+    return kanji_list
+
+def main():
+
+    ## Deal with incoming.
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='More verbose output')
+    parser.add_argument('-w', '--vocab',
+                        help='The parsed vocab list to index')
+    parser.add_argument('-i', '--input',
+                        help='The parsed kanji details to attach the index to')
+    parser.add_argument('-x', '--index',
+                        help='[optional] A file to also write the whole index to')
+    parser.add_argument('-f', '--format', choices=intermediates.FORMATS, default=intermediates.FORMATS[0],
+                        help='[optional] The output format: json (default), compact (unindented JSON) or binary')
+    parser.add_argument('-o', '--output',
+                        help='The file to output the kanji details to')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    ## Up the verbosity level if we want.
+    if args.verbose:
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.info('Verbose: on')
+
+    ## Ensure arguments and read in what is necessary.
+    if not args.vocab:
+        die_screaming('need a parsed vocab argument')
+    LOGGER.info('Will index vocab from: %s', args.vocab)
+    if not args.input:
+        die_screaming('need an input argument')
+    LOGGER.info('Will input from: %s', args.input)
+    if not args.output:
+        die_screaming('need an output argument')
+    LOGGER.info('Will output to: %s', args.output)
+
+    ## Bring data in and index.
+    index = build_index(intermediates.read(args.vocab))
+    kanji_list = attach_index(intermediates.read(args.input), index)
+    profiling.checkpoint()
+
+    ## Write everything out.
+    intermediates.write(args.output, kanji_list, args.format)
+    if args.index:
+        intermediates.write(args.index, [{"kanji": k, "vocab": index[k]} for k in sorted(index.keys())], args.format)
+    found = len([item for item in kanji_list if item["vocab-occurrences-p"]])
+    print('Indexed ' + str(len(index)) + ' kanji; ' + str(found) + ' of ' + str(len(kanji_list)) + ' kanji details have vocab')
+
+## You saw it coming...
+if __name__ == '__main__':
+    profiling.run(main)
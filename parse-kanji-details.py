@@ -6,7 +6,10 @@
 ####  python3 parse-kanji-details.py --help
 ####
 #### Get report of current problems:
-####  python3 parse-kanji-details.py --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 漢字表\(1\).tsv --output /tmp/parsed-kanji-details.json
+####  python3 parse-kanji-details.py --check --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 漢字表\(1\).tsv --output /tmp/kanji-details-problems.json
+####
+#### A very large export, parsed by four processes:
+####  python3 parse-kanji-details.py --tsv /tmp/kanji-details.tsv --jobs 4 --output /tmp/parsed-kanji-details.json
 ####
 #### As part of a pipeline:
 ####  python3 parse-kanji-details.py --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 漢字表\(8\).tsv --output /tmp/parsed-kanji-details.json && python3 chapter-bin.py --input /tmp/parsed-kanji-details.json --pattern kanji-details --output /tmp/binned-kanji.json && python3 apply-to-chapters.py --input /tmp/binned-kanji.json --template manual-html-kanji-details.template.html --output /tmp/kh-ch
@@ -18,23 +21,262 @@
 import sys
 import argparse
 import logging
-import csv
+import stagelog
 import pystache
-import json
+import tsvrows
+import chunked
+import checks
+import intermediates
+import profiling
 import functools
 import os
-import glob
+import strokes
+import kaindex
 
 ## Logger basic setup.
-logging.basicConfig(level=logging.INFO)
-LOGGER = logging.getLogger('parse-kanji-details')
-LOGGER.setLevel(logging.WARNING)
+LOGGER = stagelog.get_logger('parse-kanji-details')
+
+## Setup some general metadata checking for the different formats.
+REQUIRED_TOTAL_COLUMNS = 14
+REQUIRED_COLUMNS = ["level", "chapter", "read-write", "kanji-raw", "reading-raw", "meaning-raw", "radical-raw", "radical-example-raw", "example-word-raw", "example-word-highlighted-raw"]
+
+## Manipulate our objects to make sure that we have the correct
+## mapping in place: kanji whose stroke images are ours, not
+## kanjialive's.
+MANUAL_LOOKUP = {'井': 'shou(i)',
+                 '阪': 'han(saka)',
+                 '俺': 'en(ore)',
+                 '扱': 'sou(atsukau)',
+                 '酔': 'sui(yo)'}
 
 def die_screaming(string):
     """ Die and take our toys home. """
     LOGGER.error(string)
     sys.exit(1)
 
+def read_rows(tsv_filename):
+    """ Yield the numbered, column-checked data rows of the TSV.
+
+    A malformed row raises a tsvrows.MalformedRowError, for parse_rows()
+    to die on once the rows before it are done.
+    """
+    yield from tsvrows.read_rows(tsv_filename, REQUIRED_TOTAL_COLUMNS, LOGGER)
+
+def _die_on_malformed(results):
+    """ Pass the results through, dying on a malformed row. """
+    try:
+        yield from results
+    except tsvrows.MalformedRowError as e:
+        die_screaming(str(e))
+
+def stroke_stem(kanji, kanjialive_lookup):
+    """ The stroke image file stem of a kanji, or None if unknown. """
+    if kanji in MANUAL_LOOKUP:
+        return MANUAL_LOOKUP[kanji]
+    if kanji in kanjialive_lookup:
+        return kanjialive_lookup[kanji]["kname"]
+    return None
+
+## The lookups for parse_row(), set by _set_lookups() (once per
+## worker, when parsing in parallel).
+_LOOKUPS = None
+
+def _set_lookups(kanjialive_lookup, stroke_manifest, strokes_dir):
+    global _LOOKUPS
+    _LOOKUPS = (kanjialive_lookup, stroke_manifest, strokes_dir)
+
+def check_row(i, line, problems, known_kanji):
+    """ Add the problems with a numbered kanji details row, without enriching it. """
+    checks.check_required(i, {"level": line[0], "chapter": line[1], "read-write": line[2], "kanji-raw": line[3],
+                              "reading-raw": line[4], "meaning-raw": line[6], "radical-raw": line[7],
+                              "radical-example-raw": line[9], "example-word-raw": line[11],
+                              "example-word-highlighted-raw": line[12]}, problems)
+    checks.check_chapter(i, line[1], problems)
+    checks.check_read_write(i, line[2], problems)
+    if len(line[3]) > 0 and line[3] not in known_kanji:
+        problems.append(checks.problem(i, "kanji-raw", "unknown-kanji", 'unknown kanji "' + line[3] + '"'))
+    if len(line[11]) > 0:
+        for exwrd_pre in [ x.strip() for x in line[11].split("|") ]:
+            if not len(exwrd_pre.split("+")) == 3:
+                problems.append(checks.problem(i, "example-word-raw", "example-word",
+                                               'example word "' + exwrd_pre + '" is not japanese+hiragana+english'))
+
+def parse_row(i, line):
+    """ Transform a numbered kanji details row into a renderable dict.
+
+    The order-dependent "read-write-changed-count" is left for
+    parse_rows() to fill in.
+    """
+
+    kanjialive_lookup, stroke_manifest, strokes_dir = _LOOKUPS
+
+    # LOGGER.info("-------")
+    # LOGGER.info(type(line[3]))
+    # LOGGER.info(len(line[3]))
+    # LOGGER.info(line[3])
+
+    ## Base parsing everything into a common object.
+    ## Additional metadata that we'll want.
+    data_object = {}
+    data_object["row"] = str(i) # inserted
+
+    data_object["level"] = str(line[0]) # req
+    data_object["chapter"] = str(line[1]) # req
+    data_object["read-write"] = line[2] if (type(line[2]) is str and line[2] in ["W", "R"]) else None # req
+    data_object["kanji-raw"] = str(line[3]) # req
+    data_object["reading-raw"] = str(line[4]) # req
+    data_object["reading-highlighted-raw"] = line[5] if (type(line[5]) is str and len(line[5]) > 0) else None # opt
+    data_object["meaning-raw"] = line[6] # req
+    data_object["radical-raw"] = line[7] # req
+    data_object["radical-meaning-raw"] = line[8] if (type(line[8]) is str and len(line[8]) > 0) else None # opt
+    data_object["radical-example-raw"] = line[9] # req
+    data_object["radical-example-notes"] = line[10] if (type(line[10]) is str and len(line[10]) > 0) else None # opt
+    data_object["example-word-raw"] = line[11] # req
+    data_object["example-word-highlighted-raw"] = line[12] # req
+    data_object["stroke-order"] = line[13] if (type(line[13]) is str and len(line[13]) > 0) else None # opt
+
+    ## Basic error checking.
+    for required_entry in REQUIRED_COLUMNS:
+        if not data_object[required_entry] is str and not len(data_object[required_entry]) > 0:
+            die_screaming('malformed line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
+
+    ## Filled in, in order, afterwards; here to keep its place.
+    data_object["read-write-changed-count"] = None
+
+    ## Convert the W/R into what will appear in that
+    ## case for mustache.
+    data_object["read-write-header"] = "読めなければいけない漢字"
+    if data_object["read-write"] == "W":
+        data_object["read-write-header"] = "書けなければいけない漢字"
+
+    ## Break down the reading field csvs to get
+    ## highlighting, etc.
+    if data_object["reading-highlighted-raw"]:
+        reading_hi_list = [ x.strip() for x in data_object["reading-highlighted-raw"].split(",")]
+    else:
+        reading_hi_list = []
+    data_object["reading-highlighted-list"] = reading_hi_list
+    reading_list = [ x.strip() for x in data_object["reading-raw"].split(",")]
+    reading_enriched = []
+    for reading_item in reading_list:
+        if reading_item in reading_hi_list:
+            reading_enriched.append({"highlighted-p": True,
+                                     "reading": reading_item})
+        else:
+            reading_enriched.append({"highlighted-p": False,
+                                     "reading": reading_item})
+    data_object["reading-list-enriched"] = reading_enriched
+
+
+    ## Break down the meaning field
+    meaning_list = [ {"reading": x.strip()} for x in data_object["meaning-raw"].split("+") ]
+    data_object["meaning-list"] = meaning_list
+
+    ## Break down the somewhat complicated example
+    ## fields.
+    exwrd_enriched = []
+    ## highlighted-example-word hightlight list to use
+    ## as key to identify for highlighting.
+    exwrd_hi_list = "^".join([ x.strip() for x in data_object["example-word-highlighted-raw"].split("+")])
+    data_object["example-word-highlighted-list"] = exwrd_hi_list
+    ## example-word
+    exwrd_pre_list = [ x.strip() for x in data_object["example-word-raw"].split("|") ]
+    for exwrd_pre in exwrd_pre_list:
+        ex_triple = [ x.strip() for x in exwrd_pre.split("+") ]
+        if not len(ex_triple) == 3:
+            die_screaming('ERROR: malformed example word with "'+exwrd_pre+'" at '+ str(i) +': '+ '\t'.join(line))
+        else:
+            exwrd_enriched.append({"japanese":
+                                   {"word": ex_triple[0],
+                                    "highlighted-p": False if "^".join(ex_triple) not in exwrd_hi_list else True},
+                                   "hiragana":
+                                   {"word": ex_triple[1],
+                                    "highlighted-p": False if "^".join(ex_triple) not in exwrd_hi_list else True},
+                                   "english":
+                                   {"word": ex_triple[2],
+                                    "highlighted-p": False if "^".join(ex_triple) not in exwrd_hi_list else True}})
+    data_object["example-word-list-enriched"] = exwrd_enriched
+
+    ## Radicals.
+    radical_list = [ {"character": x.strip()} for x in data_object["radical-raw"].split(",") ]
+    data_object["radical-list"] = radical_list
+    radical_meaning_list = [] if not data_object["radical-meaning-raw"] else [ {"meaning": x.strip()} for x in data_object["radical-meaning-raw"].split(",") ]
+    data_object["radical-meaning-list"] = radical_meaning_list
+    radical_example_list = [ {"kanji": x.strip()} for x in data_object["radical-example-raw"].split(",") ]
+    data_object["radical-example-list"] = radical_example_list
+
+    ## Okay, let's experiment with image output.
+    ## TODO: Check that our directory is in place.
+
+    file_stem = stroke_stem(data_object["kanji-raw"], kanjialive_lookup)
+    if file_stem is None:
+        die_screaming("Unknown kanji: "+data_object["kanji-raw"])
+    else:
+        stroke_list = stroke_manifest.get(file_stem, [])
+        data_object["kanji-strokes-list-manual"] = []
+        data_object["kanji-strokes-list"] = []
+        data_object["kanji-strokes-base"] = strokes_dir
+        for stroke_number, file in stroke_list:
+            if data_object["kanji-raw"] in MANUAL_LOOKUP:
+                data_object["kanji-strokes-list-manual"].append(file_stem + '_' + str(stroke_number) + '.png')
+            else:
+                data_object["kanji-strokes-list"].append(file_stem + '_' + str(stroke_number) + '.svg')
+
+    return data_object
+
+def parse_rows(rows, repo=None, kanjialive_lookup=None, stroke_manifest=None, jobs=1):
+    """ Transform numbered kanji details rows into renderable dicts, lazily.
+
+    The kanjialive lookup and stroke manifest are loaded from the repo
+    unless given (say, kept around by a long-running caller). With
+    jobs > 1, the rows are parsed in chunks by a pool of workers.
+    """
+
+    if not repo:
+        repo = os.getcwd()
+
+    ## The kanjialive data, by kanji, from its (auto-rebuilt) index.
+    if kanjialive_lookup is None:
+        kanjialive_lookup = kaindex.load_index(repo + '/kanjialive/ka_data.csv')
+
+    ## The stroke images we have, by stem, from one directory scan.
+    strokes_dir = repo + '/kanjialive/kanji_strokes/'
+    if stroke_manifest is None:
+        stroke_manifest = strokes.stroke_manifest(strokes_dir)
+    reported_stems = set()
+
+    ## Process data, formatting and adding appropriate parts to
+    ## internal format so that we can simply output in any mustache
+    ## template; then, in order, the read/write section changeover
+    ## counts and stroke image warnings.
+    last_read_write_token = None
+    changed_read_write_count = 0
+    for data_object in _die_on_malformed(chunked.map_rows(parse_row, rows, jobs, initializer=_set_lookups,
+                                                          initargs=(kanjialive_lookup, stroke_manifest, strokes_dir))):
+        if not data_object["read-write"] == str(last_read_write_token):
+            changed_read_write_count = 0
+        changed_read_write_count = changed_read_write_count + 1 # inc
+        last_read_write_token = data_object["read-write"]
+        data_object["read-write-changed-count"] = changed_read_write_count
+
+        file_stem = stroke_stem(data_object["kanji-raw"], kanjialive_lookup)
+        if file_stem not in reported_stems:
+            reported_stems.add(file_stem)
+            stroke_list = stroke_manifest.get(file_stem, [])
+            if not stroke_list:
+                LOGGER.warning('No stroke images for kanji %s (%s)', data_object["kanji-raw"], file_stem,
+                               row=data_object["row"])
+            elif strokes.missing_strokes(stroke_list):
+                LOGGER.warning('Gapped stroke images for kanji %s (%s), missing: %s', data_object["kanji-raw"], file_stem,
+                               ', '.join(str(n) for n in strokes.missing_strokes(stroke_list)), row=data_object["row"])
+
+        ## Onto the pile.
+        yield data_object
+
+def parse_tsv(tsv_filename, repo=None, jobs=1):
+    """ Parse a kanji details TSV into a list of renderable dicts. """
+    return list(parse_rows(read_rows(tsv_filename), repo, jobs=jobs))
+
 def main():
 
     ## Deal with incoming.
@@ -47,8 +289,15 @@ def main():
                         help='The TSV data file to read in')
     parser.add_argument('-r', '--repo',
                         help='[optional] The path to this repo')
+    parser.add_argument('-c', '--check', action='store_true',
+                        help='[optional] Only validate the TSV, reporting every problem as JSON (to the output file, if given)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='[optional] The number of processes to parse with, in chunks of rows')
+    parser.add_argument('-f', '--format', choices=intermediates.FORMATS, default=intermediates.FORMATS[0],
+                        help='[optional] The output format: json (default), compact (unindented JSON) or binary')
     parser.add_argument('-o', '--output',
                         help='The file to output to')
+    profiling.add_arguments(parser)
     args = parser.parse_args()
 
     ## Up the verbosity level if we want.
@@ -59,188 +308,31 @@ def main():
     ## Ensure arguments and read in what is necessary.
     if not args.tsv:
         die_screaming('need an input tsv argument')
-    LOGGER.info('Will use "' + args.tsv + '" as data')
+    LOGGER.info('Will use "%s" as data', args.tsv)
 
     if not args.repo:
         args.repo = os.getcwd()
-    LOGGER.info('Will output to: ' + args.output)
+
+    ## Only validate, reporting every problem at once; a plain set
+    ## of the kanji we know is all that is needed for that.
+    if args.check:
+        known_kanji = set(kaindex.load_index(args.repo + '/kanjialive/ka_data.csv')) | set(MANUAL_LOOKUP)
+        report = checks.check_tsv(args.tsv, 'kanji-details', REQUIRED_TOTAL_COLUMNS,
+                                  functools.partial(check_row, known_kanji=known_kanji))
+        checks.write_report(args.output, report)
+        if report["problems"]:
+            die_screaming(str(report["problem-count"]) + ' problem(s) in ' + args.tsv)
+        return
+
+    LOGGER.info('Will output to: %s', args.output)
 
     if not args.output:
         die_screaming('need an output file argument')
-    LOGGER.info('Will output to: ' + args.output)
-
-    ## Setup some general metadata checking for the different formats.
-    required_total_columns = 14
-    required_columns = ["level", "chapter", "read-write", "kanji-raw", "reading-raw", "meaning-raw", "radical-raw", "radical-example-raw", "example-word-raw", "example-word-highlighted-raw"]
-
-    ##
-    kanjialive_lookup = {}
-    with open(args.repo + '/kanjialive/ka_data.csv', 'r') as ka_in:
-        ka_in = csv.reader(ka_in, delimiter=',')
-
-        for line in ka_in:
-            kanjialive_lookup[line[0]] = line[1]
-
-    ## Bring on all data in one sweep, formatting and adding
-    ## appropriate parts to internal format so that we can simply
-    ## output in any mustache template.
-    data_list = []
-    with open(args.tsv, 'r') as tsv_in:
-        tsv_in = csv.reader(tsv_in, delimiter='\t')
-
-        ## Process data.
-        first_line_p = True
-        last_read_write_token = None
-        changed_read_write_count = 0
-        i = 0
-        for line in tsv_in:
-            i = i + 1
-            if first_line_p:
-                first_line_p = False
-                continue
-            else:
-                count = len(line)
-                if len(set(line)) == 1 and line[0] == "":
-                    LOGGER.info("Skipping completely empty line: " + str(i))
-                    continue
-                elif not count == required_total_columns:
-                    die_screaming('malformed line: '+ str(i) +' '+ '\t'.join(line))
-                else:
-
-                    # LOGGER.info("-------")
-                    # LOGGER.info(type(line[3]))
-                    # LOGGER.info(len(line[3]))
-                    # LOGGER.info(line[3])
-
-                    ## Base parsing everything into a common object.
-                    ## Additional metadata that we'll want.
-                    data_object = {}
-                    data_object["row"] = str(i) # inserted
-
-                    data_object["level"] = str(line[0]) # req
-                    data_object["chapter"] = str(line[1]) # req
-                    data_object["read-write"] = line[2] if (type(line[2]) is str and line[2] in ["W", "R"]) else None # req
-                    data_object["kanji-raw"] = str(line[3]) # req
-                    data_object["reading-raw"] = str(line[4]) # req
-                    data_object["reading-highlighted-raw"] = line[5] if (type(line[5]) is str and len(line[5]) > 0) else None # opt
-                    data_object["meaning-raw"] = line[6] # req
-                    data_object["radical-raw"] = line[7] # req
-                    data_object["radical-meaning-raw"] = line[8] if (type(line[8]) is str and len(line[8]) > 0) else None # opt
-                    data_object["radical-example-raw"] = line[9] # req
-                    data_object["radical-example-notes"] = line[10] if (type(line[10]) is str and len(line[10]) > 0) else None # opt
-                    data_object["example-word-raw"] = line[11] # req
-                    data_object["example-word-highlighted-raw"] = line[12] # req
-                    data_object["stroke-order"] = line[13] if (type(line[13]) is str and len(line[13]) > 0) else None # opt
-
-                    ## Basic error checking.
-                    for required_entry in required_columns:
-                        if not data_object[required_entry] is str and not len(data_object[required_entry]) > 0:
-                            die_screaming('malformed line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
-
-                    ## Try and get the read/write section changover
-                    ## counts.
-                    if not data_object["read-write"] == str(last_read_write_token):
-                        changed_read_write_count = 0
-                    changed_read_write_count = changed_read_write_count + 1 # inc
-                    last_read_write_token = data_object["read-write"]
-                    data_object["read-write-changed-count"] = changed_read_write_count
-
-                    ## Convert the W/R into what will appear in that
-                    ## case for mustache.
-                    data_object["read-write-header"] = "読めなければいけない漢字"
-                    if data_object["read-write"] == "W":
-                        data_object["read-write-header"] = "書けなければいけない漢字"
-
-                    ## Break down the reading field csvs to get
-                    ## highlighting, etc.
-                    if data_object["reading-highlighted-raw"]:
-                        reading_hi_list = [ x.strip() for x in data_object["reading-highlighted-raw"].split(",")]
-                    else:
-                        reading_hi_list = []
-                    data_object["reading-highlighted-list"] = reading_hi_list
-                    reading_list = [ x.strip() for x in data_object["reading-raw"].split(",")]
-                    reading_enriched = []
-                    for reading_item in reading_list:
-                        if reading_item in reading_hi_list:
-                            reading_enriched.append({"highlighted-p": True,
-                                                     "reading": reading_item})
-                        else:
-                            reading_enriched.append({"highlighted-p": False,
-                                                     "reading": reading_item})
-                    data_object["reading-list-enriched"] = reading_enriched
-
-
-                    ## Break down the meaning field
-                    meaning_list = [ {"reading": x.strip()} for x in data_object["meaning-raw"].split("+") ]
-                    data_object["meaning-list"] = meaning_list
-
-                    ## Break down the somewhat complicated example
-                    ## fields.
-                    exwrd_enriched = []
-                    ## highlighted-example-word hightlight list to use
-                    ## as key to identify for highlighting.
-                    exwrd_hi_list = "^".join([ x.strip() for x in data_object["example-word-highlighted-raw"].split("+")])
-                    data_object["example-word-highlighted-list"] = exwrd_hi_list
-                    ## example-word
-                    exwrd_pre_list = [ x.strip() for x in data_object["example-word-raw"].split("|") ]
-                    for exwrd_pre in exwrd_pre_list:
-                        ex_triple = [ x.strip() for x in exwrd_pre.split("+") ]
-                        if not len(ex_triple) == 3:
-                            die_screaming('ERROR: malformed example word with "'+exwrd_pre+'" at '+ str(i) +': '+ '\t'.join(line))
-                        else:
-                            exwrd_enriched.append({"japanese":
-                                                   {"word": ex_triple[0],
-                                                    "highlighted-p": False if "^".join(ex_triple) not in exwrd_hi_list else True},
-                                                   "hiragana":
-                                                   {"word": ex_triple[1],
-                                                    "highlighted-p": False if "^".join(ex_triple) not in exwrd_hi_list else True},
-                                                   "english":
-                                                   {"word": ex_triple[2],
-                                                    "highlighted-p": False if "^".join(ex_triple) not in exwrd_hi_list else True}})
-                    data_object["example-word-list-enriched"] = exwrd_enriched
-
-                    ## Radicals.
-                    radical_list = [ {"character": x.strip()} for x in data_object["radical-raw"].split(",") ]
-                    data_object["radical-list"] = radical_list
-                    radical_meaning_list = [] if not data_object["radical-meaning-raw"] else [ {"meaning": x.strip()} for x in data_object["radical-meaning-raw"].split(",") ]
-                    data_object["radical-meaning-list"] = radical_meaning_list
-                    radical_example_list = [ {"kanji": x.strip()} for x in data_object["radical-example-raw"].split(",") ]
-                    data_object["radical-example-list"] = radical_example_list
-
-                    ## Manipulate our objects to make sure that we
-                    ## have the correct mapping in place.
-                    manual_list = ['井', '阪', '俺', '扱', '酔']
-                    kanjialive_lookup['井'] = 'shou(i)'
-                    kanjialive_lookup['阪'] = 'han(saka)'
-                    kanjialive_lookup['俺'] = 'en(ore)'
-                    kanjialive_lookup['扱'] = 'sou(atsukau)'
-                    kanjialive_lookup['酔'] = 'sui(yo)'
-
-                    ## Okay, let's experiment with image output.
-                    ## TODO: Check that our directory is in place.
-
-                    if not data_object["kanji-raw"] in kanjialive_lookup and not data_object["kanji-raw"] in manual_list:
-                        die_screaming("Unknown kanji: "+data_object["kanji-raw"])
-                    else:
-                        file_stem = kanjialive_lookup[data_object["kanji-raw"]]
-                        files = glob.glob(args.repo + '/kanjialive/kanji_strokes/' + file_stem + '_*')
-                        data_object["kanji-strokes-list-manual"] = []
-                        data_object["kanji-strokes-list"] = []
-                        data_object["kanji-strokes-base"] = args.repo + '/kanjialive/kanji_strokes/'
-                        for i, file in enumerate(files):
-                            if data_object["kanji-raw"] in manual_list:
-                                data_object["kanji-strokes-list-manual"].append(file_stem + '_' + str(i+1) + '.png')
-                            else:
-                                data_object["kanji-strokes-list"].append(file_stem + '_' + str(i+1) + '.svg')
-
-                    ## Onto the pile.
-                    data_list.append(data_object)
-
-    ## Dump to given file.
-    #LOGGER.info(json.dumps(data_list, indent = 4))
-    with open(args.output, 'w') as output:
-            output.write(json.dumps(data_list, indent = 4))
+    LOGGER.info('Will output to: %s', args.output)
+
+    ## Parse and dump to given file, row by row.
+    intermediates.write_list(args.output, parse_rows(read_rows(args.tsv), args.repo, jobs=args.jobs), args.format)
 
 ## You saw it coming...
 if __name__ == '__main__':
-    main()
+    profiling.run(main)
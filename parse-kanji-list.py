@@ -6,7 +6,10 @@
 ####  python3 parse.py --help
 ####
 #### Get report of current problems:
-####  python3 parse-kanji-list.py --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 漢字リス ト.tsv --output /tmp/parsed-kanji-list.json
+####  python3 parse-kanji-list.py --check --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 漢字リス ト.tsv --output /tmp/kanji-list-problems.json
+####
+#### A very large export, parsed by four processes:
+####  python3 parse-kanji-list.py --tsv /tmp/kanji-list.tsv --jobs 4 --output /tmp/parsed-kanji-list.json
 ####
 #### As part of a pipeline:
 ####  python3 parse-kanji-list.py --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 漢字リス ト\(1\).tsv --output /tmp/parsed-kanji-list.json && python3 chapter-bin.py -v --pattern kanji-list --input /tmp/parsed-kanji-list.json --output /tmp/chapters-kl.json && python3 apply-to-chapters.py --template manual-html-kanji-list.template.html --input /tmp/chapters-kl.json --output /tmp/ch-kl
@@ -15,22 +18,134 @@
 import sys
 import argparse
 import logging
-import csv
+import stagelog
 import pystache
-import json
-import functools
-import os
+import tsvrows
+import chunked
+import checks
+import intermediates
+import highlight
+import profiling
 
 ## Logger basic setup.
-logging.basicConfig(level=logging.INFO)
-LOGGER = logging.getLogger('parse')
-LOGGER.setLevel(logging.WARNING)
+LOGGER = stagelog.get_logger('parse-kanji-list')
+
+## Setup some general metadata checking for the different formats.
+REQUIRED_TOTAL_COLUMNS = 12
+REQUIRED_COLUMNS = ["level", "chapter", "read-write", "kanji-raw", "hiragana-raw", "meaning"]
 
 def die_screaming(string):
     """ Die and take our toys home. """
     LOGGER.error(string)
     sys.exit(1)
 
+def read_rows(tsv_filename):
+    """ Yield the numbered, column-checked data rows of the TSV.
+
+    A malformed row raises a tsvrows.MalformedRowError, for parse_rows()
+    to die on once the rows before it are done.
+    """
+    yield from tsvrows.read_rows(tsv_filename, REQUIRED_TOTAL_COLUMNS, LOGGER)
+
+def _die_on_malformed(results):
+    """ Pass the results through, dying on a malformed row. """
+    try:
+        yield from results
+    except tsvrows.MalformedRowError as e:
+        die_screaming(str(e))
+
+def check_row(i, line, problems):
+    """ Add the problems with a numbered kanji list row, without enriching it. """
+    checks.check_required(i, {"level": line[0], "chapter": line[1], "read-write": line[2],
+                              "kanji-raw": line[3], "hiragana-raw": line[4], "meaning": line[8]}, problems)
+    checks.check_chapter(i, line[1], problems)
+    checks.check_read_write(i, line[2], problems)
+
+def parse_row(i, line):
+    """ Transform a numbered kanji list row into a renderable dict.
+
+    The order-dependent "read-write-changed-count" is left for
+    parse_rows() to fill in.
+    """
+
+    # LOGGER.info("-------")
+    # LOGGER.info(type(line[3]))
+    # LOGGER.info(len(line[3]))
+    # LOGGER.info(line[3])
+
+    ## Base parsing everything into a common object.
+    ## Additional metadata that we'll want.
+    data_object = {}
+    data_object["row"] = str(i) # inserted
+
+    data_object["level"] = str(line[0]) # req
+    data_object["chapter"] = str(line[1]) # req
+    data_object["read-write"] = line[2] if (type(line[2]) is str and line[2] in ["W", "R"]) else None # req
+    data_object["kanji-raw"] = str(line[3]) # req
+    data_object["hiragana-raw"] = str(line[4]) # req
+    data_object["introduced"] = str(line[5]) # opt
+    data_object["kanji-new"] = str(line[6]) # opt
+    data_object["reading-new"] = str(line[7]) # opt
+    data_object["meaning"] = line[8] # req
+    data_object["section"] = line[9] if (type(line[9]) is str and len(line[9]) > 0) else None # opt
+    data_object["kanji-sightings"] = str(line[10]) # opt
+    data_object["notes"] = line[11] if (type(line[11]) is str and len(line[11]) > 0) else None # opt
+
+    ## Basic error checking.
+    for required_entry in REQUIRED_COLUMNS:
+        try:
+            if not data_object[required_entry] is str and not len(data_object[required_entry]) > 0:
+                die_screaming('malformed line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
+        except:
+            die_screaming('exception line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
+
+    ## Filled in, in order, afterwards; here to keep its place.
+    data_object["read-write-changed-count"] = None
+
+    ## Convert the W/R into what will appear in that
+    ## case for mustache.
+    data_object["read-write-header"] = "読めなければいけない漢字"
+    if data_object["read-write"] == "W":
+        data_object["read-write-header"] = "書けなければいけない漢字"
+
+    ## Bold for the new kanji, dotted for the introduced kanji;
+    ## the dotted span is the outer one where they meet.
+    kr = data_object["kanji-raw"]
+    data_object["kanji-atomized"] = highlight.segment(kr, [
+        highlight.find_span(kr, data_object["introduced"], "token-dot-start-p", "token-dot-end-p"),
+        highlight.find_span(kr, data_object["kanji-new"], "token-bold-start-p", "token-bold-end-p")])
+
+    ## Underlining for hiragana.
+    data_object["hiragana-atomized"] = highlight.segment(data_object["hiragana-raw"], [
+        highlight.find_span(data_object["hiragana-raw"], data_object["reading-new"],
+                            "token-underline-start-p", "token-underline-end-p")])
+
+    return data_object
+
+def parse_rows(rows, jobs=1):
+    """ Transform numbered kanji list rows into renderable dicts, lazily.
+
+    With jobs > 1, the rows are parsed in chunks by a pool of workers.
+    """
+
+    ## Try and get the read/write section changover counts, in
+    ## order.
+    last_read_write_token = None
+    changed_read_write_count = 0
+    for data_object in _die_on_malformed(chunked.map_rows(parse_row, rows, jobs)):
+        if not data_object["read-write"] == str(last_read_write_token):
+            changed_read_write_count = 0
+        changed_read_write_count = changed_read_write_count + 1 # inc
+        last_read_write_token = data_object["read-write"]
+        data_object["read-write-changed-count"] = changed_read_write_count
+
+        ## Onto the pile.
+        yield data_object
+
+def parse_tsv(tsv_filename, jobs=1):
+    """ Parse a kanji list TSV into a list of renderable dicts. """
+    return list(parse_rows(read_rows(tsv_filename), jobs))
+
 def main():
 
     ## Deal with incoming.
@@ -41,8 +156,15 @@ def main():
                         help='More verbose output')
     parser.add_argument('-t', '--tsv',
                         help='The TSV data file to read in')
+    parser.add_argument('-c', '--check', action='store_true',
+                        help='[optional] Only validate the TSV, reporting every problem as JSON (to the output file, if given)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='[optional] The number of processes to parse with, in chunks of rows')
+    parser.add_argument('-f', '--format', choices=intermediates.FORMATS, default=intermediates.FORMATS[0],
+                        help='[optional] The output format: json (default), compact (unindented JSON) or binary')
     parser.add_argument('-o', '--output',
                         help='The file to output to')
+    profiling.add_arguments(parser)
     args = parser.parse_args()
 
     ## Up the verbosity level if we want.
@@ -53,170 +175,23 @@ def main():
     ## Ensure arguments and read in what is necessary.
     if not args.tsv:
         die_screaming('need an input tsv argument')
-    LOGGER.info('Will use "' + args.tsv + '" as data')
+    LOGGER.info('Will use "%s" as data', args.tsv)
+
+    ## Only validate, reporting every problem at once.
+    if args.check:
+        report = checks.check_tsv(args.tsv, 'kanji-list', REQUIRED_TOTAL_COLUMNS, check_row)
+        checks.write_report(args.output, report)
+        if report["problems"]:
+            die_screaming(str(report["problem-count"]) + ' problem(s) in ' + args.tsv)
+        return
 
     if not args.output:
         die_screaming('need an output file argument')
-    LOGGER.info('Will output to: ' + args.output)
-
-    ## Setup some general metadata checking for the different formats.
-    required_total_columns = 12
-    required_columns = ["level", "chapter", "read-write", "kanji-raw", "hiragana-raw", "meaning"]
-
-    ## Bring on all data in one sweep, formatting and adding
-    ## appropriate parts to internal format so that we can simply
-    ## output in any mustache template.
-    data_list = []
-    with open(args.tsv, 'r') as tsv_in:
-        tsv_in = csv.reader(tsv_in, delimiter='\t')
-
-        ## Process data.
-        first_line_p = True
-        last_read_write_token = None
-        changed_read_write_count = 0
-        i = 0
-        for line in tsv_in:
-            i = i + 1
-            if first_line_p:
-                first_line_p = False
-                continue
-            else:
-                count = len(line)
-                if len(set(line)) == 1 and line[0] == "":
-                    LOGGER.info("Skipping completely empty line: " + str(i))
-                    continue
-                elif not count == required_total_columns:
-                    die_screaming('malformed line: '+ str(i) +' '+ '\t'.join(line))
-                else:
-
-                    # LOGGER.info("-------")
-                    # LOGGER.info(type(line[3]))
-                    # LOGGER.info(len(line[3]))
-                    # LOGGER.info(line[3])
-
-                    ## Base parsing everything into a common object.
-                    ## Additional metadata that we'll want.
-                    data_object = {}
-                    data_object["row"] = str(i) # inserted
-
-                    data_object["level"] = str(line[0]) # req
-                    data_object["chapter"] = str(line[1]) # req
-                    data_object["read-write"] = line[2] if (type(line[2]) is str and line[2] in ["W", "R"]) else None # req
-                    data_object["kanji-raw"] = str(line[3]) # req
-                    data_object["hiragana-raw"] = str(line[4]) # req
-                    data_object["introduced"] = str(line[5]) # opt
-                    data_object["kanji-new"] = str(line[6]) # opt
-                    data_object["reading-new"] = str(line[7]) # opt
-                    data_object["meaning"] = line[8] # req
-                    data_object["section"] = line[9] if (type(line[9]) is str and len(line[9]) > 0) else None # opt
-                    data_object["kanji-sightings"] = str(line[10]) # opt
-                    data_object["notes"] = line[11] if (type(line[11]) is str and len(line[11]) > 0) else None # opt
-
-                    ## Basic error checking.
-                    for required_entry in required_columns:
-                        try:
-                            if not data_object[required_entry] is str and not len(data_object[required_entry]) > 0:
-                                die_screaming('malformed line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
-                        except:
-                            die_screaming('exception line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
-
-                    ## Try and get the read/write section changover
-                    ## counts.
-                    if not data_object["read-write"] == str(last_read_write_token):
-                        changed_read_write_count = 0
-                    changed_read_write_count = changed_read_write_count + 1 # inc
-                    last_read_write_token = data_object["read-write"]
-                    data_object["read-write-changed-count"] = changed_read_write_count
-
-                    ## Convert the W/R into what will appear in that
-                    ## case for mustache.
-                    data_object["read-write-header"] = "読めなければいけない漢字"
-                    if data_object["read-write"] == "W":
-                        data_object["read-write-header"] = "書けなければいけない漢字"
-
-                    ## Atomize the two strings that will need detailed
-                    ## highlighting.
-                    data_object["kanji-atomized"] = [{"chr": x} for x in list(data_object["kanji-raw"])]
-
-                    ## Underlining for hiragana. Start by atomizing it.
-                    hm = [{"chr": x} for x in list(data_object["hiragana-raw"])]
-                    data_object["hiragana-atomized"] = hm
-                    hr = data_object["hiragana-raw"]
-                    rn = data_object["reading-new"]
-                    if hr and rn:
-                        if not hr.find(rn) == -1:
-                                spoint = hr.find(rn)
-                                epoint = hr.find(rn) + len(rn)
-                                data_object["hiragana-atomized"].insert(epoint, {"token-underline-end-p": True})
-                                data_object["hiragana-atomized"].insert(spoint, {"token-underline-start-p": True})
-
-                    ## Underlining for kaniji; a little more
-                    ## complicated as we need to do two at the same
-                    ## time. Start by atomizing it.
-                    points_list = []
-                    data_object["kanji-atomized"] = [{"chr": x} for x in list(data_object["kanji-raw"])]
-                    kr = data_object["kanji-raw"]
-                    kn = data_object["kanji-new"]
-                    ki = data_object["introduced"] # kanji introduced
-                    if kr and kn:
-                        if not kr.find(kn) == -1:
-                                kn_start_point = kr.find(kn)
-                                kn_end_point = kr.find(kn) + len(kn)
-                                points_list.append({"point": kn_end_point,
-                                                    "type": "new",
-                                                    "pos": "end",
-                                                    "token": "token-bold-end-p"})
-                                points_list.append({"point": kn_start_point,
-                                                    "type": "new",
-                                                    "pos": "start",
-                                                    "token": "token-bold-start-p"})
-                    if kr and ki:
-                        if not kr.find(ki) == -1:
-                                ki_start_point = kr.find(ki)
-                                ki_end_point = kr.find(ki) + len(ki)
-                                points_list.append({"point": ki_end_point,
-                                                    "type": "intro",
-                                                    "pos": "end",
-                                                    "token": "token-dot-end-p"})
-                                points_list.append({"point": ki_start_point,
-                                                    "type": "intro",
-                                                    "pos": "start",
-                                                    "token": "token-dot-start-p"})
-                    ## Order the points list using a custom comparison
-                    ## to make sure that the overlaps are symmetric
-                    ## the way we want.
-                    def points_sort(b, a):
-                        if a["point"] > b["point"]:
-                            return 1
-                        elif a["point"] < b["point"]:
-                            return -1
-                        else:
-                            scale = {"new-start": 1,
-                                     "intro-start": 2,
-                                     "intro-end": 3,
-                                     "new-end": 4}
-                            bstr = b["type"] + "-" + b["pos"]
-                            astr = a["type"] + "-" + a["pos"]
-                            if scale[bstr] - scale[astr] > 0:
-                                return 1
-                            else:
-                                return -1
-                    sorted_points_list = sorted(points_list, key=functools.cmp_to_key(points_sort))
-                    #data_object["points-list"] = sorted_points_list
-
-                    ## Finally, inject the points into the atomized
-                    ## kanji.
-                    for point in sorted_points_list:
-                        data_object["kanji-atomized"].insert(point["point"], {point["token"]: True})
-
-                    ## Onto the pile.
-                    data_list.append(data_object)
-
-    ## Dump to given file.
-    #LOGGER.info(json.dumps(data_list, indent = 4))
-    with open(args.output, 'w') as output:
-            output.write(json.dumps(data_list, indent = 4))
+    LOGGER.info('Will output to: %s', args.output)
+
+    ## Parse and dump to given file, row by row.
+    intermediates.write_list(args.output, parse_rows(read_rows(args.tsv), args.jobs), args.format)
 
 ## You saw it coming...
 if __name__ == '__main__':
-    main()
+    profiling.run(main)
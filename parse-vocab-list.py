@@ -6,7 +6,10 @@
 ####  python3 parse.py --help
 ####
 #### Get report of current problems:
-####  python3 parse-vocab-list.py --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 単語リス ト\(4\).tsv --output /tmp/parsed-vocab-list.json
+####  python3 parse-vocab-list.py --check --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 単語リス ト\(4\).tsv --output /tmp/vocab-list-problems.json
+####
+#### A very large export, parsed by four processes:
+####  python3 parse-vocab-list.py --tsv /tmp/vocab-list.tsv --jobs 4 --output /tmp/parsed-vocab-list.json
 ####
 #### As part of a pipeline for vocab list:
 ####  python3 parse-vocab-list.py --tsv ~/Downloads/UCSC中上級教科書_漢字・単語リスト\ -\ 単語リス ト\(13\).tsv --output /tmp/parsed-vocab-list.json && python3 chapter-bin.py -v --input /tmp/parsed-vocab-list.json --output /tmp/chapters.json && python3 apply-to-chapters.py --input /tmp/chapters.json --template ./word-html-frame.template.html --output /tmp/chapter
@@ -18,21 +21,153 @@
 import sys
 import argparse
 import logging
-import csv
+import stagelog
 import pystache
-import json
-import os
+import tsvrows
+import chunked
+import checks
+import ruby
+import intermediates
+import profiling
 
 ## Logger basic setup.
-logging.basicConfig(level=logging.INFO)
-LOGGER = logging.getLogger('parse')
-LOGGER.setLevel(logging.WARNING)
+LOGGER = stagelog.get_logger('parse-vocab-list')
+
+## Setup some general metadata checking for the different formats.
+REQUIRED_TOTAL_COLUMNS = 10
+REQUIRED_COLUMNS = ["level", "chapter", "raw-japanese", "reading", "meaning"]
+
+## Make some other mappings for commonly used sections names.
+SECTION_NAMES_ALT = {#None: "",
+                     "読み物　一": "R.1",
+                     "会話　一": "D.1",
+                     "読み物　二": "R.2",
+                     "会話　二": "D.2",
+                     "読み物　三": "R.3",
+                     "会話　三": "D.3",
+                     "読み物　四": "R.4",
+                     "会話　四": "D.4"}
+
+class RequiredFieldError(ValueError):
+    """ A row with a required column left empty. """
+    pass
 
 def die_screaming(string):
     """ Die and take our toys home. """
     LOGGER.error(string)
     sys.exit(1)
 
+def read_rows(tsv_filename, malformed=None):
+    """ Yield the numbered, column-checked data rows of the TSV.
+
+    A malformed row raises a tsvrows.MalformedRowError, for parse_rows()
+    to die on once the rows before it are done; given a malformed list,
+    it is added to that instead and skipped.
+    """
+    yield from tsvrows.read_rows(tsv_filename, REQUIRED_TOTAL_COLUMNS, LOGGER, malformed)
+
+def check_row(i, line, problems):
+    """ Add the problems with a numbered vocab list row, without enriching it. """
+    checks.check_required(i, {"level": line[0], "chapter": line[1], "raw-japanese": line[2],
+                              "reading": line[4], "meaning": line[5]}, problems)
+    checks.check_chapter(i, line[1], problems)
+
+    ## Only the sections that chapter-bin.py knows how to order.
+    if len(line[6]) > 0 and line[6] not in SECTION_NAMES_ALT:
+        problems.append(checks.problem(i, "section", "section", 'unknown section "' + line[6] + '"'))
+
+    try:
+        ruby.align_ruby(line[2], ruby.parse_ruby(line[3] if len(line[3]) > 0 else None))
+    except ruby.RubyError as e:
+        problems.append(checks.problem(i, "raw-ruby", "ruby", str(e)))
+
+def parse_row(i, line):
+    """ Transform a numbered vocab list row into a renderable dict.
+
+    Raises a RequiredFieldError if a required column is empty, or a
+    ruby.RubyError if the row's ruby does not fit.
+    """
+
+    # LOGGER.info("-------")
+    # LOGGER.info(type(line[3]))
+    # LOGGER.info(len(line[3]))
+    # LOGGER.info(line[3])
+
+    ## Base parsing everything into a common object.
+    ## Additional metadata that we'll want.
+    data_object = {}
+    data_object["row"] = str(i) # inserted
+
+    data_object["level"] = str(line[0]) # req
+    data_object["chapter"] = str(line[1]) # req
+    data_object["raw-japanese"] = str(line[2]) # req
+    data_object["raw-ruby"] = line[3] if (type(line[3]) is str and len(line[3]) > 0) else None # opt
+    data_object["reading"] = str(line[4]) # req
+    data_object["meaning"] = line[5] # req
+    data_object["section"] = line[6] if (type(line[6]) is str and len(line[6]) > 0) else None # opt
+    data_object["extra"] = True if (type(line[7]) is str and line[7] == '*') else None # opt
+    data_object["grammar-point"] = line[8] if (type(line[8]) is str and len(line[8]) > 0) else None # opt
+    data_object["notes"] = line[9] if (type(line[9]) is str and len(line[9]) > 0) else None # opt
+
+    ## Basic error checking.
+    for required_entry in REQUIRED_COLUMNS:
+        if not data_object[required_entry] is str and not len(data_object[required_entry]) > 0:
+            raise RequiredFieldError('malformed line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
+
+    ## Make some other mappings for commonly used
+    ## sections names.
+    if data_object["section"] in SECTION_NAMES_ALT.keys():
+        data_object["section-alt-en-short"] = SECTION_NAMES_ALT[data_object["section"]]
+
+    ## Transform the comma/pipe-separated data raw "Ruby"
+    ## object into something usable, if extant, and create a
+    ## new version of the "Japanese" ("raw-japanese") column
+    ## with mustache renderable data hints. Problems are
+    ## raised for parse_rows() to collect.
+    data_object["ruby"] = ruby.parse_ruby(data_object["raw-ruby"])
+    data_object["rich-japanese"] = ruby.align_ruby(data_object["raw-japanese"], data_object["ruby"])
+
+    return data_object
+
+def parse_rows(rows, jobs=1, malformed=None):
+    """ Transform numbered vocab list rows into renderable dicts, lazily.
+
+    With jobs > 1, the rows are parsed in chunks by a pool of workers.
+    Given the malformed list that read_rows() was given, the malformed
+    rows join the report of bad rows at the end.
+    """
+
+    ## Rows missing required columns and bad japanese/ruby rows are
+    ## collected for a single report at the end. Without a malformed
+    ## list, a malformed row ends the reading, but joins the report.
+    failures = []
+    try:
+        for data_object in chunked.map_rows(parse_row, rows, jobs, errors=(RequiredFieldError, ruby.RubyError)):
+            if isinstance(data_object, (RequiredFieldError, ruby.RubyError)):
+                failures.append(data_object)
+                continue
+
+            ## Onto the pile.
+            yield data_object
+    except tsvrows.MalformedRowError as e:
+        failures.append(e)
+    if malformed:
+        failures = sorted(failures + malformed, key=lambda e: e.row)
+
+    ## Report every bad row at once.
+    if failures:
+        for e in failures:
+            if isinstance(e, ruby.RubyError):
+                LOGGER.error('bad japanese/ruby at line %d: %s', e.row, e, row=e.row)
+            else:
+                LOGGER.error('%s', e, row=e.row)
+        die_screaming('bad row(s) at ' + str(len(failures)) + ' line(s): ' + ', '.join(str(e.row) for e in failures))
+
+def parse_tsv(tsv_filename, jobs=1):
+    """ Parse a vocab list TSV into a list of renderable dicts. """
+    malformed = []
+    return list(parse_rows(read_rows(tsv_filename, malformed), jobs, malformed))
+
 def main():
 
     ## Deal with incoming.
@@ -43,8 +178,15 @@ def main():
                         help='More verbose output')
     parser.add_argument('-t', '--tsv',
                         help='The TSV data file to read in')
+    parser.add_argument('-c', '--check', action='store_true',
+                        help='[optional] Only validate the TSV, reporting every problem as JSON (to the output file, if given)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='[optional] The number of processes to parse with, in chunks of rows')
+    parser.add_argument('-f', '--format', choices=intermediates.FORMATS, default=intermediates.FORMATS[0],
+                        help='[optional] The output format: json (default), compact (unindented JSON) or binary')
     parser.add_argument('-o', '--output',
                         help='The file to output to')
+    profiling.add_arguments(parser)
     args = parser.parse_args()
 
     ## Up the verbosity level if we want.
@@ -55,172 +197,24 @@ def main():
     ## Ensure arguments and read in what is necessary.
     if not args.tsv:
         die_screaming('need an input tsv argument')
-    LOGGER.info('Will use "' + args.tsv + '" as data')
+    LOGGER.info('Will use "%s" as data', args.tsv)
+
+    ## Only validate, reporting every problem at once.
+    if args.check:
+        report = checks.check_tsv(args.tsv, 'vocab-list', REQUIRED_TOTAL_COLUMNS, check_row)
+        checks.write_report(args.output, report)
+        if report["problems"]:
+            die_screaming(str(report["problem-count"]) + ' problem(s) in ' + args.tsv)
+        return
 
     if not args.output:
         die_screaming('need an output file argument')
-    LOGGER.info('Will output to: ' + args.output)
-
-    ## Setup some general metadata checking for the different formats.
-    required_total_columns = 10
-    required_columns = ["level", "chapter", "raw-japanese", "reading", "meaning"]
-
-    ## Bring on all data in one sweep, formatting and adding
-    ## appropriate parts to internal format so that we can simply
-    ## output in any mustache template.
-    data_list = []
-    with open(args.tsv, 'r') as tsv_in:
-        tsv_in = csv.reader(tsv_in, delimiter='\t')
-
-        ## Process data.
-        first_line_p = True
-        i = 0
-        for line in tsv_in:
-            i = i + 1
-            if first_line_p:
-                first_line_p = False
-                continue
-            else:
-                count = len(line)
-                if len(set(line)) == 1 and line[0] == "":
-                    LOGGER.info("Skipping completely empty line: " + str(i))
-                    continue
-                elif not count == required_total_columns:
-                    die_screaming('malformed line: '+ str(i) +' '+ '\t'.join(line))
-                else:
-
-                    # LOGGER.info("-------")
-                    # LOGGER.info(type(line[3]))
-                    # LOGGER.info(len(line[3]))
-                    # LOGGER.info(line[3])
-
-                    ## Base parsing everything into a common object.
-                    ## Additional metadata that we'll want.
-                    data_object = {}
-                    data_object["row"] = str(i) # inserted
-
-                    data_object["level"] = str(line[0]) # req
-                    data_object["chapter"] = str(line[1]) # req
-                    data_object["raw-japanese"] = str(line[2]) # req
-                    data_object["raw-ruby"] = line[3] if (type(line[3]) is str and len(line[3]) > 0) else None # opt
-                    data_object["reading"] = str(line[4]) # req
-                    data_object["meaning"] = line[5] # req
-                    data_object["section"] = line[6] if (type(line[6]) is str and len(line[6]) > 0) else None # opt
-                    data_object["extra"] = True if (type(line[7]) is str and line[7] == '*') else None # opt
-                    data_object["grammar-point"] = line[8] if (type(line[8]) is str and len(line[8]) > 0) else None # opt
-                    data_object["notes"] = line[9] if (type(line[9]) is str and len(line[9]) > 0) else None # opt
-
-                    ## Basic error checking.
-                    for required_entry in required_columns:
-                        if not data_object[required_entry] is str and not len(data_object[required_entry]) > 0:
-                            die_screaming('malformed line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
-
-                    ## Make some other mappings for commonly used
-                    ## sections names.
-                    section_names_alt = {#None: "",
-                                         "読み物　一": "R.1",
-                                         "会話　一": "D.1",
-                                         "読み物　二": "R.2",
-                                         "会話　二": "D.2",
-                                         "読み物　三": "R.3",
-                                         "会話　三": "D.3",
-                                         "読み物　四": "R.4",
-                                         "会話　四": "D.4"}
-                    if data_object["section"] in section_names_alt.keys():
-                        data_object["section-alt-en-short"] = section_names_alt[data_object["section"]]
-
-                    ## Transform the comma/pipe-separated data raw "Ruby"
-                    ## object into something usable, if extant.
-                    # LOGGER.info(data_object["raw-ruby"])
-                    ruby = []
-                    if data_object["raw-ruby"]:
-                        try:
-                            ruby_set_list_raw = data_object["raw-ruby"].split(",")
-                            for ruby_set_raw in ruby_set_list_raw:
-                                ruby_set_pre = ruby_set_raw.strip()
-                                LOGGER.info("ruby_set_pre: " + ruby_set_pre)
-                                ruby_set = ruby_set_pre.split("|")
-                                ruby_kanji = ruby_set[0].strip()
-                                ruby_reading = ruby_set[1].strip()
-                                ruby.append({"kanji": ruby_kanji,
-                                             "reading": ruby_reading})
-                        except:
-                            die_screaming('error parsing ruby at '+ str(i) +': '+ '\t'.join(line))
-                    data_object["ruby"] = ruby
-
-                    ## Now that we have the ruby parsed, create a new
-                    ## version of the "Japanese" ("raw-japanese")
-                    ## column with mustache renderable data hints.
-                    LOGGER.info('^^^')
-                    j = data_object["raw-japanese"]
-                    remaining_rubys = len(ruby)
-                    ruby_parse_data = []
-                    for r in ruby:
-                        ## Case when kanji not found in remaining
-                        ## japanese.
-                        LOGGER.info("japanese: " + j)
-                        LOGGER.info("kanji: " + r["kanji"])
-                        LOGGER.info("reading: " + r["reading"])
-                        if j.find(r["kanji"]) == -1:
-                            LOGGER.info('malformed line at '+ str(i) +': '+ '\t'.join(line))
-                            die_screaming('bad japanese/ruby at line '+ str(i))
-                        else:
-
-                            ## Some numbers we'll want on hand.
-                            jl = len(j) # the remaining length of the japanese
-                            rl = len(r["kanji"]) # the length of the ruby
-                            offset = j.find(r["kanji"]) # the offset of the kanji
-                            LOGGER.info(str(jl))
-                            LOGGER.info(str(rl))
-                            LOGGER.info(str(offset))
-
-                            ## Get the pre-ruby string added, if
-                            ## extant.
-                            if offset == 0:
-                                pass
-                            else:
-                                pre_string = j[0:(offset)]
-                                LOGGER.info('pre_string: ' + pre_string)
-                                ruby_parse_data.append({"string": pre_string,
-                                                            "has-ruby": False})
-
-                            ## Add the ruby string section.
-                            ruby_string = j[offset:(offset+rl)]
-                            LOGGER.info('ruby_string: ' + ruby_string)
-                            ruby_parse_data.append({"string": ruby_string,
-                                                    "reading":r["reading"],
-                                                    "has-ruby": True})
-
-                            ## If this is the last ruby we're dealing
-                            ## with, we're done and add the rest of
-                            ## the string. Otherwise, "soft loop" on
-                            ## the shorter string and next ruby.
-                            remaining_rubys = remaining_rubys - 1
-                            if remaining_rubys == 0:
-                                ## Last one, add any remaining string.
-                                if (offset+rl) < jl:
-                                    post_string = j[(offset+rl):jl]
-                                    LOGGER.info('post_string: ' + post_string)
-                                    ruby_parse_data.append({"string": post_string,
-                                                            "has-ruby": False})
-                            else:
-                                j = j[(offset+rl):jl]
-
-                    data_object["rich-japanese"] = ruby_parse_data
-
-                    ## Basic error checking.
-                    for required_entry in required_columns:
-                        if not data_object[required_entry] is str and not len(data_object[required_entry]) > 0:
-                            die_screaming('malformed line with "'+required_entry+'" at '+ str(i) +': '+ '\t'.join(line))
-
-                    ## Onto the pile.
-                    data_list.append(data_object)
-
-    ## Dump to given file.
-    #LOGGER.info(json.dumps(data_list, indent = 4))
-    with open(args.output, 'w') as output:
-            output.write(json.dumps(data_list, indent = 4))
+    LOGGER.info('Will output to: %s', args.output)
+
+    ## Parse and dump to given file, row by row.
+    malformed = []
+    intermediates.write_list(args.output, parse_rows(read_rows(args.tsv, malformed), args.jobs, malformed), args.format)
 
 ## You saw it coming...
 if __name__ == '__main__':
-    main()
+    profiling.run(main)
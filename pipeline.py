@@ -0,0 +1,201 @@
+####
+#### Run a whole parse -> bin -> render pipeline in a single process,
+#### passing the records between the stages in memory.
+####
+#### Each stage is the same code as the stand-alone scripts
+#### (parse-*.py, chapter-bin.py, jalphabetical-bin.py, apply-*.py);
+#### intermediate JSON files are only written when asked for.
+####
+#### Example usage to analyze the usual suspects:
+####  python3 pipeline.py --help
+####
+#### Vocab list chapters:
+####  python3 pipeline.py --pipeline vocab-list --tsv /tmp/vocab-list.tsv --template word-html-vocab-list.template.html --output /tmp/chapter
+####
+#### Glossary, keeping the intermediate JSON around:
+####  python3 pipeline.py --pipeline vocab-glossary --tsv /tmp/vocab-list.tsv --template manual-glossary.template.html --output /tmp/glossary.html --intermediates /tmp
+####
+#### Both glossaries from one parse:
+####  python3 pipeline.py --pipeline vocab-glossary --tsv /tmp/vocab-list.tsv --template manual-glossary.template.html --output /tmp/glossary.html --template word-glossary.template.html --output /tmp/word-glossary.html
+####
+#### Kanji details chapters, with repo specified:
+####  python3 pipeline.py --pipeline kanji-details --tsv /tmp/kanji-details.tsv --repo /home/sjcarbon/local/src/git/textbook-project-data --template manual-html-kanji-details.template.html --output /tmp/kh-ch
+####
+
+import sys
+import argparse
+import logging
+import stagelog
+import intermediates
+import profiling
+import os
+import importlib.util
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('pipeline')
+
+## The directory that the stage scripts live in.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+## The known pipelines, as:
+##  name: (parse stage, bin stage, bin pattern, apply stage)
+PIPELINES = {
+    "vocab-list": ("parse-vocab-list", "chapter-bin", "vocab-list", "apply-to-chapters"),
+    "vocab-glossary": ("parse-vocab-list", "jalphabetical-bin", "vocab-list", "apply-globally"),
+    "kanji-list": ("parse-kanji-list", "chapter-bin", "kanji-list", "apply-to-chapters"),
+    "kanji-details": ("parse-kanji-details", "chapter-bin", "kanji-details", "apply-to-chapters"),
+}
+
+## Loaded stage modules, by script name.
+_STAGES = {}
+
+def die_screaming(string):
+    """ Die and take our toys home. """
+    LOGGER.error(string)
+    sys.exit(1)
+
+def load_stage(name):
+    """ Import a (hyphenated) stage script, like "chapter-bin", once. """
+    if name not in _STAGES:
+        path = os.path.join(SCRIPT_DIR, name + '.py')
+        spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+        module = importlib.util.module_from_spec(spec)
+        ## Registered so that pool workers can find stage functions.
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+        _STAGES[name] = module
+    return _STAGES[name]
+
+def write_intermediate(directory, name, data_list, output_format="json"):
+    """ Write an intermediate in the same formats the scripts use. """
+    filename = os.path.join(directory, name + intermediates.SUFFIXES[output_format])
+    LOGGER.info('Writing intermediate: %s', filename)
+    intermediates.write(filename, data_list, output_format)
+
+def run_pipeline(pipeline, tsv_filename, template_filename, output, repo=None, intermediates_dir=None, template_cache=None, jobs=1, incremental=False, dry_run=False, output_format="json", vocab_tsv=None, export=False):
+    """ Run a named pipeline from TSV to rendered output in memory.
+
+    template_filename and output may also be equal-length lists, to
+    render several outputs from the one parse. With vocab_tsv, kanji
+    details get the vocab that uses each kanji attached. With export,
+    chapters ship with copies of the stroke images they use.
+    """
+
+    if isinstance(template_filename, str):
+        template_filename = [template_filename]
+    if isinstance(output, str):
+        output = [output]
+    if not len(template_filename) == len(output):
+        die_screaming('need one output for each template')
+    pairs = list(zip(template_filename, output))
+
+    if pipeline not in PIPELINES:
+        die_screaming('pipeline argument unknown')
+    parse_name, bin_name, pattern, apply_name = PIPELINES[pipeline]
+
+    ## Parse.
+    LOGGER.info('Stage: %s', parse_name)
+    if parse_name == "parse-kanji-details":
+        parsed = load_stage(parse_name).parse_tsv(tsv_filename, repo, jobs)
+    else:
+        parsed = load_stage(parse_name).parse_tsv(tsv_filename, jobs)
+    if parse_name == "parse-kanji-details" and vocab_tsv:
+        LOGGER.info('Stage: %s', 'kanji-vocab-index')
+        vocab_index = load_stage('kanji-vocab-index').build_index(load_stage('parse-vocab-list').parse_tsv(vocab_tsv, jobs))
+        parsed = load_stage('kanji-vocab-index').attach_index(parsed, vocab_index)
+    if intermediates_dir:
+        write_intermediate(intermediates_dir, 'parsed-' + pipeline, parsed, output_format)
+
+    ## Bin.
+    LOGGER.info('Stage: %s', bin_name)
+    binned = load_stage(bin_name).bin_data(parsed, pattern)
+    profiling.checkpoint()
+    if intermediates_dir:
+        write_intermediate(intermediates_dir, 'binned-' + pipeline, binned, output_format)
+
+    ## Render.
+    LOGGER.info('Stage: %s', apply_name)
+    if apply_name == "apply-to-chapters":
+        load_stage(apply_name).apply_templates(binned, pairs, template_cache, jobs,
+                                               incremental=incremental, dry_run=dry_run, export=export)
+    else:
+        load_stage(apply_name).apply_templates(binned, pairs, template_cache)
+
+def main():
+
+    ## Deal with incoming.
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='More verbose output')
+    parser.add_argument('-p', '--pipeline',
+                        help='The pipeline to run: ' + ', '.join(PIPELINES.keys()))
+    parser.add_argument('-t', '--tsv',
+                        help='The TSV data file to read in')
+    parser.add_argument('-r', '--repo',
+                        help='[optional] The path to this repo')
+    parser.add_argument('-w', '--vocab-tsv',
+                        help='[optional] For kanji-details, a vocab list TSV to list the words using each kanji from')
+    parser.add_argument('-m', '--template', action='append', default=[],
+                        help='The output template to use; may be repeated, pairing with each --output')
+    parser.add_argument('-c', '--template-cache',
+                        help='[optional] A directory to cache parsed templates in')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='[optional] The number of processes to parse (in chunks of rows) and render chapters with')
+    parser.add_argument('-n', '--incremental', action='store_true',
+                        help='[optional] Only rebuild chapters whose data or template changed')
+    parser.add_argument('-d', '--dry-run', action='store_true',
+                        help='[optional] Only list the chapter files that would be (re)built')
+    parser.add_argument('-x', '--export', action='store_true',
+                        help='[optional] For chapters, copy the stroke images used next to them and link to those')
+    parser.add_argument('-o', '--output', action='append', default=[],
+                        help='The file (or file pattern for chapters) to output to; may be repeated, pairing with each --template')
+    parser.add_argument('-k', '--intermediates',
+                        help='[optional] A directory to also write the intermediates to (*.json, or *.bin when binary)')
+    parser.add_argument('-f', '--format', choices=intermediates.FORMATS, default=intermediates.FORMATS[0],
+                        help='[optional] The intermediate format: json (default), compact (unindented JSON) or binary')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    ## Up the verbosity level if we want.
+    if args.verbose:
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.info('Verbose: on')
+
+    ## Ensure arguments and read in what is necessary.
+    if not args.pipeline:
+        die_screaming('need a pipeline argument')
+    if args.pipeline not in PIPELINES:
+        die_screaming('pipeline argument unknown')
+    if not args.tsv:
+        die_screaming('need an input tsv argument')
+    LOGGER.info('Will use "%s" as data', args.tsv)
+    if not args.template:
+        die_screaming('need a template argument for the output')
+    for template_filename in args.template:
+        LOGGER.info('Will use: %s as an output formatter', template_filename)
+    if not args.output:
+        die_screaming('need an output argument')
+    if not len(args.output) == len(args.template):
+        die_screaming('need one output argument for each template argument')
+    for output in args.output:
+        LOGGER.info('Will output to: %s', output)
+    if not args.repo:
+        args.repo = os.getcwd()
+
+    ## Stages share our verbosity.
+    if args.verbose:
+        parse_name, bin_name, pattern, apply_name = PIPELINES[args.pipeline]
+        for name in [parse_name, bin_name, apply_name]:
+            load_stage(name).LOGGER.setLevel(logging.INFO)
+
+    run_pipeline(args.pipeline, args.tsv, args.template, args.output,
+                 repo=args.repo, intermediates_dir=args.intermediates,
+                 template_cache=args.template_cache, jobs=args.jobs,
+                 incremental=args.incremental, dry_run=args.dry_run,
+                 output_format=args.format, vocab_tsv=args.vocab_tsv, export=args.export)
+
+## You saw it coming...
+if __name__ == '__main__':
+    profiling.run(main)
@@ -0,0 +1,276 @@
+####
+#### A small local HTTP server for previewing the chapters and the
+#### glossary, rendered on request.
+####
+#### Pages are rendered from in-memory parsed and binned data with the
+#### usual templates, and cached until their TSV or template changes;
+#### only the chapters that are actually opened are rendered. Stroke
+#### images are served from kanjialive/kanji_strokes/.
+####
+#### Pages:
+####  /                          an index of what there is
+####  /vocab/chapter/N           vocab list chapter N
+####  /kanji-list/chapter/N      kanji list chapter N
+####  /kanji-details/chapter/N   kanji details chapter N
+####  /glossary                  the glossary
+####
+#### Example usage to analyze the usual suspects:
+####  python3 preview.py --help
+####
+#### Preview everything on http://localhost:8000/:
+####  python3 preview.py --vocab-tsv /tmp/vocab-list.tsv --kanji-list-tsv /tmp/kanji-list.tsv --kanji-details-tsv /tmp/kanji-details.tsv
+####
+
+import sys
+import argparse
+import logging
+import stagelog
+import pipeline
+import templates
+import watch
+import kaindex
+import strokes
+import os
+import html
+import mimetypes
+import urllib.parse
+import threading
+import http.server
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('preview')
+
+## URL prefixes for the chapter pipelines.
+CHAPTER_ROUTES = {
+    "vocab": "vocab-list",
+    "kanji-list": "kanji-list",
+    "kanji-details": "kanji-details",
+}
+
+def die_screaming(string):
+    """ Die and take our toys home. """
+    LOGGER.error(string)
+    sys.exit(1)
+
+class RenderError(Exception):
+    """ A page could not be built; the stage has logged why. """
+    pass
+
+class Preview(object):
+    """ Parses, bins and renders pipelines on demand, caching the pages. """
+
+    def __init__(self, tsvs, targets, repo, template_cache=None):
+        ## tsvs: parse stage -> TSV; targets: pipeline -> template
+        self.tsvs = tsvs
+        self.targets = targets
+        self.repo = repo
+        self.template_cache = template_cache
+        self.strokes_dir = repo + '/kanjialive/kanji_strokes/'
+        self.lock = threading.Lock()
+        self.signatures = {}
+        self.parsed = {}
+        self.binned = {}
+        self.pages = {}
+        self.kanjialive_lookup = None
+        self.stroke_manifest = None
+
+    def _invalidate(self, name):
+        """ Drop what we have for a pipeline if its inputs changed. """
+        parse_name = pipeline.PIPELINES[name][0]
+        tsv_filename = self.tsvs[parse_name]
+        signature = (watch.file_signature(tsv_filename), watch.file_signature(self.targets[name]))
+        if self.signatures.get(name) == signature:
+            return
+        if self.signatures.get(name, (None, None))[0] != signature[0]:
+            self.parsed.pop(parse_name, None)
+        self.binned.pop(name, None)
+        for key in [k for k in self.pages.keys() if k[0] == name]:
+            del self.pages[key]
+        self.signatures[name] = signature
+
+    def _parse(self, parse_name):
+        stage = pipeline.load_stage(parse_name)
+        rows = stage.read_rows(self.tsvs[parse_name])
+        if parse_name == "parse-kanji-details":
+            if self.kanjialive_lookup is None:
+                self.kanjialive_lookup = kaindex.load_index(self.repo + '/kanjialive/ka_data.csv')
+                self.stroke_manifest = strokes.stroke_manifest(self.strokes_dir)
+            return list(stage.parse_rows(rows, self.repo, self.kanjialive_lookup, self.stroke_manifest))
+        return list(stage.parse_rows(rows))
+
+    def _binned(self, name):
+        """ The binned data for a pipeline, (re)building it if needed. """
+        parse_name, bin_name, pattern, apply_name = pipeline.PIPELINES[name]
+        try:
+            if parse_name not in self.parsed:
+                LOGGER.info('Parsing: %s', self.tsvs[parse_name])
+                self.parsed[parse_name] = self._parse(parse_name)
+            if name not in self.binned:
+                self.binned[name] = pipeline.load_stage(bin_name).bin_data(self.parsed[parse_name], pattern)
+        except SystemExit:
+            raise RenderError(name + ' could not be built from ' + self.tsvs[parse_name])
+        return self.binned[name]
+
+    def _render(self, name, context):
+        parsed = templates.load_template(self.targets[name], self.template_cache)
+        rendered = templates.render(parsed, context)
+        ## The templates link strokes as local files; point them here.
+        return rendered.replace('file://' + self.strokes_dir, '/strokes/')
+
+    def available(self, name):
+        return name in self.targets and pipeline.PIPELINES[name][0] in self.tsvs
+
+    def chapters(self, name):
+        """ The chapter numbers a pipeline has. """
+        with self.lock:
+            self._invalidate(name)
+            return [str(item["chapter"]) for item in self._binned(name)]
+
+    def page(self, name, chapter=None):
+        """ Return the rendered page, or None if there is no such chapter. """
+        with self.lock:
+            self._invalidate(name)
+            key = (name, chapter)
+            if key not in self.pages:
+                binned = self._binned(name)
+                if chapter is None:
+                    LOGGER.info('Rendering: %s', name)
+                    self.pages[key] = self._render(name, {"all": binned}).encode('utf-8')
+                else:
+                    items = [item for item in binned if str(item["chapter"]) == chapter]
+                    if not items:
+                        return None
+                    LOGGER.info('Rendering: %s chapter %s', name, chapter, chapter=chapter)
+                    self.pages[key] = self._render(name, {"data": items[0]["data"]}).encode('utf-8')
+            return self.pages[key]
+
+    def index(self):
+        """ A plain page linking to everything there is. """
+        lines = ['<html><body>']
+        for prefix, name in CHAPTER_ROUTES.items():
+            if self.available(name):
+                lines.append('<h4>' + html.escape(name) + '</h4>')
+                try:
+                    for chapter in self.chapters(name):
+                        lines.append('<a href="/' + prefix + '/chapter/' + chapter + '">' + chapter + '</a> ')
+                except RenderError as e:
+                    lines.append(html.escape(str(e)))
+        if self.available("vocab-glossary"):
+            lines.append('<h4><a href="/glossary">glossary</a></h4>')
+        lines.append('</body></html>')
+        return '\n'.join(lines).encode('utf-8')
+
+class PreviewHandler(http.server.BaseHTTPRequestHandler):
+    """ Routes requests to the server's Preview. """
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stroke(self, filename):
+        ## Only plain file names, from the strokes directory.
+        if not filename or filename != os.path.basename(filename) or filename.startswith('.'):
+            return self._send(404, b'not found', 'text/plain')
+        try:
+            with open(self.server.preview.strokes_dir + filename, 'rb') as image:
+                body = image.read()
+        except OSError:
+            return self._send(404, b'not found', 'text/plain')
+        self._send(200, body, mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+
+    def do_GET(self):
+        preview = self.server.preview
+        parts = [urllib.parse.unquote(p) for p in self.path.split('?')[0].split('/') if p]
+        try:
+            if not parts:
+                return self._send(200, preview.index())
+            if parts[0] == 'strokes' and len(parts) == 2:
+                return self._send_stroke(parts[1])
+            if parts == ['glossary'] and preview.available("vocab-glossary"):
+                return self._send(200, preview.page("vocab-glossary"))
+            if len(parts) == 3 and parts[0] in CHAPTER_ROUTES and parts[1] == 'chapter' and \
+               preview.available(CHAPTER_ROUTES[parts[0]]):
+                body = preview.page(CHAPTER_ROUTES[parts[0]], parts[2])
+                if body is not None:
+                    return self._send(200, body)
+        except RenderError as e:
+            return self._send(500, (str(e) + '; see the server log\n').encode('utf-8'), 'text/plain; charset=utf-8')
+        except Exception as e:
+            ## Anything else (a bad template, say) still gets an answer.
+            LOGGER.exception('failed to serve %s', self.path)
+            return self._send(500, (type(e).__name__ + ': ' + str(e) + '\n').encode('utf-8'), 'text/plain; charset=utf-8')
+        self._send(404, b'not found', 'text/plain')
+
+    def log_message(self, format, *args):
+        LOGGER.info('%s %s', self.address_string(), format % args)
+
+def main():
+
+    ## Deal with incoming.
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='More verbose output')
+    parser.add_argument('--vocab-tsv',
+                        help='[optional] The vocab list TSV (vocab chapters and glossary)')
+    parser.add_argument('--kanji-list-tsv',
+                        help='[optional] The kanji list TSV (kanji-list chapters)')
+    parser.add_argument('--kanji-details-tsv',
+                        help='[optional] The kanji details TSV (kanji-details chapters)')
+    parser.add_argument('-r', '--repo',
+                        help='[optional] The path to this repo')
+    parser.add_argument('-m', '--template', action='append', default=[],
+                        help='[optional] Use another template for a pipeline, as PIPELINE=TEMPLATE; may be repeated')
+    parser.add_argument('-c', '--template-cache',
+                        help='[optional] A directory to cache parsed templates in')
+    parser.add_argument('-b', '--bind', default='127.0.0.1',
+                        help='[optional] The address to listen on (default 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8000,
+                        help='[optional] The port to listen on (default 8000)')
+    args = parser.parse_args()
+
+    ## Up the verbosity level if we want.
+    if args.verbose:
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.info('Verbose: on')
+
+    ## Ensure arguments and read in what is necessary.
+    tsvs = {}
+    if args.vocab_tsv:
+        tsvs["parse-vocab-list"] = args.vocab_tsv
+    if args.kanji_list_tsv:
+        tsvs["parse-kanji-list"] = args.kanji_list_tsv
+    if args.kanji_details_tsv:
+        tsvs["parse-kanji-details"] = args.kanji_details_tsv
+    if not tsvs:
+        die_screaming('need at least one tsv argument to preview')
+    if not args.repo:
+        args.repo = os.getcwd()
+    args.repo = os.path.abspath(args.repo)
+
+    targets = {}
+    for name, (template_filename, output) in watch.DEFAULT_TARGETS.items():
+        targets[name] = template_filename
+    for override in args.template:
+        name, sep, template_filename = override.partition('=')
+        if not sep or name not in targets:
+            die_screaming('template argument should be PIPELINE=TEMPLATE, with PIPELINE one of: ' + ', '.join(targets.keys()))
+        targets[name] = template_filename
+
+    server = http.server.ThreadingHTTPServer((args.bind, args.port), PreviewHandler)
+    server.preview = Preview(tsvs, targets, args.repo, args.template_cache)
+    print('Serving on http://' + args.bind + ':' + str(server.server_address[1]) + '/; ^C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+## You saw it coming...
+if __name__ == '__main__':
+    main()
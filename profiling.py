@@ -0,0 +1,127 @@
+####
+#### A common --profile option for the stage scripts.
+####
+#### With `--profile PATH`, the whole run of a script is profiled with
+#### cProfile: the raw pstats data is dumped to PATH and a summary of
+#### the top hot functions to PATH.txt (and stderr). With
+#### `--profile-memory`, tracemalloc also runs and the biggest
+#### allocation sites are written to PATH.memory.txt, with the raw
+#### snapshot in PATH.tracemalloc. Scripts call checkpoint() where their
+#### data is at its biggest, so that the snapshot is taken there.
+####
+#### Only the main process is profiled; pool workers (say, from
+#### apply-to-chapters.py --jobs) are not.
+####
+#### Example usage, in a script:
+####  import profiling
+####  ...
+####  profiling.add_arguments(parser)
+####  ...
+####  profiling.checkpoint()
+####  ...
+####  if __name__ == '__main__':
+####      profiling.run(main)
+####
+#### Then, to look at a run later:
+####  python3 chapter-bin.py --pattern vocab-list --input /tmp/parsed.json --output /tmp/chapters.json --profile /tmp/chapter-bin.pstats
+####  python3 -m pstats /tmp/chapter-bin.pstats
+####
+
+import sys
+import argparse
+import cProfile
+import pstats
+import tracemalloc
+import io
+
+## How many functions (and allocation sites) the summaries show.
+DEFAULT_TOP = 25
+
+## How many frames tracemalloc keeps per allocation.
+TRACEMALLOC_FRAMES = 10
+
+## The biggest checkpoint() snapshot so far, as (traced size, snapshot).
+_CHECKPOINT = None
+
+def add_arguments(parser):
+    """ Add the --profile options to a script's argument parser. """
+    parser.add_argument('--profile', metavar='PATH',
+                        help='[optional] Profile the run; write pstats data to PATH and a summary to PATH.txt')
+    parser.add_argument('--profile-top', metavar='N', type=int, default=DEFAULT_TOP,
+                        help='[optional] How many hot functions to summarize (default ' + str(DEFAULT_TOP) + ')')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='[optional] With --profile, also record the biggest allocation sites to PATH.memory.txt')
+
+def _profile_args(argv):
+    """ Pick our options out of the command line, ignoring the rest. """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(parser)
+    args, rest = parser.parse_known_args(argv)
+    return args
+
+def summarize(profiler, top=DEFAULT_TOP):
+    """ Return the text of the top functions by own and cumulative time. """
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs()
+    out.write('## Top ' + str(top) + ' functions by own time\n')
+    stats.sort_stats('tottime').print_stats(top)
+    out.write('## Top ' + str(top) + ' functions by cumulative time\n')
+    stats.sort_stats('cumulative').print_stats(top)
+    return out.getvalue()
+
+def summarize_memory(snapshot, top=DEFAULT_TOP):
+    """ Return the text of the biggest allocation sites in a snapshot. """
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    lines = ['## Top ' + str(top) + ' allocation sites']
+    for stat in snapshot.statistics('lineno')[:top]:
+        lines.append(str(stat))
+    total = sum(stat.size for stat in snapshot.statistics('filename'))
+    lines.append('## Total traced at snapshot: ' + str(total // 1024) + ' KiB')
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append('## Peak traced: ' + str(peak // 1024) + ' KiB')
+    return '\n'.join(lines) + '\n'
+
+def checkpoint():
+    """ Note a point of high memory use; a no-op unless tracing memory. """
+    global _CHECKPOINT
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        if _CHECKPOINT is None or current > _CHECKPOINT[0]:
+            _CHECKPOINT = (current, tracemalloc.take_snapshot())
+
+def _write(filename, text):
+    with open(filename, 'w') as output:
+        output.write(text)
+
+def run(main, argv=None):
+    """ Run main(), profiled if the command line asks for it. """
+    args = _profile_args(sys.argv[1:] if argv is None else argv)
+    if not args.profile:
+        return main()
+
+    if args.profile_memory:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    profiler = cProfile.Profile()
+    try:
+        ## Includes runs that die_screaming() out.
+        return profiler.runcall(main)
+    finally:
+        ## Most data is gone by now; prefer the biggest checkpoint.
+        snapshot = None
+        if args.profile_memory:
+            checkpoint()
+            snapshot = _CHECKPOINT[1]
+        profiler.dump_stats(args.profile)
+        summary = summarize(profiler, args.profile_top)
+        _write(args.profile + '.txt', summary)
+        sys.stderr.write(summary)
+        sys.stderr.write('Wrote profile to: ' + args.profile + ' (summary in ' + args.profile + '.txt)\n')
+        if snapshot is not None:
+            snapshot.dump(args.profile + '.tracemalloc')
+            _write(args.profile + '.memory.txt', summarize_memory(snapshot, args.profile_top))
+            tracemalloc.stop()
+            sys.stderr.write('Wrote allocation sites to: ' + args.profile + '.memory.txt\n')
@@ -0,0 +1,62 @@
+####
+#### Parsing of the vocab list "Ruby" column and alignment of the
+#### ruby onto the "Japanese" column.
+####
+#### The ruby is a comma-separated list of pipe-separated items, each
+#### a kanji set and its reading, that map in order onto the Japanese.
+####
+#### Example usage:
+####  import ruby
+####  segments = ruby.align_ruby('お正月', ruby.parse_ruby('正月|しょうがつ'))
+####  # => [{"string": "お", "has-ruby": False},
+####  #     {"string": "正月", "reading": "しょうがつ", "has-ruby": True}]
+####
+
+class RubyError(ValueError):
+    """ A problem with a row's ruby; offset is into the Japanese. """
+
+    def __init__(self, message, offset=None, kanji=None):
+        self.offset = offset
+        self.kanji = kanji
+        super().__init__(message)
+
+def parse_ruby(raw_ruby):
+    """ Turn raw "kanji|reading, ..." ruby into a list of dicts. """
+    ruby = []
+    if raw_ruby:
+        for ruby_set_raw in raw_ruby.split(","):
+            ruby_set = ruby_set_raw.strip().split("|")
+            if len(ruby_set) < 2:
+                raise RubyError('ruby item without a reading: "' + ruby_set_raw.strip() + '"')
+            ruby.append({"kanji": ruby_set[0].strip(),
+                         "reading": ruby_set[1].strip()})
+    return ruby
+
+def align_ruby(japanese, ruby):
+    """ Split the Japanese into plain and ruby segments, in one walk.
+
+    Each kanji set is looked for from where the previous one ended;
+    raise a RubyError with that offset if it is not found.
+    """
+    segments = []
+    cursor = 0
+    for r in ruby:
+        offset = japanese.find(r["kanji"], cursor)
+        if offset == -1:
+            raise RubyError('expected "' + r["kanji"] + '" at or after offset ' + str(cursor) + ' of "' + japanese + '"',
+                            offset=cursor, kanji=r["kanji"])
+
+        ## Any plain string before the ruby, then the ruby.
+        if offset > cursor:
+            segments.append({"string": japanese[cursor:offset],
+                             "has-ruby": False})
+        cursor = offset + len(r["kanji"])
+        segments.append({"string": japanese[offset:cursor],
+                         "reading": r["reading"],
+                         "has-ruby": True})
+
+    ## Add any remaining string after the last ruby.
+    if ruby and cursor < len(japanese):
+        segments.append({"string": japanese[cursor:],
+                         "has-ruby": False})
+    return segments
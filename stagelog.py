@@ -0,0 +1,78 @@
+####
+#### A shared logging layer for the pipeline stages.
+####
+#### Messages use deferred (%-style) formatting, and can carry
+#### structured "row" and "chapter" fields alongside the stage that
+#### logged them. Nothing is formatted for disabled levels; expensive
+#### arguments can be wrapped in lazy() or lazy_json() so that they are
+#### not even computed unless the message is emitted.
+####
+#### Example usage:
+####  import stagelog
+####  LOGGER = stagelog.get_logger('apply-to-chapters')
+####  LOGGER.info('Rendering: %s', stagelog.lazy_json(data), chapter=chapter)
+####
+
+import logging
+import json
+
+## The structured fields that may be attached to an event.
+EVENT_FIELDS = ["row", "chapter"]
+
+class StageFormatter(logging.Formatter):
+    """ The usual "LEVEL:stage:message", plus any event fields. """
+
+    def format(self, record):
+        text = super().format(record)
+        fields = [f + '=' + str(getattr(record, f)) for f in EVENT_FIELDS if getattr(record, f, None) is not None]
+        if fields:
+            text = text + ' [' + ', '.join(fields) + ']'
+        return text
+
+class StageLogger(logging.LoggerAdapter):
+    """ A logger that tags its records with the stage and event fields. """
+
+    def process(self, msg, kwargs):
+        ## Only called for enabled levels.
+        extra = dict(self.extra)
+        for field in EVENT_FIELDS:
+            if field in kwargs:
+                extra[field] = kwargs.pop(field)
+        extra.update(kwargs.get('extra') or {})
+        kwargs['extra'] = extra
+        return msg, kwargs
+
+class _Lazy(object):
+    """ Computes its string only when a handler formats it. """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+def lazy(func, *args, **kwargs):
+    """ Defer func(*args, **kwargs) until the message is emitted. """
+    return _Lazy(func, args, kwargs)
+
+def lazy_json(data):
+    """ Defer indented JSON serialization until the message is emitted. """
+    return _Lazy(json.dumps, (data,), {"indent": 4})
+
+def basic_config():
+    """ Like logging.basicConfig(level=logging.INFO), with our formatter. """
+    root = logging.getLogger()
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(StageFormatter(logging.BASIC_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+
+def get_logger(stage):
+    """ Return the logger for a stage, at WARNING until made verbose. """
+    basic_config()
+    logger = logging.getLogger(stage)
+    logger.setLevel(logging.WARNING)
+    return StageLogger(logger, {"stage": stage})
@@ -0,0 +1,214 @@
+####
+#### Pack each chapter's stroke order images into inline SVG
+#### <symbol> definitions, so that a rendered kanji details chapter
+#### is a single request instead of one per stroke image.
+####
+#### Reads binned kanji details chapters (from chapter-bin.py) and adds:
+####  "stroke-symbols": per chapter, a hidden <svg> of the chapter's symbols
+####  "kanji-strokes-sprites": per record, [{"id": ..., "manual-p": ...}]
+#### which manual-html-kanji-details.template.html draws with <use>.
+#### Records with any stroke image missing or unusable keep their <img>
+#### links, and leave their symbols out.
+####
+#### Symbols are named by the hash of their image, so a stroke is only
+#### defined once per page however often it is used. With a cache
+#### directory, converted symbols are kept there by the same hash.
+####
+#### Example usage to analyze the usual suspects:
+####  python3 stroke-sprites.py --help
+####
+#### As part of a pipeline, between binning and applying:
+####  python3 parse-kanji-details.py --tsv /tmp/kanji-details.tsv --output /tmp/parsed-kanji-details.json && python3 chapter-bin.py --input /tmp/parsed-kanji-details.json --pattern kanji-details --output /tmp/binned-kanji.json && python3 stroke-sprites.py --input /tmp/binned-kanji.json --output /tmp/sprited-kanji.json --cache /tmp/stroke-cache && python3 apply-to-chapters.py --input /tmp/sprited-kanji.json --template manual-html-kanji-details.template.html --output /tmp/kh-ch
+####
+
+import sys
+import argparse
+import logging
+import stagelog
+import intermediates
+import profiling
+import os
+import hashlib
+import base64
+import struct
+import xml.etree.ElementTree
+import xml.sax.saxutils
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('stroke-sprites')
+
+SVG_NAMESPACE = '{http://www.w3.org/2000/svg}'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+## SVG elements that are editor baggage, not drawing.
+SKIPPED_ELEMENTS = ["metadata", "title", "desc"]
+
+## Converted symbols already seen by this process, by content hash.
+_SYMBOLS = {}
+
+def die_screaming(string):
+    """ Die and take our toys home. """
+    LOGGER.error(string)
+    sys.exit(1)
+
+def symbol_id(digest):
+    """ The id a stroke image's symbol is defined (and used) as. """
+    return 'stroke-' + digest[:16]
+
+def _svg_tag(element):
+    """ The SVG tag of an element, with or without the namespace; None for other namespaces. """
+    if element.tag.startswith(SVG_NAMESPACE):
+        return element.tag[len(SVG_NAMESPACE):]
+    if element.tag.startswith('{'):
+        return None
+    return element.tag
+
+def _svg_markup(element):
+    """ Serialize the drawing parts of an SVG element, without namespaces or ids. """
+    tag = _svg_tag(element)
+    if tag is None or tag in SKIPPED_ELEMENTS:
+        return ''
+    ## Editor attributes are namespaced; ids would clash between symbols.
+    attributes = ''.join(' ' + k + '=' + xml.sax.saxutils.quoteattr(v)
+                         for k, v in element.attrib.items() if not k.startswith('{') and not k == 'id')
+    inner = xml.sax.saxutils.escape(element.text or '')
+    for child in element:
+        inner = inner + _svg_markup(child) + xml.sax.saxutils.escape(child.tail or '')
+    return '<' + tag + attributes + '>' + inner + '</' + tag + '>'
+
+def svg_symbol(data, sid):
+    """ Return a <symbol> for the contents of an SVG file, or None if it draws nothing. """
+    root = xml.etree.ElementTree.fromstring(data)
+    if not _svg_tag(root) == 'svg':
+        return None
+    view_box = root.get('viewBox')
+    if not view_box:
+        width = root.get('width', '0').rstrip('ptx')
+        height = root.get('height', '0').rstrip('ptx')
+        view_box = '0 0 ' + width + ' ' + height
+    inner = ''.join(_svg_markup(child) for child in root)
+    if not inner:
+        return None
+    return '<symbol id="' + sid + '" viewBox=' + xml.sax.saxutils.quoteattr(view_box) + '>' + inner + '</symbol>'
+
+def png_symbol(data, sid):
+    """ Return a <symbol> embedding a PNG file. """
+    width, height = struct.unpack('>II', data[16:24])
+    href = 'data:image/png;base64,' + base64.b64encode(data).decode('ascii')
+    return '<symbol id="' + sid + '" viewBox="0 0 ' + str(width) + ' ' + str(height) + '">' + \
+        '<image width="' + str(width) + '" height="' + str(height) + '" href="' + href + '" /></symbol>'
+
+def load_symbol(filename, cache_dir=None):
+    """ Return (symbol id, symbol markup) for a stroke image, or None if unusable. """
+    try:
+        with open(filename, 'rb') as image:
+            data = image.read()
+    except OSError:
+        return None
+    digest = hashlib.sha256(data).hexdigest()
+    sid = symbol_id(digest)
+    if digest in _SYMBOLS:
+        return sid, _SYMBOLS[digest]
+
+    cache_filename = os.path.join(cache_dir, digest + '.symbol') if cache_dir else None
+    markup = None
+    if cache_filename and os.path.exists(cache_filename):
+        with open(cache_filename, 'r') as cached:
+            markup = cached.read()
+    if markup is None:
+        try:
+            if data.startswith(PNG_SIGNATURE):
+                markup = png_symbol(data, sid)
+            else:
+                markup = svg_symbol(data, sid)
+        except (xml.etree.ElementTree.ParseError, struct.error) as e:
+            LOGGER.warning('Cannot use stroke image %s: %s', filename, e)
+            return None
+        if markup is None:
+            LOGGER.warning('Cannot use stroke image %s: nothing to draw', filename)
+            return None
+        if cache_filename:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_filename = cache_filename + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_filename, 'w') as cached:
+                cached.write(markup)
+            os.replace(tmp_filename, cache_filename)
+    _SYMBOLS[digest] = markup
+    return sid, markup
+
+def sprite_chapters(chapter_list, cache_dir=None):
+    """ Add shared stroke symbols to each binned kanji details chapter. """
+    for item in chapter_list:
+        chapter = str(item["chapter"])
+        symbols = {}
+        for section in item["data"]:
+            for record in section["sections"]:
+                sprites = []
+                record_symbols = {}
+                for list_key, manual_p in [("kanji-strokes-list", False), ("kanji-strokes-list-manual", True)]:
+                    for stroke_filename in record.get(list_key, []):
+                        loaded = load_symbol(str(record["kanji-strokes-base"]) + stroke_filename, cache_dir)
+                        if loaded is None:
+                            sprites = None
+                            break
+                        sid, markup = loaded
+                        record_symbols[sid] = markup
+                        sprites.append({"id": sid, "manual-p": manual_p})
+                    if sprites is None:
+                        LOGGER.warning('Missing stroke images for kanji %s; keeping image links', record.get("kanji-raw"),
+                                       chapter=chapter, row=record.get("row"))
+                        break
+                ## Only records drawn with <use> need their symbols.
+                if sprites:
+                    record["kanji-strokes-sprites"] = sprites
+                    for sid, markup in record_symbols.items():
+                        symbols.setdefault(sid, markup)
+        if symbols:
+            item["stroke-symbols"] = '<svg xmlns="http://www.w3.org/2000/svg" style="display:none">' + \
+                ''.join(symbols.values()) + '</svg>'
+        LOGGER.info('Chapter %s: %d stroke symbols', chapter, len(symbols), chapter=chapter)
+    return chapter_list
+
+def main():
+
+    ## Deal with incoming.
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='More verbose output')
+    parser.add_argument('-i', '--input',
+                        help='The binned kanji details to use as input')
+    parser.add_argument('-c', '--cache',
+                        help='[optional] A directory to cache converted stroke symbols in')
+    parser.add_argument('-f', '--format', choices=intermediates.FORMATS, default=intermediates.FORMATS[0],
+                        help='[optional] The output format: json (default), compact (unindented JSON) or binary')
+    parser.add_argument('-o', '--output',
+                        help='The file to output')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    ## Up the verbosity level if we want.
+    if args.verbose:
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.info('Verbose: on')
+
+    ## Ensure arguments and read in what is necessary.
+    if not args.input:
+        die_screaming('need an input argument')
+    LOGGER.info('Will input from: %s', args.input)
+    if not args.output:
+        die_screaming('need an output argument')
+    LOGGER.info('Will output to: %s', args.output)
+
+    ## Bring data in and pack.
+    chapter_list = sprite_chapters(intermediates.read(args.input), args.cache)
+    profiling.checkpoint()
+
+    ## Write everything out.
+    intermediates.write(args.output, chapter_list, args.format)
+    print('Packed ' + str(len(_SYMBOLS)) + ' stroke images into ' + str(len(chapter_list)) + ' chapters')
+
+## You saw it coming...
+if __name__ == '__main__':
+    profiling.run(main)
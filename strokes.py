@@ -0,0 +1,46 @@
+####
+#### A manifest of the stroke order images in kanjialive/kanji_strokes/,
+#### built with a single directory scan.
+####
+#### The images are named "<stem>_<stroke number>.<extension>", where
+#### the stem is the kanjialive "kname" (e.g. "sui(yo)_11.png").
+####
+#### Example usage:
+####  import strokes
+####  manifest = strokes.stroke_manifest(repo + '/kanjialive/kanji_strokes/')
+####  manifest.get('sui(yo)', []) # => [(1, 'sui(yo)_1.png'), ...]
+####
+
+import os
+
+def split_stroke_filename(filename):
+    """ Return (stem, stroke number) for a stroke image, or None. """
+    base = os.path.splitext(filename)[0]
+    stem, sep, number = base.rpartition('_')
+    if not sep or not stem or not number.isdigit():
+        return None
+    return stem, int(number)
+
+def stroke_manifest(strokes_dir):
+    """ Map each stem to its (stroke number, filename) list, in stroke order. """
+    manifest = {}
+    try:
+        entries = list(os.scandir(strokes_dir))
+    except FileNotFoundError:
+        return manifest
+    for entry in entries:
+        if not entry.is_file():
+            continue
+        split = split_stroke_filename(entry.name)
+        if split:
+            manifest.setdefault(split[0], []).append((split[1], entry.name))
+    for stroke_list in manifest.values():
+        stroke_list.sort()
+    return manifest
+
+def missing_strokes(stroke_list):
+    """ Return the stroke numbers missing from 1..(last stroke). """
+    numbers = set(number for number, filename in stroke_list)
+    if not numbers:
+        return []
+    return [n for n in range(1, max(numbers) + 1) if n not in numbers]
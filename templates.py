@@ -0,0 +1,119 @@
+####
+#### Load and render mustache templates, parsing each template at
+#### most once per process.
+####
+#### Parsed templates can also be kept in an on-disk cache directory,
+#### keyed by the hash of the template file's contents, so that
+#### repeated builds skip parsing entirely.
+####
+#### Example usage:
+####  import templates
+####  parsed = templates.load_template('manual-glossary.template.html', '/tmp/template-cache')
+####  rendered = templates.render(parsed, {"all": data_list})
+####
+#### Or, a section at a time:
+####  head, body, tail = templates.split_section(parsed, 'all')
+####
+
+import os
+import stagelog
+import hashlib
+import pickle
+import pystache
+import pystache.parsed
+import pystache.parser
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('templates')
+
+## Parsed templates already seen by this process, by content hash.
+_PARSED = {}
+
+## One renderer is enough for everyone; pystache.render() would
+## otherwise make a new one for every call.
+_RENDERER = pystache.Renderer()
+
+def content_hash(text):
+    """ Return the hex digest used to key a template's contents. """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _cache_filename(cache_dir, key):
+    """ Where a parsed template is kept on disk. """
+    ## The pickled parse tree belongs to a specific pystache.
+    version = getattr(pystache, '__version__', 'unknown')
+    return os.path.join(cache_dir, key + '-pystache-' + version + '.pickle')
+
+def _read_cache(cache_filename):
+    """ Return a cached parsed template, or None if unusable. """
+    try:
+        with open(cache_filename, 'rb') as fhandle:
+            return pickle.load(fhandle)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOGGER.warning('Ignoring bad template cache %s: %s', cache_filename, e)
+        return None
+
+def _write_cache(cache_filename, parsed):
+    """ Atomically write a parsed template to the on-disk cache. """
+    try:
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        tmp_filename = cache_filename + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_filename, 'wb') as fhandle:
+            pickle.dump(parsed, fhandle)
+        os.replace(tmp_filename, cache_filename)
+    except OSError as e:
+        LOGGER.warning('Could not write template cache %s: %s', cache_filename, e)
+
+def parse_template(text, cache_dir=None):
+    """ Return the parsed form of the template text. """
+
+    key = content_hash(text)
+    if key in _PARSED:
+        return _PARSED[key]
+
+    parsed = None
+    cache_filename = None
+    if cache_dir:
+        cache_filename = _cache_filename(cache_dir, key)
+        parsed = _read_cache(cache_filename)
+        if parsed is not None:
+            LOGGER.info('Using cached template: %s', cache_filename)
+
+    if parsed is None:
+        parsed = pystache.parse(text)
+        if cache_filename:
+            _write_cache(cache_filename, parsed)
+
+    _PARSED[key] = parsed
+    return parsed
+
+def load_template(template_filename, cache_dir=None):
+    """ Read and return the parsed form of the template file. """
+    with open(template_filename) as fhandle:
+        return parse_template(fhandle.read(), cache_dir)
+
+def render(parsed, *context):
+    """ Render a parsed template with the given context (stack). """
+    return _RENDERER.render(parsed, *context)
+
+def split_section(parsed, key):
+    """ Split a parsed template around its top-level `key` section.
+
+    Return (head, section body, tail) as parsed templates, or None if
+    there is no such section. Rendering the head, then the body once
+    for each item (with the item on top of the context), then the tail
+    gives the same text as rendering the whole template.
+    """
+    tree = parsed._parse_tree
+    for n, node in enumerate(tree):
+        ## Not public pystache API, but stable across its releases.
+        if isinstance(node, pystache.parser._SectionNode) and node.key == key:
+            head = pystache.parsed.ParsedTemplate()
+            for part in tree[:n]:
+                head.add(part)
+            tail = pystache.parsed.ParsedTemplate()
+            for part in tree[n+1:]:
+                tail.add(part)
+            return head, node.parsed, tail
+    return None
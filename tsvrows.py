@@ -0,0 +1,56 @@
+####
+#### A shared, streaming reader for the TSV exports of the textbook
+#### spreadsheet.
+####
+#### Rows are read lazily and yielded with their (1-based) line
+#### numbers; the header line and completely empty lines are skipped,
+#### and lines with the wrong number of columns are errors.
+####
+#### Example usage:
+####  import tsvrows
+####  for i, line in tsvrows.read_rows('/tmp/list.tsv', 10):
+####      ...
+####
+
+import csv
+import stagelog
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('tsvrows')
+
+class MalformedRowError(ValueError):
+    """ A TSV line that does not have the required number of columns. """
+
+    def __init__(self, row, line):
+        self.row = row
+        self.line = line
+        super().__init__('malformed line: '+ str(row) +' '+ '\t'.join(line))
+
+def empty_line_p(line):
+    """ Whether every field of the (non-blank) line is empty. """
+    return len(set(line)) == 1 and line[0] == ""
+
+def read_rows(tsv_filename, required_total_columns, logger=None, malformed=None):
+    """ Yield (row number, line) for every data line of the TSV.
+
+    Lines with the wrong number of columns raise a MalformedRowError,
+    or, given a malformed list, are added to it and skipped.
+    """
+
+    logger = logger or LOGGER
+    with open(tsv_filename, 'r') as tsv_in:
+        tsv_in = csv.reader(tsv_in, delimiter='\t')
+
+        ## Skip the header line.
+        next(tsv_in, None)
+
+        for i, line in enumerate(tsv_in, start=2):
+            if empty_line_p(line):
+                logger.info("Skipping completely empty line: %d", i, row=i)
+                continue
+            elif not len(line) == required_total_columns:
+                if malformed is None:
+                    raise MalformedRowError(i, line)
+                malformed.append(MalformedRowError(i, line))
+                continue
+            yield i, line
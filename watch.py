@@ -0,0 +1,276 @@
+####
+#### Watch the TSVs and templates and rebuild outputs when they change.
+####
+#### The kanjialive lookup, the parsed templates and the last parsed
+#### and binned data are kept in memory. When a TSV changes, only the
+#### pipelines that read it are re-parsed, re-binned and re-rendered;
+#### when a template changes, only the outputs that use it are
+#### re-rendered, from the data already in memory. Chapters are
+#### rendered incrementally, so unchanged chapter files are left alone.
+#### With the kanji details, the stroke image directory is watched too:
+#### adding, removing or renaming a stroke image re-parses them.
+####
+#### A failed rebuild (say, a half-edited TSV) is reported and the
+#### watch carries on with the next change.
+####
+#### Example usage to analyze the usual suspects:
+####  python3 watch.py --help
+####
+#### Watch all three TSVs, writing everything under /tmp/out:
+####  python3 watch.py --vocab-tsv /tmp/vocab-list.tsv --kanji-list-tsv /tmp/kanji-list.tsv --kanji-details-tsv /tmp/kanji-details.tsv --output /tmp/out
+####
+#### Watch the vocab list only, with the word glossary template:
+####  python3 watch.py --vocab-tsv /tmp/vocab-list.tsv --template vocab-glossary=word-glossary.template.html --output /tmp/out
+####
+
+import sys
+import argparse
+import logging
+import stagelog
+import pipeline
+import kaindex
+import strokes
+import os
+import time
+
+## Logger basic setup.
+LOGGER = stagelog.get_logger('watch')
+
+## What each pipeline renders, by default, as:
+##  name: (template, output under the output directory)
+DEFAULT_TARGETS = {
+    "vocab-list": ("word-html-vocab-list.template.html", "vocab-list-chapter"),
+    "vocab-glossary": ("manual-glossary.template.html", "glossary.html"),
+    "kanji-list": ("manual-html-kanji-list.template.html", "kanji-list-chapter"),
+    "kanji-details": ("manual-html-kanji-details.template.html", "kanji-details-chapter"),
+}
+
+def die_screaming(string):
+    """ Die and take our toys home. """
+    LOGGER.error(string)
+    sys.exit(1)
+
+def file_signature(filename):
+    """ What we compare to see if a file changed, or None if missing. """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def describe_failure(e):
+    """ Stages die_screaming() their own reasons; say what else went wrong. """
+    if isinstance(e, SystemExit):
+        return ''
+    return ' (' + type(e).__name__ + ': ' + str(e) + ')'
+
+class Watcher(object):
+    """ Keeps the watched pipelines' data in memory and rebuilds on change. """
+
+    def __init__(self, tsvs, targets, repo, template_cache=None, jobs=1):
+        ## tsvs: parse stage -> TSV; targets: pipeline -> (template, output)
+        self.tsvs = tsvs
+        self.targets = targets
+        self.repo = repo
+        self.template_cache = template_cache
+        self.jobs = jobs
+        self.parsed = {}
+        self.binned = {}
+        self.seen = {}
+        self.pending = {}
+        self.kanjialive_lookup = None
+        self.stroke_manifest = None
+        self.strokes_dir = repo + '/kanjialive/kanji_strokes/'
+
+    def watched_files(self):
+        """ The TSVs, templates and stroke image directory that we care about. """
+        files = list(self.tsvs.values())
+        for template_filename, output in self.targets.values():
+            if template_filename not in files:
+                files.append(template_filename)
+        ## A directory's signature changes as its entries do.
+        if "parse-kanji-details" in self.tsvs:
+            files.append(self.strokes_dir)
+        return files
+
+    def changes(self):
+        """ Return the files that changed and have since settled.
+
+        A change is only acted on once the file looks the same on two
+        polls in a row, so that we do not read half-written files.
+        """
+        changed = []
+        for filename in self.watched_files():
+            signature = file_signature(filename)
+            if signature is None or signature == self.seen.get(filename):
+                self.pending.pop(filename, None)
+            elif self.pending.get(filename) == signature:
+                del self.pending[filename]
+                self.seen[filename] = signature
+                changed.append(filename)
+            else:
+                self.pending[filename] = signature
+        return changed
+
+    def parse(self, parse_name):
+        """ (Re)parse a stage's TSV into memory. """
+        stage = pipeline.load_stage(parse_name)
+        rows = stage.read_rows(self.tsvs[parse_name])
+        if parse_name == "parse-kanji-details":
+            if self.kanjialive_lookup is None:
+                self.kanjialive_lookup = kaindex.load_index(self.repo + '/kanjialive/ka_data.csv')
+            if self.stroke_manifest is None:
+                self.stroke_manifest = strokes.stroke_manifest(self.strokes_dir)
+            self.parsed[parse_name] = list(stage.parse_rows(rows, self.repo, self.kanjialive_lookup, self.stroke_manifest))
+        else:
+            self.parsed[parse_name] = list(stage.parse_rows(rows))
+
+    def render(self, name):
+        """ Render a pipeline's output from its binned data. """
+        parse_name, bin_name, pattern, apply_name = pipeline.PIPELINES[name]
+        template_filename, output = self.targets[name]
+        if apply_name == "apply-to-chapters":
+            pipeline.load_stage(apply_name).apply_template(self.binned[name], template_filename, output,
+                                                           self.template_cache, self.jobs, incremental=True)
+        else:
+            pipeline.load_stage(apply_name).apply_template(self.binned[name], template_filename, output,
+                                                           self.template_cache)
+
+    def rebuild(self, changed):
+        """ Re-run only the stages affected by the changed files. """
+
+        ## Parse each changed TSV once, even if several pipelines
+        ## share it; the kanji details again if their strokes changed.
+        if self.strokes_dir in changed:
+            self.stroke_manifest = None
+        reparsed = []
+        for parse_name, tsv_filename in self.tsvs.items():
+            if tsv_filename in changed or \
+               (parse_name == "parse-kanji-details" and self.strokes_dir in changed):
+                start = time.perf_counter()
+                try:
+                    self.parse(parse_name)
+                except (SystemExit, Exception) as e:
+                    self.parsed.pop(parse_name, None)
+                    LOGGER.error('%s failed on %s%s; waiting for the next change', parse_name, tsv_filename, describe_failure(e))
+                    continue
+                reparsed.append(parse_name)
+                print('Parsed ' + tsv_filename + ' in ' + ('%.2f' % (time.perf_counter() - start)) + 's')
+
+        for name, (template_filename, output) in self.targets.items():
+            parse_name, bin_name, pattern, apply_name = pipeline.PIPELINES[name]
+            if parse_name not in self.parsed:
+                continue
+            if parse_name not in reparsed and template_filename not in changed:
+                continue
+            start = time.perf_counter()
+            try:
+                if parse_name in reparsed or name not in self.binned:
+                    self.binned[name] = pipeline.load_stage(bin_name).bin_data(self.parsed[parse_name], pattern)
+                self.render(name)
+            except (SystemExit, Exception) as e:
+                self.binned.pop(name, None)
+                LOGGER.error('%s failed%s; waiting for the next change', name, describe_failure(e))
+                continue
+            print('Rebuilt ' + name + ' (' + output + ') in ' + ('%.2f' % (time.perf_counter() - start)) + 's')
+
+    def watch(self, interval=0.2):
+        """ Build everything once, then poll for changes forever. """
+        for filename in self.watched_files():
+            self.seen[filename] = file_signature(filename)
+        self.rebuild(self.watched_files())
+        print('Watching ' + str(len(self.watched_files())) + ' files; ^C to stop')
+        while True:
+            time.sleep(interval)
+            changed = self.changes()
+            if changed:
+                LOGGER.info('Changed: %s', ', '.join(changed))
+                self.rebuild(changed)
+
+def main():
+
+    ## Deal with incoming.
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='More verbose output')
+    parser.add_argument('--vocab-tsv',
+                        help='[optional] The vocab list TSV to watch (vocab-list and vocab-glossary)')
+    parser.add_argument('--kanji-list-tsv',
+                        help='[optional] The kanji list TSV to watch (kanji-list)')
+    parser.add_argument('--kanji-details-tsv',
+                        help='[optional] The kanji details TSV to watch (kanji-details)')
+    parser.add_argument('-r', '--repo',
+                        help='[optional] The path to this repo')
+    parser.add_argument('-m', '--template', action='append', default=[],
+                        help='[optional] Use another template for a pipeline, as PIPELINE=TEMPLATE; may be repeated')
+    parser.add_argument('-c', '--template-cache',
+                        help='[optional] A directory to cache parsed templates in')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='[optional] The number of chapters to render in parallel')
+    parser.add_argument('-i', '--interval', type=float, default=0.2,
+                        help='[optional] Seconds between checks for changes (default 0.2)')
+    parser.add_argument('--once', action='store_true',
+                        help='[optional] Build everything once and exit')
+    parser.add_argument('-o', '--output',
+                        help='The directory to write the outputs to')
+    args = parser.parse_args()
+
+    ## Up the verbosity level if we want.
+    if args.verbose:
+        LOGGER.setLevel(logging.INFO)
+        LOGGER.info('Verbose: on')
+
+    ## Ensure arguments and read in what is necessary.
+    tsvs = {}
+    if args.vocab_tsv:
+        tsvs["parse-vocab-list"] = args.vocab_tsv
+    if args.kanji_list_tsv:
+        tsvs["parse-kanji-list"] = args.kanji_list_tsv
+    if args.kanji_details_tsv:
+        tsvs["parse-kanji-details"] = args.kanji_details_tsv
+    if not tsvs:
+        die_screaming('need at least one tsv argument to watch')
+    for tsv_filename in tsvs.values():
+        LOGGER.info('Will watch "%s" as data', tsv_filename)
+    if not args.output:
+        die_screaming('need an output directory argument')
+    os.makedirs(args.output, exist_ok=True)
+    LOGGER.info('Will output to: %s', args.output)
+    if not args.repo:
+        args.repo = os.getcwd()
+
+    templates = {}
+    for override in args.template:
+        name, sep, template_filename = override.partition('=')
+        if not sep or name not in DEFAULT_TARGETS:
+            die_screaming('template argument should be PIPELINE=TEMPLATE, with PIPELINE one of: ' + ', '.join(DEFAULT_TARGETS.keys()))
+        templates[name] = template_filename
+
+    ## Only the pipelines fed by a watched TSV.
+    targets = {}
+    for name, (template_filename, output) in DEFAULT_TARGETS.items():
+        if pipeline.PIPELINES[name][0] in tsvs:
+            targets[name] = (templates.get(name, template_filename), os.path.join(args.output, output))
+            LOGGER.info('Will render %s with %s to: %s', name, targets[name][0], targets[name][1])
+
+    ## Stages share our verbosity.
+    if args.verbose:
+        for name in targets.keys():
+            parse_name, bin_name, pattern, apply_name = pipeline.PIPELINES[name]
+            for stage_name in [parse_name, bin_name, apply_name]:
+                pipeline.load_stage(stage_name).LOGGER.setLevel(logging.INFO)
+
+    watcher = Watcher(tsvs, targets, args.repo, args.template_cache, args.jobs)
+    if args.once:
+        watcher.rebuild(watcher.watched_files())
+        return
+    try:
+        watcher.watch(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+## You saw it coming...
+if __name__ == '__main__':
+    main()